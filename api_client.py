@@ -0,0 +1,166 @@
+import logging
+import re
+import time
+
+from typing import List, Optional
+from urllib.parse import quote, urlencode, urlunparse
+import requests
+
+from client import BaseClient, BlockedError, ProductItem, blocked_url_regex, parse_retry_after
+from fetch_cache import CacheEntry, FetchCache, fingerprint
+from metrics import span
+
+
+class ApiClient(BaseClient):
+    """
+    直接呼叫搜尋頁背後的 JSON API，不需要開啟瀏覽器
+    每次查詢只需要一次 HTTP round-trip
+    """
+
+    page_size = 60
+    price_unit = 100000   # API 回傳的價格單位 (1 元 = 100000)
+    sort_mapping = {
+        'ctime': 'ctime',
+        'relevancy': 'relevancy',
+        'sales': 'sales',
+        'price': 'price',
+    }
+
+    def __init__(self,
+                 api_base: Optional[str] = None,
+                 image_base: str = 'https://cf.shopee.tw/file/',
+                 timeout: float = 10,
+                 cache: Optional[FetchCache] = None,
+                 logger = logging.getLogger('api_client')):
+        super().__init__(logger)
+        self.api_base = api_base.rstrip('/') if api_base else None
+        self.image_base = image_base
+        self.timeout = timeout
+        self.cache = cache
+        self.category_regex = re.compile(r'-cat\.([0-9.]+)$')
+        self.session = self.init_session()
+
+    def init_session(self):
+        session = requests.Session()
+        session.headers.update({
+            'User-Agent': 'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/108.0 Safari/537.36',
+            'Accept': 'application/json',
+            'x-api-source': 'pc',
+            'x-shopee-language': 'zh-Hant',
+        })
+        return session
+
+    def close(self):
+        self.session.close()
+
+    def restart(self):
+        self.close()
+        self.session = self.init_session()
+
+    def build_api_params(self, url, params):
+        """將搜尋頁的 url 與參數轉成 search_items API 的參數"""
+        page = int(params.get('page', 0))
+        api_params = {
+            'by': self.sort_mapping.get(params.get('sortBy', 'ctime'), 'ctime'),
+            'order': params.get('order', 'desc'),
+            'limit': self.page_size,
+            'newest': page * self.page_size,
+            'page_type': 'search',
+            'version': 2,
+        }
+        category = self.category_regex.search(url.path)
+        if category:
+            # 分類頁: 取最後一層分類 id
+            api_params['match_id'] = category.group(1).split('.')[-1]
+            api_params['scenario'] = 'PAGE_CATEGORY'
+        elif url.path.rstrip('/').endswith('/search'):
+            api_params['scenario'] = 'PAGE_GLOBAL_SEARCH'
+        else:
+            raise ValueError(f'Unsupported url for api backend: {url.geturl()}')
+        if 'keyword' in params:
+            api_params['keyword'] = params['keyword']
+        for k in ('minPrice', 'maxPrice'):
+            if k in params:
+                api_params[{'minPrice': 'price_min', 'maxPrice': 'price_max'}[k]] = params[k]
+        return api_params
+
+    def format_price(self, basic):
+        low = basic.get('price_min') or basic.get('price') or 0
+        high = basic.get('price_max') or low
+        low, high = low // self.price_unit, high // self.price_unit
+        if low == high:
+            return f'${low:,}'
+        return f'${low:,} - ${high:,}'
+
+    def to_product_item(self, url, entry) -> Optional[ProductItem]:
+        basic = entry.get('item_basic') or entry
+        shop_id, item_id = basic.get('shopid'), basic.get('itemid')
+        if shop_id is None or item_id is None:
+            return None
+        name = basic.get('name', '')
+        # 標題可能包含 `#`、`?`、`/` 或空白，需要編碼，否則 id 會被當成 fragment / query 而連結失效
+        link = urlunparse((url.scheme, url.netloc, f"/{quote(name, safe='')}-i.{shop_id}.{item_id}", '', '', ''))
+        img = f"{self.image_base}{basic['image']}" if basic.get('image') else ''
+        return ProductItem(f'-i.{shop_id}.{item_id}', img, name, self.format_price(basic), link)
+
+    def report(self):
+        return {'cache': self.cache.report()} if self.cache else {}
+
+    def fetch(self, url, **args) -> List[ProductItem]:
+        url, params = self.build_params(url, **args)
+        api_params = self.build_api_params(url, params)
+        api_base = self.api_base or f'{url.scheme}://{url.netloc}'
+        api_url = f'{api_base}/api/v4/search/search_items'
+
+        key = f'{api_url}?{urlencode(sorted(api_params.items()))}'
+        cached = self.cache.get(key) if self.cache else None
+        headers = {'Referer': url.geturl()}
+        if cached is not None:
+            # server 支援的話，沒有變動時只會回傳 304
+            if cached.etag:
+                headers['If-None-Match'] = cached.etag
+            if cached.last_modified:
+                headers['If-Modified-Since'] = cached.last_modified
+
+        self.logger.info(f'Fetch {api_url} with {api_params} to get lastest result')
+        start = time.perf_counter()
+        with span('api_request'):
+            response = self.session.get(api_url, params=api_params, timeout=self.timeout, headers=headers)
+        fetch_cost = time.perf_counter() - start
+        if cached is not None and response.status_code == 304:
+            self.cache.hit(cached, cached.fetch_cost + cached.parse_cost - fetch_cost, not_modified=True)
+            self.logger.info(f'Not modified, reuse {len(cached.items)} items')
+            return list(cached.items)
+        if response.status_code == 429:
+            raise BlockedError(api_url, 'rate_limited', parse_retry_after(response.headers.get('Retry-After')))
+        if response.status_code == 403 or blocked_url_regex.search(response.url):
+            raise BlockedError(api_url, 'captcha', parse_retry_after(response.headers.get('Retry-After')))
+        response.raise_for_status()
+
+        digest = None
+        if self.cache is not None:
+            digest = fingerprint(response.content)
+            cached = self.cache.lookup(key, digest)
+            if cached is not None:
+                self.cache.hit(cached, cached.parse_cost)
+                self.logger.info(f'Response unchanged, reuse {len(cached.items)} items')
+                return list(cached.items)
+
+        start = time.perf_counter()
+        with span('extract'):
+            data = response.json()
+            if data.get('error'):
+                raise RuntimeError(f"Search api returned error {data.get('error')}: {data.get('error_msg')}")
+
+            info = []
+            for entry in data.get('items') or []:
+                item = self.to_product_item(url, entry)
+                if item:
+                    info.append(item)
+        if digest is not None:
+            self.cache.put(key, CacheEntry(
+                digest, info, fetch_cost, time.perf_counter() - start,
+                response.headers.get('ETag'), response.headers.get('Last-Modified'),
+            ))
+        self.logger.info(f'Loaded {len(info)} items')
+        return list(info)
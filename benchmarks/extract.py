@@ -0,0 +1,49 @@
+"""
+比較 Client 兩種取得商品資料的方式:
+- element: 每張卡片分別呼叫 find_element / get_attribute / text
+- batch: 以單一 execute_script 取得所有卡片
+
+usage: python -m benchmarks.extract --driver chromedriver --rounds 20
+"""
+import argparse
+import statistics
+import time
+
+from selenium_client import Client
+from benchmarks.server import FixtureServer
+
+
+def measure(func, rounds):
+    samples = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        result = func()
+        samples.append(time.perf_counter() - start)
+    return result, samples
+
+def main():
+    parser = argparse.ArgumentParser(description='DOM extraction micro-benchmark')
+    parser.add_argument('--driver', default='chromedriver', help='chromedriver 的路徑')
+    parser.add_argument('--rounds', type=int, default=20)
+    parser.add_argument('--fixture', default='search_page.html')
+    args = parser.parse_args()
+
+    client = Client(args.driver)
+    try:
+        with FixtureServer() as server, client.pool.checkout() as entry:
+            driver = entry.driver
+            _, items = client.load_page(driver, server.url(args.fixture))
+            element_items, element_samples = measure(lambda: [client.extract_item(item) for item in items], args.rounds)
+            batch_items, batch_samples = measure(lambda: client.extract_items(driver), args.rounds)
+            assert element_items == batch_items, 'two strategies returned different items'
+
+            print(f'{len(items)} cards, {args.rounds} rounds')
+            for name, samples in (('element', element_samples), ('batch', batch_samples)):
+                print(f'{name:>8}: median {statistics.median(samples) * 1000:8.2f} ms, '
+                      f'min {min(samples) * 1000:8.2f} ms, max {max(samples) * 1000:8.2f} ms')
+            print(f' speedup: {statistics.median(element_samples) / statistics.median(batch_samples):.1f}x')
+    finally:
+        client.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,266 @@
+"""
+以本機的 fixture server 取代蝦皮，測量 抓取 -> 去重 -> 通知 整條流程的效能
+
+usage:
+    python -m benchmarks.pipeline --targets 20 --rounds 10 --concurrency 8
+    python -m benchmarks.pipeline --save-baseline benchmarks/baseline.json
+    python -m benchmarks.pipeline --baseline benchmarks/baseline.json --threshold 0.1
+
+baseline 檔不存在時 (例如第一次在這台機器上執行)，會把這次的結果存成 baseline，之後的執行再與它比較
+baseline 與機器相關，因此不放進 repo
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+from collections import defaultdict
+from typing import Dict, List
+try:
+    import resource
+except ImportError:
+    resource = None
+
+from api_client import ApiClient
+from client import BaseClient, ProductItem
+from fetch_cache import FetchCache
+from sinks import SinkWriter, create_sink
+from planner import QueryPlanner
+from notification import Channel, NotificationDispatcher, Notifier, format_items
+from scheduler import Watcher, WatchTarget
+from store import MemorySeenStore, SqliteSeenStore
+from benchmarks.server import FixtureServer
+
+
+class StageTimer:
+
+    def __init__(self):
+        self.samples: Dict[str, List[float]] = defaultdict(list)
+
+    def record(self, stage: str, seconds: float):
+        self.samples[stage].append(seconds)
+
+    def wrap(self, stage: str, func):
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.record(stage, time.perf_counter() - start)
+        return timed
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        return {stage: summarize(samples) for stage, samples in self.samples.items()}
+
+class TimedClient(BaseClient):
+    """記錄每次 fetch 的時間"""
+
+    def __init__(self, client: BaseClient, timer: StageTimer):
+        super().__init__(client.logger)
+        self.client = client
+        self.fetch = timer.wrap('fetch', client.fetch)
+
+    def close(self):
+        self.client.close()
+
+class FormatChannel(Channel):
+    """只產生通知內容不寄出，用來測量通知格式化的時間"""
+
+    def __init__(self, timer: StageTimer):
+        super().__init__('benchmark')
+        self.format = timer.wrap('notify_format', format_items)
+
+    def send(self, receiver, items):
+        self.format(items)
+        return True
+
+def percentile(samples: List[float], p: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p))]
+
+def summarize(samples: List[float]) -> Dict[str, float]:
+    return {
+        'count': len(samples),
+        'total': sum(samples),
+        'mean': statistics.mean(samples),
+        'p50': percentile(samples, 0.5),
+        'p99': percentile(samples, 0.99),
+    }
+
+def peak_rss() -> int:
+    """目前 process 的最高 RSS (bytes)，不支援的平台回傳 0"""
+    if resource is None:
+        return 0
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS 的單位為 bytes，linux 為 KB
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+def micro_benchmarks(rounds: int = 10000) -> Dict[str, float]:
+    client = BaseClient()
+    link = 'https://shopee.tw/Apple-iPad-第9代-64GB-WiFi-台灣公司貨-i.10000000.20000000000?sp_atk=fixture'
+    items = [ProductItem(f'-i.1.{i}', '', f'Apple iPad #{i}', '$10,490', link) for i in range(60)]
+    result = {}
+    start = time.perf_counter()
+    for _ in range(rounds):
+        client.unique_link(link)
+    result['unique_link_us'] = (time.perf_counter() - start) / rounds * 1e6
+    start = time.perf_counter()
+    for _ in range(rounds // 10):
+        format_items(items)
+    result['format_60_items_us'] = (time.perf_counter() - start) / (rounds // 10) * 1e6
+    return result
+
+async def drive(watcher: Watcher, rounds: int, init_pages: int = 0):
+    watcher.semaphore = asyncio.Semaphore(watcher.concurrency)
+    watcher.init_semaphore = asyncio.Semaphore(watcher.init_parallelism)
+    if init_pages > 0:
+        await watcher.seed_all(init_pages)
+    for _ in range(rounds):
+        await asyncio.gather(*(watcher.poll(listing) for listing in watcher.listings))
+
+def run(args) -> Dict:
+    logging.basicConfig(level=logging.WARNING)
+    timer = StageTimer()
+    with FixtureServer(latency=args.latency, page_items=args.items, new_per_poll=args.new_per_poll, etag=args.etag) as server, \
+            tempfile.TemporaryDirectory() as tmp:
+        cache = FetchCache(args.cache_size) if args.cache_size > 0 else None
+        if args.backend == 'selenium':
+            # 只有 selenium 後端需要載入 selenium
+            from selenium_client import Client
+            # 靜態的搜尋結果頁，不會產生新商品
+            client = TimedClient(Client(args.driver, args.concurrency, profile=args.profile, cache=cache), timer)
+            urls = [server.url('search_page.html')] * args.targets
+        else:
+            client = TimedClient(ApiClient(cache=cache), timer)
+            # --listings 個不同的列表由所有目標輪流訂閱，參數順序不同但指向同一個列表
+            listings = args.listings or args.targets
+            urls = [server.url(f'/bench-cat.1.{i % listings}' + ('?sortBy=ctime' if i // listings % 2 else '')) for i in range(args.targets)]
+        store = SqliteSeenStore(os.path.join(tmp, 'state.db')) if args.store == 'sqlite' else MemorySeenStore()
+        notifier = Notifier([NotificationDispatcher(FormatChannel(timer), window=0)]).start()
+        sink = None
+        if args.sink != 'none':
+            cfg = {'kind': args.sink, 'filename': os.path.join(tmp, 'export.db')} if args.sink == 'sqlite' \
+                else {'kind': args.sink, 'directory': os.path.join(tmp, 'export')}
+            sink = SinkWriter([create_sink(cfg)], max_pending=args.sink_pending).start()
+        targets = [WatchTarget(url, f'user{i}@example.com', name=f'target{i}') for i, url in enumerate(urls)]
+
+        def notify(target, items):
+            notifier.submit(target.receiver, items)
+
+        planner = QueryPlanner(client.client.default_params) if args.plan else None
+        watcher = Watcher(client, store, targets, timer.wrap('notify_submit', notify),
+                          args.concurrency, args.concurrency, incremental=args.incremental, sink=sink, planner=planner)
+        watcher.collect_new_items = timer.wrap('dedup', watcher.collect_new_items)
+        watcher.poll = timer.wrap('poll', watcher.poll)
+
+        # 初始化與第一輪當作 warm-up，不計入結果
+        asyncio.run(drive(watcher, 1, init_pages=1))
+        timer.samples.clear()
+        start = time.perf_counter()
+        asyncio.run(drive(watcher, args.rounds))
+        elapsed = time.perf_counter() - start
+        notifier.stop()
+        if sink:
+            sink.stop()
+        store.close()
+        backend_report = client.client.report()
+        client.close()
+
+    polls = args.targets * args.rounds
+    fetch = timer.summary().get('fetch', {})
+    return {
+        'config': {k: v for k, v in vars(args).items() if k not in ('baseline', 'save_baseline', 'output')},
+        'polls': polls,
+        'elapsed': elapsed,
+        'polls_per_sec': polls / elapsed,
+        'fetch_p50': fetch.get('p50'),
+        'fetch_p99': fetch.get('p99'),
+        'peak_rss': peak_rss(),
+        'stages': {stage: v for stage, v in timer.summary().items() if stage != 'poll'},
+        'micro': micro_benchmarks(),
+        'backend': backend_report,
+        'sink': sink.report() if sink else None,
+        'planner': planner.report() if planner else None,
+    }
+
+def print_report(result: Dict):
+    print(f"{result['polls']} polls in {result['elapsed']:.2f}s: {result['polls_per_sec']:.1f} polls/sec")
+    print(f"fetch latency p50 {result['fetch_p50'] * 1000:.2f} ms, p99 {result['fetch_p99'] * 1000:.2f} ms")
+    print(f"peak rss {result['peak_rss'] / 1024 / 1024:.1f} MB")
+    for stage, v in result['stages'].items():
+        print(f"  {stage:>14}: total {v['total'] * 1000:9.2f} ms, mean {v['mean'] * 1000:8.3f} ms, p99 {v['p99'] * 1000:8.3f} ms ({v['count']} calls)")
+    for name, v in result['micro'].items():
+        print(f"  {name:>18}: {v:.2f}")
+    cache = result['backend'].get('cache')
+    if cache:
+        print(f"fetch cache: hit rate {cache['hit_rate']:.1%} ({cache['hits']} hits, {cache['not_modified']} not modified), "
+              f"saved {cache['saved_seconds'] * 1000:.1f} ms")
+    planner = result.get('planner')
+    if planner:
+        print(f"planner: {planner['targets']} targets -> {planner['listings']} listings, "
+              f"{planner['fetches']} fetches for {planner['deliveries']} deliveries (dedup ratio {planner['dedup_ratio']:.1%})")
+    pages = result['backend'].get('pages')
+    if pages:
+        print(f"{pages['profile']} profile: {pages['bytes_avg'] / 1024:.1f} KB, {pages['resources_avg']:.0f} resources, "
+              f"{pages['load_ms_avg']:.0f} ms per page")
+
+def check_regression(result: Dict, baseline_path: str, threshold: float) -> bool:
+    with open(baseline_path, 'r') as f:
+        baseline = json.load(f)
+    expected = baseline['polls_per_sec']
+    drop = 1 - result['polls_per_sec'] / expected
+    print(f"baseline {expected:.1f} polls/sec, current {result['polls_per_sec']:.1f} polls/sec ({-drop:+.1%})")
+    if drop > threshold:
+        print(f'REGRESSION: throughput dropped more than {threshold:.0%}')
+        return False
+    return True
+
+def build_parser(description: str = 'offline pipeline benchmark') -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument('--backend', choices=('api', 'selenium'), default='api')
+    parser.add_argument('--driver', default='chromedriver', help='chromedriver 的路徑 (selenium)')
+    parser.add_argument('--profile', choices=('default', 'lean'), default='default', help='瀏覽器設定 (selenium)')
+    parser.add_argument('--targets', type=int, default=20, help='監控目標數量')
+    parser.add_argument('--rounds', type=int, default=10, help='每個目標查詢次數')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--items', type=int, default=60, help='每頁商品數')
+    parser.add_argument('--new-per-poll', type=int, default=1, help='每次查詢新增的商品數')
+    parser.add_argument('--latency', type=float, default=0.05, help='server 回應延遲 (秒)')
+    parser.add_argument('--cache-size', type=int, default=1000, help='fetch cache 的頁數上限，0 則不使用')
+    parser.add_argument('--no-etag', dest='etag', action='store_false', help='fixture server 不回傳 ETag')
+    parser.add_argument('--store', choices=('memory', 'sqlite'), default='sqlite')
+    parser.add_argument('--no-incremental', dest='incremental', action='store_false')
+    parser.add_argument('--listings', type=int, default=0, help='目標共用的列表數量，0 則每個目標各自一個列表')
+    parser.add_argument('--no-plan', dest='plan', action='store_false', help='不合併指向同一個列表的目標')
+    parser.add_argument('--sink', choices=('none', 'jsonl', 'csv', 'sqlite', 'parquet'), default='none', help='匯出查詢到的商品')
+    parser.add_argument('--sink-pending', type=int, default=20000, help='匯出尚未寫入的資料上限')
+    return parser
+
+def main():
+    parser = build_parser()
+    parser.add_argument('--output', help='將結果寫入 json 檔')
+    parser.add_argument('--save-baseline', help='將結果存成 baseline')
+    parser.add_argument('--baseline', help='與 baseline 比較，throughput 下降超過 threshold 時回傳失敗')
+    parser.add_argument('--threshold', type=float, default=0.1)
+    args = parser.parse_args()
+
+    result = run(args)
+    print_report(result)
+    save_baseline = args.save_baseline
+    if args.baseline and not os.path.exists(args.baseline):
+        print(f'baseline {args.baseline} not found, save this run as the baseline')
+        save_baseline = args.baseline
+    for path in (args.output, save_baseline):
+        if path:
+            with open(path, 'w') as f:
+                json.dump(result, f, indent=2)
+    if args.baseline and save_baseline != args.baseline and not check_regression(result, args.baseline, args.threshold):
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,182 @@
+import copy
+import json
+import logging
+import os
+import threading
+import time
+
+from collections import deque
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+fixtures_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+
+class FixtureHandler(SimpleHTTPRequestHandler):
+    """
+    提供 fixtures 資料夾中的檔案，以及模擬的 search_items API
+    API 的商品以錄製的 search_items.json 為範本產生，每次查詢第 0 頁會多出 new_per_poll 個新商品
+    etag 為 True 時回應會帶 ETag，內容沒有變動的條件式請求回傳 304
+    max_rate 不為 0 時模擬蝦皮的限流: 最近一秒的請求超過 max_rate 次後，penalty 秒內的請求都會被擋下，
+    block 為 '429' 時回傳 429，為 'captcha' 時導向驗證頁
+    """
+
+    latency = 0
+    page_items = 60
+    new_per_poll = 1
+    etag = True
+    max_rate = 0
+    penalty = 5
+    block = '429'
+    api_path = '/api/v4/search/search_items'
+
+    def do_GET(self):
+        if self.latency:
+            time.sleep(self.latency)
+        url = urlparse(self.path)
+        if url.path.startswith('/verify/'):
+            return self.send_body(200, b'<html><body><div class="captcha">verify</div></body></html>', 'text/html')
+        if self.max_rate and not self.server.admit(self.max_rate, self.penalty):
+            return self.send_blocked(url)
+        if url.path == self.api_path:
+            return self.send_search_items(parse_qs(url.query))
+        # 忽略 query string，讓 ?page=0&sortBy=ctime 之類的參數也能對應到 fixture
+        self.path = url.path
+        super().do_GET()
+
+    def send_body(self, status, body, content_type, headers=None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_blocked(self, url):
+        if self.block == 'captcha':
+            self.send_response(302)
+            self.send_header('Location', f'/verify/captcha?from={url.path}')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        self.send_body(429, b'{"error": "too many requests"}', 'application/json', {'Retry-After': str(self.penalty)})
+
+    def send_search_items(self, query):
+        newest = int(query.get('newest', ['0'])[0])
+        limit = min(int(query.get('limit', ['60'])[0]), self.page_items)
+        key = query.get('match_id', query.get('keyword', ['']))[0]
+        head = self.server.advance(key, self.new_per_poll) if newest == 0 else self.server.head(key)
+        template = self.server.template['items']
+        items = []
+        for position in range(newest, newest + limit):
+            serial = head - position
+            if serial < 0:
+                break
+            item = copy.deepcopy(template[serial % len(template)])
+            basic = item['item_basic']
+            basic['itemid'] = item['itemid'] = 20000000000 + serial
+            basic['shopid'] = item['shopid'] = 10000000 + serial % 7
+            basic['name'] = f"{basic['name'].split('#')[0]}#{serial}"
+            items.append(item)
+        etag = f'"{key}-{head}-{newest}-{limit}"'
+        if self.etag and self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+        body = json.dumps({'error': None, 'nomore': len(items) < limit, 'items': items}).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        if self.etag:
+            self.send_header('ETag', etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logging.getLogger('fixture_server').debug(format % args)
+
+class FixtureHTTPServer(ThreadingHTTPServer):
+
+    daemon_threads = True
+
+    def __init__(self, address, handler, initial_items: int):
+        super().__init__(address, handler)
+        with open(os.path.join(fixtures_dir, 'search_items.json'), 'r', encoding='utf-8') as f:
+            self.template = json.load(f)
+        self.initial_items = initial_items
+        self.heads = {}
+        self.lock = threading.Lock()
+        self.requests = deque()
+        self.blocked_until = 0.0
+        self.blocked = 0
+
+    def admit(self, max_rate: float, penalty: float) -> bool:
+        """最近一秒的請求超過 max_rate 次時，penalty 秒內都不接受請求"""
+        now = time.monotonic()
+        with self.lock:
+            if now < self.blocked_until:
+                self.blocked += 1
+                return False
+            while self.requests and self.requests[0] <= now - 1:
+                self.requests.popleft()
+            if len(self.requests) >= max_rate:
+                self.blocked_until = now + penalty
+                self.blocked += 1
+                return False
+            self.requests.append(now)
+            return True
+
+    def head(self, key):
+        with self.lock:
+            return self.heads.setdefault(key, self.initial_items)
+
+    def advance(self, key, count):
+        with self.lock:
+            self.heads[key] = self.heads.get(key, self.initial_items) + count
+            return self.heads[key]
+
+class FixtureServer:
+    """在本機背景執行的 HTTP server，提供 fixtures 與模擬的搜尋 API"""
+
+    def __init__(self,
+                 directory: str = fixtures_dir,
+                 latency: float = 0,
+                 page_items: int = 60,
+                 new_per_poll: int = 1,
+                 initial_items: int = 1000,
+                 etag: bool = True,
+                 max_rate: float = 0,
+                 penalty: float = 5,
+                 block: str = '429',
+                 host: str = '127.0.0.1',
+                 port: int = 0):
+        handler = type('Handler', (FixtureHandler,), {
+            'latency': latency,
+            'page_items': page_items,
+            'new_per_poll': new_per_poll,
+            'etag': etag,
+            'max_rate': max_rate,
+            'penalty': penalty,
+            'block': block,
+        })
+        self.httpd = FixtureHTTPServer((host, port), partial(handler, directory=directory), initial_items)
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def base_url(self):
+        host, port = self.httpd.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def url(self, path: str):
+        return f"{self.base_url}/{path.lstrip('/')}"
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
@@ -0,0 +1,41 @@
+"""
+測量匯出 (sink) 對整條流程 throughput 的影響，超過 budget 時回傳失敗
+
+usage:
+    python -m benchmarks.sinks --sink jsonl --repeat 3 --budget 0.05
+    python -m benchmarks.sinks --sink sqlite --new-per-poll 60
+"""
+import statistics
+import sys
+
+from copy import copy
+from benchmarks.pipeline import build_parser, run
+
+
+def main():
+    parser = build_parser('sink overhead benchmark')
+    parser.set_defaults(sink='jsonl')
+    parser.add_argument('--repeat', type=int, default=3, help='交替執行的次數，取中位數')
+    parser.add_argument('--budget', type=float, default=0.05, help='可接受的 throughput 下降比例')
+    args = parser.parse_args()
+
+    baseline_args = copy(args)
+    baseline_args.sink = 'none'
+    baseline, exported, records = [], [], 0
+    for _ in range(args.repeat):
+        # 交替執行，降低機器負載變化的影響
+        baseline.append(run(baseline_args)['polls_per_sec'])
+        result = run(args)
+        exported.append(result['polls_per_sec'])
+        records += result['sink']['written']
+
+    expected, actual = statistics.median(baseline), statistics.median(exported)
+    overhead = 1 - actual / expected
+    print(f'without sink {expected:.1f} polls/sec, with {args.sink} sink {actual:.1f} polls/sec ({-overhead:+.1%})')
+    print(f'{records} records exported in {args.repeat} runs')
+    if overhead > args.budget:
+        print(f'OVER BUDGET: throughput dropped more than {args.budget:.0%}')
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
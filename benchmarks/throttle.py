@@ -0,0 +1,87 @@
+"""
+以會限流的 fixture server 測試 RateLimiter，找出可持續的最大請求速率
+
+server 最近一秒的請求超過 --server-rate 次後，--penalty 秒內都會回傳 429 (或導向驗證頁)
+每個 --rates 各執行 --duration 秒，rate 為 0 代表不限流
+
+usage:
+    python -m benchmarks.throttle --server-rate 20 --rates 0,5,10,15,20,30
+    python -m benchmarks.throttle --block captcha --duration 5
+"""
+import argparse
+import logging
+import threading
+import time
+
+from typing import Dict
+from api_client import ApiClient
+from client import BlockedError
+from ratelimit import RateLimiter, RateLimitPolicy, Throttled, ThrottledClient
+from benchmarks.server import FixtureServer
+
+
+def run(args, rate: float) -> Dict:
+    with FixtureServer(latency=args.latency, max_rate=args.server_rate, penalty=args.penalty, block=args.block) as server:
+        client = ApiClient()
+        if rate > 0:
+            policy = RateLimitPolicy(rate=rate, burst=args.burst, backoff=args.backoff, max_backoff=args.backoff * 8,
+                                     ramp_start=args.ramp_start, ramp_step=args.ramp_step)
+            client = ThrottledClient(client, RateLimiter(policy))
+        urls = [server.url(f'/bench-cat.1.{i}') for i in range(args.targets)]
+        counts = {'ok': 0, 'blocked': 0, 'throttled': 0}
+        lock = threading.Lock()
+        deadline = time.monotonic() + args.duration
+
+        def worker(index: int):
+            while time.monotonic() < deadline:
+                url = urls[index % len(urls)]
+                index += args.threads
+                try:
+                    client.fetch(url)
+                    outcome, pause = 'ok', 0
+                except Throttled as e:
+                    outcome, pause = ('blocked' if e.__cause__ else 'throttled'), e.retry_after
+                except BlockedError:
+                    outcome, pause = 'blocked', 0
+                with lock:
+                    counts[outcome] += 1
+                if pause:
+                    time.sleep(max(0, min(pause, deadline - time.monotonic())))
+
+        threads = [threading.Thread(target=worker, args=(i,)) for i in range(args.threads)]
+        start = time.monotonic()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.monotonic() - start
+        client.close()
+        return {'rate': rate, 'elapsed': elapsed, 'ok_per_sec': counts['ok'] / elapsed,
+                'server_blocked': server.httpd.blocked, **counts}
+
+def main():
+    parser = argparse.ArgumentParser(description='rate limiter benchmark')
+    parser.add_argument('--rates', default='0,5,10,15,20,30', help='要比較的限流速率 (每秒請求數)，0 代表不限流')
+    parser.add_argument('--server-rate', type=float, default=20, help='server 每秒可接受的請求數')
+    parser.add_argument('--penalty', type=float, default=2, help='超過時 server 擋下請求的秒數')
+    parser.add_argument('--block', choices=('429', 'captcha'), default='429')
+    parser.add_argument('--duration', type=float, default=10, help='每個速率執行的秒數')
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--targets', type=int, default=20)
+    parser.add_argument('--latency', type=float, default=0.01, help='server 回應延遲 (秒)')
+    parser.add_argument('--burst', type=int, default=3)
+    parser.add_argument('--backoff', type=float, default=1)
+    parser.add_argument('--ramp-start', type=float, default=0.25)
+    parser.add_argument('--ramp-step', type=int, default=10)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.ERROR)
+
+    results = [run(args, float(rate)) for rate in args.rates.split(',')]
+    print(f"{'rate':>6} {'ok/sec':>8} {'ok':>6} {'blocked':>8} {'throttled':>10} {'server blocked':>15}")
+    for r in results:
+        print(f"{r['rate'] or 'none':>6} {r['ok_per_sec']:8.1f} {r['ok']:6d} {r['blocked']:8d} {r['throttled']:10d} {r['server_blocked']:15d}")
+    best = max(results, key=lambda r: r['ok_per_sec'])
+    print(f"best sustained throughput {best['ok_per_sec']:.1f} req/sec at rate {best['rate'] or 'none'}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+import json
+import logging
+import os
+import time
+
+from typing import Any, Callable, Dict, List, Tuple
+
+
+def atomic_write(filename: str, data: bytes):
+    """先寫入暫存檔並 fsync，再 rename 取代原檔，中途當掉也不會留下寫到一半的檔案"""
+    tmp = f'{filename}.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, filename)
+    if hasattr(os, 'O_DIRECTORY'):
+        # rename 本身也需要 fsync 所在的資料夾才算寫入
+        fd = os.open(os.path.dirname(os.path.abspath(filename)), os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+class Checkpointer:
+    """
+    定期將執行狀態 (各監控目標的排程、尚未寄出的通知) 寫入 checkpoint 檔
+    寫入前會先呼叫 on_save 註冊的函式 (例如 SeenStore.flush)，讓已通知過的 id 與 checkpoint 一起落地
+    重新啟動時以 load 還原，不需要重新初始化
+    """
+
+    version = 1
+
+    def __init__(self, filename: str, interval: float = 10, logger: logging.Logger = logging.getLogger('checkpoint')):
+        self.logger = logger
+        self.filename = filename
+        self.interval = interval
+        self.providers: Dict[str, Tuple[Callable[[], Any], Callable[[Any], None]]] = {}
+        self.savers: List[Callable[[], None]] = []
+        self.saves = 0
+
+    def register(self, name: str, snapshot: Callable[[], Any], restore: Callable[[Any], None]):
+        """snapshot 回傳可以轉成 JSON 的狀態，restore 則以該狀態還原"""
+        self.providers[name] = (snapshot, restore)
+
+    def on_save(self, func: Callable[[], None]):
+        self.savers.append(func)
+
+    def load(self) -> bool:
+        if not os.path.exists(self.filename):
+            return False
+        start = time.perf_counter()
+        try:
+            with open(self.filename, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+        except (OSError, ValueError) as e:
+            self.logger.error(f'Ignore unreadable checkpoint {self.filename}: {e!r}')
+            return False
+        if state.get('version') != self.version:
+            self.logger.warning(f'Ignore checkpoint {self.filename} with version {state.get("version")}')
+            return False
+        for name, (_, restore) in self.providers.items():
+            if name in state:
+                restore(state[name])
+        self.logger.info(f'Restore checkpoint saved at {time.ctime(state.get("saved", 0))} in {time.perf_counter() - start:.3f}s')
+        return True
+
+    def save(self):
+        start = time.perf_counter()
+        for func in self.savers:
+            func()
+        state = {'version': self.version, 'saved': time.time()}
+        for name, (snapshot, _) in self.providers.items():
+            state[name] = snapshot()
+        atomic_write(self.filename, json.dumps(state, ensure_ascii=False).encode('utf-8'))
+        self.saves += 1
+        self.logger.debug(f'Save checkpoint in {time.perf_counter() - start:.3f}s')
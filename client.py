@@ -1,17 +1,46 @@
+import json
 import logging
 import re
+import threading
 
 from dataclasses import dataclass
-from typing import List
-from urllib.parse import urlencode, urlparse, urlunparse, parse_qs
-from selenium import webdriver
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.webdriver.common.by import By
-from selenium.common.exceptions import NoSuchElementException, StaleElementReferenceException
-from selenium.webdriver.common.action_chains import ActionChains
+from typing import Callable, Dict, Iterator, List, Optional
+from urllib.parse import urlparse, parse_qs
 
 
+# 被判定為機器人時會被導向驗證頁
+blocked_url_regex = re.compile(r'/verify/(captcha|traffic)')
+
+class BlockedError(Exception):
+    """
+    被蝦皮限流 (429) 或要求驗證 (captcha)
+    不是後端本身的問題，不需要重啟 driver 或改用其他後端，應該暫停對該網站的請求
+    """
+
+    def __init__(self, url: str, reason: str, retry_after: Optional[float] = None):
+        super().__init__(f'Blocked ({reason}) when fetching {url}')
+        self.url = url
+        self.reason = reason
+        self.retry_after = retry_after
+
+    def to_error(self) -> str:
+        """轉成字串，讓 worker process 可以透過佇列回報"""
+        return 'blocked ' + json.dumps({'url': self.url, 'reason': self.reason, 'retry_after': self.retry_after})
+
+    @classmethod
+    def from_error(cls, error: Optional[str]) -> Optional['BlockedError']:
+        if not error or not error.startswith('blocked '):
+            return None
+        data = json.loads(error[len('blocked '):])
+        return cls(data['url'], data['reason'], data['retry_after'])
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Retry-After 的秒數，無法解析 (例如 HTTP 日期) 時回傳 None"""
+    try:
+        return float(value) if value else None
+    except ValueError:
+        return None
+
 @dataclass
 class ProductItem:
     id: str
@@ -19,43 +48,30 @@ class ProductItem:
     title: str
     price: str
     url: str
+    note: Optional[str] = None  # 通知時附加的說明 (例如降價、重新上架)
 
-class Client:
+class BaseClient:
+    """所有抓取後端的共同介面，子類別需實作 fetch"""
 
-    def __init__(self, driver_path, logger = logging.getLogger('client')):
+    thread_safe = True  # 是否可以在多個 thread 同時呼叫 fetch
+
+    def __init__(self, logger = logging.getLogger('client')):
         self.logger = logger
         self.regex = re.compile(r'-i\.[0-9]+\.[0-9]+')
         self.default_params = {
             'page': 0,         # page number
             'sortBy': 'ctime', # 時間排序
         }
-        self.driver_path = driver_path
-        self.driver = self.init_driver()
-    
-    def init_driver(self):
-        options = webdriver.ChromeOptions()
-        options.add_argument('--headless')
-        options.add_argument('--disable-logging')
-        options.add_argument('--log-level=3')
-        return webdriver.Chrome(self.driver_path, options=options)
-
-    def close_driver(self):
-        self.driver.quit()
-
-    def restart_driver(self):
-        self.close_driver()
-        self.driver = self.init_driver()
 
     def unique_link(self, link):
-        res = self.regex.findall(link)
-        if res and len(res) > 0:
-            self.logger.debug(f'Generated {res} by {link}')
-            return res[0]
+        res = self.regex.search(link)
+        if res:
+            return res.group(0)
         else:
             self.logger.error(f'Failed to generate unique link by {link}, use original link instead')
             return link
-    
-    def fetch(self, url, **args) -> List[ProductItem]:
+
+    def build_params(self, url, **args):
         url = urlparse(url)
         # 先取得預設值
         params = self.default_params.copy()
@@ -67,37 +83,96 @@ class Client:
                 params[k] = ','.join(v)
             else:
                 params[k] = v
-                
-        # 因為 urlencode 會將空格轉成 +，所以直接自幹
-        url = urlunparse((url.scheme, url.netloc, url.path, '', '&'.join(f'{k}={v}' for k, v in params.items()), ''))
-
-        self.driver.get(url)
-        self.logger.info(f'Fetch {url} to get lastest result')
-        main = WebDriverWait(self.driver, 30).until(EC.presence_of_element_located((By.CLASS_NAME, "shopee-search-item-result")))
-        items = WebDriverWait(self.driver, 30).until(EC.presence_of_all_elements_located((By.CLASS_NAME, "shopee-search-item-result__item")))
-        
-        # make unload items loaded
-        stale_retry = 0
-        self.logger.info(f"Load {len(items)} Items")
-        while stale_retry < 100:
-            try:
-                e = main.find_element(By.CLASS_NAME, "shopee-image-placeholder")
-                ActionChains(self.driver).move_to_element(e).perform()
-            except StaleElementReferenceException:
-                stale_retry += 1
-                continue
-            except NoSuchElementException:
-                break
-        if stale_retry >= 100: self.logger.error(f"Failed to load all items")
-
-        # get all items
-        self.logger.info(f'Loaded {len(items)} items')
-        info = []
-        for item in items:
-            link_element = item.find_element(By.XPATH, "./a[@data-sqe='link']")
-            link = link_element.get_attribute("href")
-            img = link_element.find_element(By.XPATH, ".//img").get_attribute('src')
-            title = link_element.find_element(By.XPATH, './/div[@data-sqe="name"]').text
-            price = link_element.find_element(By.XPATH, './/div[@data-sqe="name"]/following-sibling::div').text
-            info.append(ProductItem(self.unique_link(link), img, title, price, link))
-        return info
\ No newline at end of file
+        return url, params
+
+    def fetch(self, url, **args) -> List[ProductItem]:
+        raise NotImplementedError
+
+    def iter_items(self, url, **args) -> Iterator[ProductItem]:
+        """依頁面順序逐一產生商品，子類別可以覆寫成真正的延遲載入"""
+        yield from self.fetch(url, **args)
+
+    def fetch_new(self,
+                  url,
+                  is_known: Callable[[str], bool],
+                  known_run: int = 3,
+                  max_pages: int = 3,
+                  include_known: bool = False,
+                  **args) -> Iterator[ProductItem]:
+        """
+        增量抓取: 依序產生商品，連續遇到 known_run 個已知 id 時停止
+        若整頁都是新商品，則自動往下一頁抓取 (最多 max_pages 頁)
+        include_known 為 True 時也會產生停止前看到的已知商品
+        """
+        for page in range(max_pages):
+            run, count, all_new = 0, 0, True
+            for item in self.iter_items(url, page = page, **args):
+                count += 1
+                if is_known(item.id):
+                    all_new = False
+                    run += 1
+                    if include_known:
+                        yield item
+                    if run >= known_run:
+                        self.logger.debug(f'Reach {run} known items at page {page}, stop fetching')
+                        return
+                    continue
+                run = 0
+                yield item
+            if count == 0 or not all_new:
+                return
+            self.logger.info(f'Page {page} are all new items, continue to page {page + 1}')
+
+    def close(self):
+        pass
+
+    def restart(self):
+        pass
+
+    def report(self) -> Dict:
+        """回傳後端的狀態資訊 (例如 driver pool 的使用情況)"""
+        return {}
+
+class FallbackClient(BaseClient):
+    """先使用 primary 抓取，失敗時改用 fallback (第一次失敗時才建立)"""
+
+    def __init__(self, primary: BaseClient, fallback_factory, logger = logging.getLogger('client')):
+        super().__init__(logger)
+        self.primary = primary
+        self.fallback_factory = fallback_factory
+        self.fallback = None
+        self.fallback_lock = threading.Lock()
+
+    def fetch(self, url, **args) -> List[ProductItem]:
+        try:
+            return self.primary.fetch(url, **args)
+        except BlockedError:
+            # 同一個 IP 換成其他後端也一樣會被擋
+            raise
+        except Exception as e:
+            self.logger.warning(f'Primary backend failed ({e!r}), use fallback backend instead')
+            # fallback 不一定能同時使用 (例如 selenium)，因此一次只讓一個 thread 使用
+            with self.fallback_lock:
+                if self.fallback is None:
+                    self.fallback = self.fallback_factory()
+                return self.fallback.fetch(url, **args)
+
+    def close(self):
+        self.primary.close()
+        if self.fallback is not None:
+            self.fallback.close()
+
+    def restart(self):
+        self.primary.restart()
+        if self.fallback is not None:
+            self.fallback.restart()
+
+    def report(self):
+        return {'primary': self.primary.report(), 'fallback': self.fallback.report() if self.fallback else {}}
+
+def __getattr__(name):
+    # selenium 後端在 selenium_client，只有真的用到時才載入 selenium
+    if name == 'Client':
+        from selenium_client import Client
+        return Client
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,265 @@
+import json
+import logging
+import multiprocessing
+import os
+import signal
+import sqlite3
+import threading
+import time
+import uuid
+
+from dataclasses import asdict
+from typing import Callable, Dict, List, Optional, Tuple
+from client import BaseClient, BlockedError, ProductItem
+
+
+class QueueStopped(Exception):
+    """coordinator 已經停止，不再等待 worker 的結果"""
+
+class WorkQueue:
+    """
+    以 SQLite 實作的本機工作佇列，不需要額外的 broker
+    coordinator 放入 job，worker process 取得 (lease) 後執行並寫回結果
+    lease 過期 (worker 當掉) 的 job 會重新被其他 worker 取得
+    """
+
+    def __init__(self, filename: str, lease: float = 120, max_attempts: int = 3):
+        self.filename = filename
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self.local = threading.local()
+        with self.connection() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS jobs ('
+                'id INTEGER PRIMARY KEY AUTOINCREMENT, payload TEXT NOT NULL, '
+                "state TEXT NOT NULL DEFAULT 'queued', worker TEXT, leased_until REAL, "
+                'attempts INTEGER NOT NULL DEFAULT 0, result TEXT, error TEXT, created REAL NOT NULL)'
+            )
+            conn.execute('CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, id)')
+
+    def connection(self) -> sqlite3.Connection:
+        # sqlite 連線不能跨 thread 使用，每個 thread 各自建立
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.filename, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self.local.conn = conn
+        return conn
+
+    def put(self, payload: Dict) -> int:
+        cursor = self.connection().execute(
+            'INSERT INTO jobs (payload, created) VALUES (?, ?)', (json.dumps(payload), time.time())
+        )
+        return cursor.lastrowid
+
+    def claim(self, worker: str) -> Optional[Tuple[int, Dict]]:
+        conn = self.connection()
+        now = time.time()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute(
+                "SELECT id, payload, attempts FROM jobs WHERE state = 'queued' "
+                "OR (state = 'running' AND leased_until < ?) ORDER BY id LIMIT 1", (now,)
+            ).fetchone()
+            if row is None:
+                conn.execute('COMMIT')
+                return None
+            job_id, payload, attempts = row
+            if attempts >= self.max_attempts:
+                conn.execute(
+                    "UPDATE jobs SET state = 'failed', error = ? WHERE id = ?",
+                    (f'lease expired {attempts} times', job_id),
+                )
+                conn.execute('COMMIT')
+                return self.claim(worker)
+            conn.execute(
+                "UPDATE jobs SET state = 'running', worker = ?, leased_until = ?, attempts = attempts + 1 WHERE id = ?",
+                (worker, now + self.lease, job_id),
+            )
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        return job_id, json.loads(payload)
+
+    def complete(self, job_id: int, result: Dict):
+        self.connection().execute(
+            "UPDATE jobs SET state = 'done', result = ? WHERE id = ?", (json.dumps(result), job_id)
+        )
+
+    def fail(self, job_id: int, error: str):
+        self.connection().execute("UPDATE jobs SET state = 'failed', error = ? WHERE id = ?", (error, job_id))
+
+    def take_result(self, job_id: int) -> Optional[Tuple[str, Optional[Dict], Optional[str]]]:
+        """取得已完成 (或失敗) 的結果並移除 job，尚未完成時回傳 None"""
+        conn = self.connection()
+        row = conn.execute(
+            "SELECT state, result, error FROM jobs WHERE id = ? AND state IN ('done', 'failed')", (job_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        conn.execute('DELETE FROM jobs WHERE id = ?', (job_id,))
+        state, result, error = row
+        return state, json.loads(result) if result else None, error
+
+    def clear(self):
+        """移除上次執行留下的 job"""
+        self.connection().execute('DELETE FROM jobs')
+
+    def cancel(self, job_id: int):
+        self.connection().execute('DELETE FROM jobs WHERE id = ?', (job_id,))
+
+    def cancel_queued(self) -> int:
+        """移除還沒有 worker 取得的 job，回傳移除的數量"""
+        return self.connection().execute("DELETE FROM jobs WHERE state = 'queued'").rowcount
+
+    def counts(self) -> Dict[str, int]:
+        return dict(self.connection().execute('SELECT state, COUNT(*) FROM jobs GROUP BY state').fetchall())
+
+    def close(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self.local.conn = None
+
+class QueueClient(BaseClient):
+    """
+    coordinator 端的抓取後端: 將 fetch 放入 WorkQueue，等待 worker process 回傳結果
+    去重與通知都留在 coordinator，由 Watcher 處理
+    stop 之後不再等待結果，進行中的 fetch 會丟出 QueueStopped
+    """
+
+    def __init__(self,
+                 queue: WorkQueue,
+                 timeout: float = 180,
+                 poll_interval: float = 0.05,
+                 logger = logging.getLogger('queue_client')):
+        super().__init__(logger)
+        self.queue = queue
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+        self.stopped = threading.Event()
+
+    def fetch(self, url, **args) -> List[ProductItem]:
+        if self.stopped.is_set():
+            raise QueueStopped(f'Stopped before fetching {url}')
+        job_id = self.queue.put({'url': url, 'args': args})
+        deadline = time.monotonic() + self.timeout
+        delay = self.poll_interval
+        while time.monotonic() < deadline:
+            result = self.queue.take_result(job_id)
+            if result is not None:
+                state, data, error = result
+                if state == 'failed':
+                    blocked = BlockedError.from_error(error)
+                    if blocked is not None:
+                        raise blocked
+                    raise RuntimeError(f'Worker failed to fetch {url}: {error}')
+                return [ProductItem(**item) for item in data['items']]
+            if self.stopped.wait(delay):
+                self.queue.cancel(job_id)
+                raise QueueStopped(f'Stopped while waiting for a worker to fetch {url}')
+            delay = min(delay * 2, 0.5)
+        self.queue.cancel(job_id)
+        raise TimeoutError(f'No worker finished fetching {url} in {self.timeout}s')
+
+    def stop(self):
+        """停止時呼叫: 取消還在佇列中的 job，不再等待 worker 的結果"""
+        self.stopped.set()
+        cancelled = self.queue.cancel_queued()
+        self.logger.info(f'Stop waiting for workers, cancel {cancelled} queued jobs')
+
+    def report(self):
+        return {'queue': self.queue.counts()}
+
+    def close(self):
+        self.queue.close()
+
+def run_worker(queue_path: str,
+               client_factory: Callable[[], BaseClient],
+               worker_id: Optional[str] = None,
+               poll_interval: float = 0.1,
+               managed: bool = False):
+    """
+    worker process 的主程式: 不斷從佇列取得 job 並以自己的後端抓取
+    managed 為 True (由 WorkerGroup 啟動) 時忽略 SIGINT，由 coordinator 以 SIGTERM 停止
+    """
+    worker_id = worker_id or f'{os.getpid()}-{uuid.uuid4().hex[:6]}'
+    logger = logging.getLogger(f'worker.{worker_id}')
+    stopping = threading.Event()
+
+    def stop(sig, frame):
+        logger.info(f'Worker {worker_id} stopping (signal {sig})')
+        stopping.set()
+    signal.signal(signal.SIGTERM, stop)
+    # Ctrl+C 會送到同一個 process group 的所有 process，worker 自行停止的話 coordinator 會一直等到 timeout
+    signal.signal(signal.SIGINT, signal.SIG_IGN if managed else stop)
+
+    queue = WorkQueue(queue_path)
+    client = client_factory()
+    logger.info(f'Worker {worker_id} started')
+    try:
+        while not stopping.is_set():
+            job = queue.claim(worker_id)
+            if job is None:
+                stopping.wait(poll_interval)
+                continue
+            job_id, payload = job
+            try:
+                items = client.fetch(payload['url'], **payload.get('args', {}))
+            except BlockedError as e:
+                logger.warning(str(e))
+                queue.fail(job_id, e.to_error())
+                continue
+            except Exception as e:
+                logger.exception(e)
+                queue.fail(job_id, repr(e))
+                continue
+            queue.complete(job_id, {'items': [asdict(item) for item in items]})
+    finally:
+        client.close()
+        queue.close()
+        logger.info(f'Worker {worker_id} stopped')
+
+class WorkerGroup:
+    """在本機啟動多個 worker process"""
+
+    def __init__(self, queue_path: str, client_factory: Callable[[], BaseClient], size: int,
+                 logger: logging.Logger = logging.getLogger('workers')):
+        self.logger = logger
+        self.queue_path = queue_path
+        self.client_factory = client_factory
+        self.size = size
+        self.processes: List[multiprocessing.Process] = []
+
+    def start(self):
+        ctx = multiprocessing.get_context('spawn')
+        for i in range(self.size):
+            process = ctx.Process(
+                target=run_worker,
+                args=(self.queue_path, self.client_factory, f'w{i}'),
+                kwargs={'managed': True},
+                name=f'worker-{i}',
+                daemon=True,
+            )
+            process.start()
+            self.processes.append(process)
+        self.logger.info(f'Started {self.size} worker processes')
+        return self
+
+    def stop(self, timeout: float = 30):
+        for process in self.processes:
+            if process.is_alive():
+                process.terminate()
+        for process in self.processes:
+            process.join(timeout)
+
+if __name__ == '__main__':
+    # 另外啟動的 worker: python cluster.py，使用 config.yaml 的後端設定
+    from functools import partial
+    from config import load_config
+    from main import create_client
+
+    system_config = load_config().get('system')
+    run_worker(system_config.get('queue_file', 'queue.db'), partial(create_client, system_config))
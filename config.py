@@ -12,16 +12,83 @@ default_config = {
         'smtp_port': 587,                   # smtp port
         'username': 'username',             # username
         'password': 'password',             # password
+        'digest_window': 30,                # 同一收件者在幾秒內的新商品合併成一封信
+        'max_retries': 10,                  # 寄送失敗的重試次數
+        'min_interval': 0,                  # 兩封信之間至少間隔幾秒
+        'timeout': 30,                      # smtp 連線逾時 (秒)
     },
+    'webhooks': [],                         # 其他通知管道: [{name, kind (slack/discord/line/json), url, token, timeout, min_interval, max_retries, digest_window}]
     'user': {
         'init': True,                       # True: 需要初始化, False: 不需要初始化
         'url': 'https://shopee.tw/iPad-cat.11041546.11041612.11041613',
         'receiver': 'name@example.com',     # 接收通知的 email
     },
+    'targets': [],                          # 多個監控目標: [{url, receiver, interval, name, channels, filter}]，空的話使用 user 設定
+    'filters': {},                          # 過濾規則: {name: {include, exclude, regex, min_price, max_price, shops_allow, shops_deny}}
+    'adaptive': {                           # 依新商品速率自動調整查詢間隔
+        'enabled': True,
+        'min_interval': 10,                 # 最短間隔 (秒)
+        'max_interval': 600,                # 最長間隔 (秒)
+        'target_items': 10,                 # 希望每次查詢平均抓到的新商品數
+        'jitter': 0.1,                      # 隨機擾動比例
+        'backoff': 2,                       # 錯誤時的退避倍數
+        'max_depth': 10,                    # 整頁都是新商品時，下一輪最多抓取的頁數
+    },
+    'rate_limit': {                         # 所有抓取共用的限流，被限流 (429) 或要求驗證時暫停該網站
+        'enabled': True,
+        'rate': 1,                          # 每個網站每秒最多的請求數
+        'burst': 5,                         # 可以累積的請求數
+        'backoff': 30,                      # 被擋下後暫停的秒數，連續被擋下時加倍
+        'max_backoff': 1800,                # 最長暫停秒數
+        'ramp_start': 0.25,                 # 恢復後先以 rate 的這個比例請求
+        'ramp_step': 10,                    # 每成功幾次請求提高一次速率 (加倍)，直到回到 rate
+    },
+    'history': {                           # 已知商品的降價與重新上架通知
+        'enabled': True,
+        'file': 'history.bin',              # 商品價格紀錄
+        'max_items': 1000000,               # 最多記錄的商品數 (同一個商品在每個列表各算一筆)，超過時淘汰最久沒看到的商品
+        'drop_threshold': 0.1,              # 價格下降超過此比例時通知
+        'relist_after_hours': 24,           # 超過幾小時沒出現的商品再次出現時視為重新上架
+    },
+    'export': {                            # 將每次查詢到的商品匯出，供分析使用
+        'sinks': [],                        # [{kind: jsonl/csv/parquet, directory, max_bytes, max_age} 或 {kind: sqlite, filename}]
+        'batch_size': 500,                  # 累積幾筆寫入一次
+        'flush_interval': 5,                # 最多幾秒寫入一次
+        'max_pending': 20000,               # 尚未寫入的資料上限，超過時查詢會等待
+    },
     'system': {
-        'state_file': 'state.txt',           # 紀錄已經通知過的商品 id
-        'chrome_driver': 'chromedriver',     # chromedriver 的路徑
+        'state_file': 'state.txt',           # 紀錄已經通知過的商品 id (store 為 memory 時使用)
+        'store': 'sqlite',                   # 紀錄方式: sqlite 或 memory (結束時才寫入 state_file)
+        'state_db': 'state.db',              # sqlite 資料庫路徑
+        'store_batch_size': 100,             # 累積幾筆 id 才寫入資料庫
+        'store_flush_interval': 5,           # 最多幾秒寫入一次資料庫
+        'seen_ttl_days': 90,                 # id 保留天數，None 則不限制
+        'seen_max_size': 100000,             # 每個監控目標最多保留的 id 數量，None 則不限制
+        'chrome_driver': 'chromedriver',     # chromedriver 的路徑，不存在時自動下載與 Chrome 相符的版本到 driver_cache_dir
+        'driver_cache_dir': '.cache/chromedriver', # 下載的 chromedriver 與版本偵測結果
         'init_pages': 5,                     # 初始要查詢的頁數
+        'init_parallelism': 4,               # 初始查詢時同時抓取的頁數
+        'backend': 'api',                    # 抓取方式: api (直接呼叫 JSON API) 或 selenium (瀏覽器)
+        'fallback': 'selenium',              # api 失敗時改用的抓取方式，None 則不使用
+        'interval': 60,                      # 預設查詢間隔 (秒)
+        'concurrency': 4,                    # 同時進行的查詢數量上限
+        'incremental': True,                 # 監控時依序讀取，遇到連續已知商品就停止
+        'merge_targets': True,               # 指向同一個列表 (參數順序、預設參數、頁數不同) 的目標合併成一次抓取
+        'known_run': 3,                      # 連續遇到幾個已知商品時停止
+        'max_pages': 3,                      # 整頁都是新商品時最多往後抓幾頁
+        'pool_size': 1,                      # selenium 同時開啟的瀏覽器數量
+        'driver_max_failures': 3,            # 瀏覽器連續失敗幾次後重啟
+        'driver_max_page_loads': 500,        # 瀏覽器載入幾頁後重啟
+        'batch_extract': True,               # 以單一 script 取得所有商品資料
+        'profile': 'lean',                   # 瀏覽器設定: default 或 lean (不載入圖片/影音/字型/第三方網域)
+        'blocked_domains': None,             # lean 不連線的網域，None 則使用內建清單
+        'fetch_cache_size': 1000,            # 記錄上次結果的頁數，頁面沒有變動時不重新解析，0 則不使用
+        'checkpoint_file': 'checkpoint.json', # 定期寫入排程與尚未寄出的通知，重新啟動時接續，None 則不使用
+        'checkpoint_interval': 10,           # checkpoint 間隔 (秒)
+        'workers': 0,                        # worker process 數量，0 則在同一個 process 中抓取
+        'queue_file': 'queue.db',            # coordinator 與 worker 之間的工作佇列
+        'metrics_port': None,                # 提供 http://127.0.0.1:<port>/metrics，None 則不啟用
+        'trace_file': None,                  # 每次查詢各階段耗時的 JSON Lines 檔，None 則不記錄
     }
 }
 
@@ -0,0 +1,235 @@
+import logging
+import os
+import queue
+import threading
+import time
+
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional
+from client import BlockedError
+from metrics import registry
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+
+def process_tree_rss(pid: int) -> Optional[int]:
+    """回傳 pid 及其所有子程序的 RSS (bytes)，無法取得時回傳 None"""
+    if psutil is not None:
+        try:
+            proc = psutil.Process(pid)
+            return sum(p.memory_info().rss for p in [proc] + proc.children(recursive=True))
+        except psutil.Error:
+            return None
+    # 沒有 psutil 的話只支援 linux 的 /proc
+    if not os.path.isdir('/proc'):
+        return None
+    children: Dict[int, List[int]] = {}
+    rss: Dict[int, int] = {}
+    for name in os.listdir('/proc'):
+        if not name.isdigit():
+            continue
+        try:
+            with open(f'/proc/{name}/status', 'r') as f:
+                status = dict(line.split(':', 1) for line in f if ':' in line)
+        except OSError:
+            continue
+        children.setdefault(int(status.get('PPid', '0').strip()), []).append(int(name))
+        if 'VmRSS' in status:
+            rss[int(name)] = int(status['VmRSS'].split()[0]) * 1024
+    if pid not in rss:
+        return None
+    total, stack = 0, [pid]
+    while stack:
+        p = stack.pop()
+        total += rss.get(p, 0)
+        stack.extend(children.get(p, []))
+    return total
+
+@dataclass
+class PooledDriver:
+    id: int
+    driver: object
+    created: float = field(default_factory=time.time)
+    page_loads: int = 0
+    failures: int = 0   # 連續失敗次數
+
+    @property
+    def pid(self) -> Optional[int]:
+        service = getattr(self.driver, 'service', None)
+        process = getattr(service, 'process', None)
+        return getattr(process, 'pid', None)
+
+@dataclass
+class PoolStats:
+    checkouts: int = 0
+    checkout_wait_total: float = 0
+    checkout_wait_max: float = 0
+    recycles: int = 0
+    health_check_failures: int = 0
+
+    @property
+    def checkout_wait_avg(self):
+        return self.checkout_wait_total / self.checkouts if self.checkouts else 0
+
+class DriverPool:
+    """
+    保持 size 個已啟動的 driver，提供給同時進行的 fetch 使用
+    driver 只有在連續失敗 max_failures 次或載入超過 max_page_loads 頁時才會重啟
+    """
+
+    def __init__(self,
+                 driver_factory: Callable[[], object],
+                 size: int = 2,
+                 max_failures: int = 3,
+                 max_page_loads: int = 500,
+                 logger: logging.Logger = logging.getLogger('driver_pool')):
+        self.logger = logger
+        self.driver_factory = driver_factory
+        self.size = size
+        self.max_failures = max_failures
+        self.max_page_loads = max_page_loads
+        self.stats = PoolStats()
+        self.lock = threading.Lock()
+        self.next_id = 0
+        self.entries: Dict[int, PooledDriver] = {}
+        self.idle: 'queue.Queue[PooledDriver]' = queue.Queue()
+        self.closed = False
+        for _ in range(size):
+            self.idle.put(self.create())
+
+    def create(self) -> PooledDriver:
+        with self.lock:
+            self.next_id += 1
+            entry_id = self.next_id
+        entry = PooledDriver(entry_id, self.driver_factory())
+        with self.lock:
+            self.entries[entry.id] = entry
+        self.logger.info(f'Driver {entry.id} started')
+        return entry
+
+    def placeholder(self) -> PooledDriver:
+        """driver 無法啟動時放回 idle 的空位，下次 checkout 時再重新建立，pool 不會因此變小"""
+        return PooledDriver(0, None)
+
+    def destroy(self, entry: PooledDriver):
+        with self.lock:
+            self.entries.pop(entry.id, None)
+        if entry.driver is None:
+            return
+        try:
+            entry.driver.quit()
+        except Exception as e:
+            self.logger.warning(f'Failed to quit driver {entry.id}: {e!r}')
+
+    def recycle(self, entry: PooledDriver) -> PooledDriver:
+        self.logger.info(f'Recycle driver {entry.id} (page loads: {entry.page_loads}, failures: {entry.failures})')
+        self.stats.recycles += 1
+        registry.inc('driver_restarts_total')
+        self.destroy(entry)
+        return self.create()
+
+    def is_healthy(self, entry: PooledDriver) -> bool:
+        try:
+            return entry.driver.execute_script('return 1') == 1
+        except Exception:
+            self.stats.health_check_failures += 1
+            return False
+
+    def acquire(self, timeout: Optional[float] = None) -> PooledDriver:
+        if self.closed:
+            raise RuntimeError('DriverPool is closed')
+        start = time.perf_counter()
+        entry = self.idle.get(timeout=timeout)
+        wait = time.perf_counter() - start
+        self.stats.checkouts += 1
+        self.stats.checkout_wait_total += wait
+        self.stats.checkout_wait_max = max(self.stats.checkout_wait_max, wait)
+        registry.observe('driver_checkout_seconds', wait)
+        try:
+            if entry.driver is None:
+                entry = self.create()
+            elif not self.is_healthy(entry):
+                self.logger.warning(f'Driver {entry.id} failed health check')
+                entry = self.recycle(entry)
+        except Exception:
+            # 舊的 driver 已經關閉，放回空位讓之後的 checkout 重試
+            self.idle.put(self.placeholder())
+            raise
+        return entry
+
+    def release(self, entry: PooledDriver, failed: bool = False):
+        entry.page_loads += 1
+        entry.failures = entry.failures + 1 if failed else 0
+        if self.closed:
+            self.destroy(entry)
+            return
+        if entry.failures >= self.max_failures or entry.page_loads >= self.max_page_loads:
+            try:
+                entry = self.recycle(entry)
+            except Exception as e:
+                # 原本的 driver 已經關閉，放回空位，下次 checkout 時再重新建立
+                self.logger.exception(e)
+                entry = self.placeholder()
+        self.idle.put(entry)
+
+    @contextmanager
+    def checkout(self, timeout: Optional[float] = None):
+        entry = self.acquire(timeout)
+        failed = True
+        try:
+            yield entry
+            failed = False
+        except (GeneratorExit, BlockedError):
+            # 在 generator 中使用時，提早結束迭代不算失敗；被網站擋下也不是 driver 的問題
+            failed = False
+            raise
+        finally:
+            self.release(entry, failed)
+
+    def recycle_all(self):
+        """重啟所有閒置中的 driver"""
+        for _ in range(self.idle.qsize()):
+            try:
+                entry = self.idle.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                entry = self.recycle(entry)
+            except Exception as e:
+                self.logger.exception(e)
+                entry = self.placeholder()
+            self.idle.put(entry)
+
+    def memory_usage(self) -> Dict[int, Optional[int]]:
+        with self.lock:
+            entries = list(self.entries.values())
+        return {entry.id: process_tree_rss(entry.pid) if entry.pid else None for entry in entries}
+
+    def report(self) -> Dict:
+        with self.lock:
+            entries = list(self.entries.values())
+        return {
+            'size': self.size,
+            'idle': self.idle.qsize(),
+            'checkouts': self.stats.checkouts,
+            'checkout_wait_avg': self.stats.checkout_wait_avg,
+            'checkout_wait_max': self.stats.checkout_wait_max,
+            'recycles': self.stats.recycles,
+            'health_check_failures': self.stats.health_check_failures,
+            'drivers': [
+                {'id': e.id, 'page_loads': e.page_loads, 'failures': e.failures, 'age': time.time() - e.created}
+                for e in entries
+            ],
+            'memory': self.memory_usage(),
+        }
+
+    def close(self):
+        self.closed = True
+        while True:
+            try:
+                self.destroy(self.idle.get_nowait())
+            except queue.Empty:
+                break
@@ -0,0 +1,89 @@
+import hashlib
+import threading
+
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Dict, List, Optional
+from metrics import registry
+if TYPE_CHECKING:
+    from client import ProductItem
+
+
+def fingerprint(data: bytes) -> str:
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+def items_fingerprint(items: List['ProductItem']) -> str:
+    """依序的商品 id 與價格"""
+    return fingerprint('\n'.join(f'{item.id},{item.price}' for item in items).encode('utf-8'))
+
+@dataclass
+class CacheEntry:
+    fingerprint: str
+    items: List['ProductItem']
+    fetch_cost: float                   # 上次下載的時間
+    parse_cost: float                   # 上次解析 (抽取商品) 的時間
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+
+class FetchCache:
+    """
+    以頁面 (url + 參數) 為 key 記錄上次的 fingerprint 與解析結果，LRU 淘汰
+    fingerprint 相同 (或 server 回傳 304) 時直接使用上次的結果，不需要重新解析
+    多個後端與監控目標可以共用同一個 cache
+    """
+
+    def __init__(self, max_entries: int = 1000):
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.entries: 'OrderedDict[str, CacheEntry]' = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+        self.saved_seconds = 0.0
+
+    def get(self, key: str) -> Optional[CacheEntry]:
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+            return entry
+
+    def put(self, key: str, entry: CacheEntry):
+        with self.lock:
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def lookup(self, key: str, digest: str) -> Optional[CacheEntry]:
+        """fingerprint 與上次相同時回傳 entry，否則記錄為未命中 (命中時由呼叫端以 hit 記錄省下的時間)"""
+        entry = self.get(key)
+        if entry is not None and entry.fingerprint == digest:
+            return entry
+        self.miss()
+        return None
+
+    def hit(self, entry: CacheEntry, saved: float, not_modified: bool = False):
+        with self.lock:
+            self.hits += 1
+            self.not_modified += not_modified
+            self.saved_seconds += max(saved, 0)
+        registry.inc('fetch_cache_hits_total', not_modified=not_modified)
+        registry.inc('fetch_cache_saved_seconds_total', max(saved, 0))
+
+    def miss(self):
+        with self.lock:
+            self.misses += 1
+        registry.inc('fetch_cache_misses_total')
+
+    def report(self) -> Dict:
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self.entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'not_modified': self.not_modified,
+                'hit_rate': self.hits / lookups if lookups else 0,
+                'saved_seconds': self.saved_seconds,
+            }
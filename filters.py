@@ -0,0 +1,147 @@
+import logging
+import re
+
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional, Set, Union
+from client import ProductItem
+from history import parse_item_id, parse_price_range
+
+
+@dataclass
+class Rule:
+    """
+    單一過濾規則，所有條件都成立才會通知
+    include 為空代表不限關鍵字；價格以元為單位，商品價格為區間時與規則的區間有重疊即可
+    """
+    name: str
+    include: List[str] = field(default_factory=list)    # 標題包含任一關鍵字 (不分大小寫)
+    exclude: List[str] = field(default_factory=list)    # 標題包含任一關鍵字則排除
+    regex: Optional[str] = None                         # 標題需符合的正規表示式
+    min_price: Optional[float] = None
+    max_price: Optional[float] = None
+    shops_allow: List[int] = field(default_factory=list)
+    shops_deny: List[int] = field(default_factory=list)
+
+    @classmethod
+    def from_config(cls, name: str, cfg: Dict):
+        def as_list(value):
+            if value is None:
+                return []
+            return [value] if isinstance(value, (str, int)) else list(value)
+        return cls(
+            name,
+            [k.lower() for k in as_list(cfg.get('include'))],
+            [k.lower() for k in as_list(cfg.get('exclude'))],
+            cfg.get('regex'),
+            cfg.get('min_price'),
+            cfg.get('max_price'),
+            [int(s) for s in as_list(cfg.get('shops_allow'))],
+            [int(s) for s in as_list(cfg.get('shops_deny'))],
+        )
+
+class CompiledRule:
+
+    __slots__ = ('name', 'include', 'exclude', 'regex', 'min_price', 'max_price', 'shops_allow', 'shops_deny')
+
+    def __init__(self, rule: Rule):
+        self.name = rule.name
+        self.include = frozenset(rule.include)
+        self.exclude = frozenset(rule.exclude)
+        self.regex = re.compile(rule.regex, re.IGNORECASE) if rule.regex else None
+        self.min_price = round(rule.min_price * 100) if rule.min_price is not None else None
+        self.max_price = round(rule.max_price * 100) if rule.max_price is not None else None
+        self.shops_allow = frozenset(rule.shops_allow)
+        self.shops_deny = frozenset(rule.shops_deny)
+
+class ItemFilter:
+    """
+    將所有規則編譯成一個 matcher
+    所有規則的關鍵字合併成一個正規表示式，每個商品標題只需要掃描一次，
+    再依命中的關鍵字找出需要檢查的規則，規則數量增加時不需要逐一比對標題
+    """
+
+    def __init__(self, rules: Iterable[Rule], logger: logging.Logger = logging.getLogger('filter')):
+        self.logger = logger
+        self.rules: Dict[str, CompiledRule] = {rule.name: CompiledRule(rule) for rule in rules}
+        keywords = set()
+        for rule in self.rules.values():
+            keywords.update(rule.include)
+            keywords.update(rule.exclude)
+        # 長的關鍵字優先，同一位置只會命中一個，較短的關鍵字以 contains 補上
+        ordered = sorted(keywords, key=len, reverse=True)
+        self.keyword_regex = re.compile('(?=(' + '|'.join(map(re.escape, ordered)) + '))') if ordered else None
+        self.contains = {k: frozenset(other for other in ordered if other in k) for k in ordered}
+        # 有 include 的規則只有在命中關鍵字時才需要檢查
+        self.by_keyword: Dict[str, List[CompiledRule]] = {}
+        self.always: List[CompiledRule] = []
+        for rule in self.rules.values():
+            if rule.include:
+                for k in rule.include:
+                    self.by_keyword.setdefault(k, []).append(rule)
+            else:
+                self.always.append(rule)
+        self.logger.info(f'Compile {len(self.rules)} rules with {len(keywords)} keywords')
+
+    @classmethod
+    def from_config(cls, cfg: Dict):
+        return cls(Rule.from_config(name, rule) for name, rule in (cfg or {}).items())
+
+    def keywords(self, title: str) -> Set[str]:
+        if self.keyword_regex is None:
+            return set()
+        found = set()
+        for k in set(self.keyword_regex.findall(title.lower())):
+            found |= self.contains[k]
+        return found
+
+    def accepts(self, rule: CompiledRule, item: ProductItem, found: Set[str], shop: Optional[int], prices) -> bool:
+        if rule.include and rule.include.isdisjoint(found):
+            return False
+        if rule.exclude and not rule.exclude.isdisjoint(found):
+            return False
+        if rule.min_price is not None or rule.max_price is not None:
+            if prices is None:
+                return False
+            if rule.min_price is not None and prices[1] < rule.min_price:
+                return False
+            if rule.max_price is not None and prices[0] > rule.max_price:
+                return False
+        if rule.shops_allow and shop not in rule.shops_allow:
+            return False
+        if rule.shops_deny and shop in rule.shops_deny:
+            return False
+        if rule.regex is not None and not rule.regex.search(item.title):
+            return False
+        return True
+
+    def match(self, item: ProductItem, names: Optional[Set[str]] = None) -> Set[str]:
+        """回傳接受此商品的規則名稱，names 可限制只檢查部分規則"""
+        found = self.keywords(item.title)
+        candidates = list(self.always)
+        seen = set()
+        for k in found:
+            for rule in self.by_keyword.get(k, ()):
+                if rule.name not in seen:
+                    seen.add(rule.name)
+                    candidates.append(rule)
+        if names is not None:
+            candidates = [rule for rule in candidates if rule.name in names]
+        if not candidates:
+            return set()
+        ids = parse_item_id(item.id)
+        shop = ids[0] if ids else None
+        prices = parse_price_range(item.price)
+        return set(rule.name for rule in candidates if self.accepts(rule, item, found, shop, prices))
+
+    def rule_names(self, names: Union[str, List[str]]) -> Set[str]:
+        """將監控目標的 filter 設定轉成規則名稱，有不存在的規則時丟出 KeyError"""
+        names = {names} if isinstance(names, str) else set(names)
+        unknown = names - self.rules.keys()
+        if unknown:
+            raise KeyError(f'Unknown filter: {", ".join(sorted(unknown))}')
+        return names
+
+    def select(self, items: List[ProductItem], names: Union[str, List[str]]) -> List[ProductItem]:
+        """只保留至少符合 names 其中一個規則的商品"""
+        names = self.rule_names(names)
+        return [item for item in items if self.match(item, names)]
@@ -0,0 +1,203 @@
+import json
+import logging
+import os
+import re
+import threading
+import time
+
+from array import array
+from dataclasses import replace
+from itertools import islice
+from typing import Dict, List, Optional, Tuple
+from checkpoint import atomic_write
+from client import ProductItem
+from metrics import registry
+
+
+price_regex = re.compile(r'[0-9][0-9,]*(?:\.[0-9]+)?')
+id_regex = re.compile(r'-i\.([0-9]+)\.([0-9]+)')
+
+def to_cents(number: str) -> int:
+    whole, _, fraction = number.replace(',', '').partition('.')
+    return int(whole) * 100 + int((fraction + '00')[:2])
+
+def parse_price_range(price: str) -> Optional[Tuple[int, int]]:
+    """將 `$1,234` 或 `$100 - $200` 轉成以分為單位的 (最低價, 最高價)，無法解析時回傳 None"""
+    numbers = price_regex.findall(price or '')
+    if not numbers:
+        return None
+    low, high = to_cents(numbers[0]), to_cents(numbers[-1])
+    return (low, high) if low <= high else (high, low)
+
+def parse_price(price: str) -> Optional[int]:
+    """價格 (分)，區間取最低價"""
+    prices = parse_price_range(price)
+    return prices[0] if prices else None
+
+def parse_item_id(item_id: str) -> Optional[Tuple[int, int]]:
+    """`-i.<shop id>.<item id>` -> (shop id, item id)"""
+    match = id_regex.search(item_id)
+    if match is None:
+        return None
+    return int(match.group(1)), int(match.group(2))
+
+def format_cents(cents: int) -> str:
+    return f'${cents // 100:,}' if cents % 100 == 0 else f'${cents / 100:,.2f}'
+
+class ItemHistory:
+    """
+    記錄每個商品最後看到的價格與時間，用來偵測降價與重新上架
+    價格依 namespace (列表) 分開記錄，同一個商品出現在多個列表時，每個列表都會各自偵測到降價
+    key 為 (namespace id << 128 | shop id << 64 | item id)，價格與時間存放在 array 中 (每個商品 20 bytes)
+    index 依最後看到的順序排列，超過 max_items 時直接淘汰最前面 (最久沒看到) 的商品，讓記憶體有上限
+
+    記憶體: 主要是 dict 索引 (entry 與 hash table 約 40 bytes) 與 key / slot 的 int 物件 (約 70 bytes)，
+    每個商品實際約 130 bytes，max_items 為一百萬時約 130 MB；需要更低的用量時請調低 max_items
+    observe / save 可能花上數百毫秒，呼叫端應在 thread 中執行
+    """
+
+    file_magic = b'SHOPHIS2'
+
+    def __init__(self,
+                 filename: Optional[str] = None,
+                 max_items: int = 1000000,
+                 drop_threshold: float = 0.1,
+                 relist_after: float = 86400,
+                 save_interval: float = 300,
+                 logger: logging.Logger = logging.getLogger('history')):
+        self.logger = logger
+        self.filename = filename
+        self.max_items = max_items
+        self.drop_threshold = drop_threshold
+        self.relist_after = relist_after
+        self.save_interval = save_interval
+        self.last_save = time.monotonic()
+        self.lock = threading.Lock()
+        self.index: Dict[int, int] = {}     # key -> slot
+        self.namespaces: Dict[str, int] = {}    # namespace -> id
+        self.price = array('q')             # 最後看到的價格 (分)，-1 表示未知
+        self.reference = array('q')         # 比較降價用的價格: 首次看到、上次通知或漲價後的價格
+        self.last_seen = array('I')         # 最後看到的時間 (epoch 秒)
+        self.free: List[int] = []
+        if filename and os.path.exists(filename):
+            self.load(filename)
+
+    def size(self) -> int:
+        return len(self.index)
+
+    def allocate(self, key: int, price: int, now: int) -> int:
+        if self.free:
+            slot = self.free.pop()
+            self.price[slot], self.reference[slot], self.last_seen[slot] = price, price, now
+        else:
+            slot = len(self.price)
+            self.price.append(price)
+            self.reference.append(price)
+            self.last_seen.append(now)
+        self.index[key] = slot
+        return slot
+
+    def evict(self):
+        """淘汰最久沒看到的 10% 商品"""
+        count = max(1, len(self.index) // 10)
+        # index 依最後看到的順序排列，不需要排序，只花 O(count) 的時間
+        evicted = list(islice(self.index, count))
+        for key in evicted:
+            self.free.append(self.index.pop(key))
+        self.logger.info(f'Evict {len(evicted)} items last seen before {time.ctime(self.last_seen[self.free[-1]])}')
+
+    def namespace_id(self, namespace: str) -> int:
+        if namespace not in self.namespaces:
+            self.namespaces[namespace] = len(self.namespaces)
+        return self.namespaces[namespace]
+
+    def observe(self, items: List[ProductItem], namespace: str = '', now: Optional[float] = None, notify: bool = True) -> List[ProductItem]:
+        """
+        記錄 namespace 這次查詢看到的商品，回傳降價或重新上架的商品 (附上 note 說明)
+        notify 為 False 時只記錄 (例如第一次看到的商品已經以新商品通知)
+        """
+        now = int(now if now is not None else time.time())
+        changed = []
+        with self.lock:
+            prefix = self.namespace_id(namespace) << 128
+            for item in items:
+                ids = parse_item_id(item.id)
+                if ids is None:
+                    continue
+                key = prefix | ids[0] << 64 | ids[1]
+                price = parse_price(item.price)
+                price = -1 if price is None else price
+                slot = self.index.pop(key, None)
+                if slot is None:
+                    if len(self.index) >= self.max_items:
+                        self.evict()
+                    self.allocate(key, price, now)
+                    continue
+                # 重新加入，移到最後 (最近看到)
+                self.index[key] = slot
+                note = None
+                reference, last_seen = self.reference[slot], self.last_seen[slot]
+                if self.relist_after and now - last_seen >= self.relist_after:
+                    note = f'重新上架 (上次出現於 {time.strftime("%Y-%m-%d", time.localtime(last_seen))})'
+                    registry.inc('relists_total')
+                if price >= 0:
+                    if reference < 0 or price > reference:
+                        self.reference[slot] = price
+                    elif price <= reference * (1 - self.drop_threshold):
+                        note = f'降價 {format_cents(reference)} -> {format_cents(price)}' + (f', {note}' if note else '')
+                        self.reference[slot] = price
+                        registry.inc('price_drops_total')
+                self.price[slot] = price
+                self.last_seen[slot] = now
+                if note and notify:
+                    changed.append(replace(item, note=note))
+        return changed
+
+    def load(self, filename: str):
+        with open(filename, 'rb') as f:
+            magic = f.read(len(self.file_magic))
+            if magic != self.file_magic:
+                self.logger.warning(f'Ignore {filename}: not a history file or saved by an older version')
+                return
+            size = array('Q')
+            size.fromfile(f, 1)
+            names = json.loads(f.read(size[0]).decode('utf-8'))
+            count = array('Q')
+            count.fromfile(f, 1)
+            namespaces, shops, items = array('I'), array('Q'), array('Q')
+            namespaces.fromfile(f, count[0])
+            shops.fromfile(f, count[0])
+            items.fromfile(f, count[0])
+            self.price.fromfile(f, count[0])
+            self.reference.fromfile(f, count[0])
+            self.last_seen.fromfile(f, count[0])
+        self.namespaces = {name: i for i, name in enumerate(names)}
+        self.index = {namespace << 128 | shop << 64 | item: slot for slot, (namespace, shop, item) in enumerate(zip(namespaces, shops, items))}
+        self.logger.info(f'Load {self.size()} items of {len(names)} namespaces from {filename}')
+
+    def save(self, filename: str):
+        mask = 0xFFFFFFFFFFFFFFFF
+        with self.lock:
+            # 只在 lock 中複製，轉換成檔案格式時不阻擋 observe
+            names = sorted(self.namespaces, key=self.namespaces.get)
+            keys, slots = list(self.index), list(self.index.values())
+            price, reference, last_seen = self.price[:], self.reference[:], self.last_seen[:]
+        namespaces = array('I', (key >> 128 for key in keys))
+        shops = array('Q', (key >> 64 & mask for key in keys))
+        items = array('Q', (key & mask for key in keys))
+        columns = [array(column.typecode, (column[slot] for slot in slots)) for column in (price, reference, last_seen)]
+        names = json.dumps(names, ensure_ascii=False).encode('utf-8')
+        data = [self.file_magic, array('Q', [len(names)]).tobytes(), names, array('Q', [len(slots)]).tobytes()]
+        data += [column.tobytes() for column in [namespaces, shops, items] + columns]
+        atomic_write(filename, b''.join(data))
+        self.last_save = time.monotonic()
+        self.logger.info(f'Save {len(slots)} items to {filename}')
+
+    def flush(self):
+        """距離上次存檔超過 save_interval 秒才寫入，避免頻繁寫入大量資料"""
+        if self.filename and time.monotonic() - self.last_save >= self.save_interval:
+            self.save(self.filename)
+
+    def close(self):
+        if self.filename:
+            self.save(self.filename)
@@ -1,14 +1,26 @@
-import logging
 import time
+started = time.perf_counter()
+
+import asyncio
+import logging
 import os
 import signal
-import sys
-import time
-from typing import List
-from client import Client, ProductItem
-from notification import GoogleEmail, DummyEmail
+from functools import partial
+from typing import List, Optional
+from checkpoint import Checkpointer
+from client import FallbackClient, ProductItem
+from cluster import QueueClient, WorkerGroup, WorkQueue
+from scheduler import AdaptivePolicy, Watcher, WatchTarget
+from fetch_cache import FetchCache
+from filters import ItemFilter
+from history import ItemHistory
+from planner import QueryPlanner
+from ratelimit import RateLimiter, RateLimitPolicy, ThrottledClient
+from metrics import MetricsServer, PhaseTimer, TraceWriter, registry
+from sinks import SinkWriter, create_sink
+from store import MemorySeenStore, SeenStore, SqliteSeenStore
+from notification import Channel, DummyEmail, EmailChannel, NotificationDispatcher, Notifier, SmtpEmail, WebhookChannel
 from config import save_config, load_config, get_default_config
-from utils import download_chrome_driver
 
 
 # logger ---
@@ -67,96 +79,301 @@ def init(config):
     update_config(user_config, 'receiver', '請輸入欲寄送通知之email: ')
 
     system_config = config.get('system')
+    update_config(system_config, 'backend', '請輸入抓取方式 (api/selenium): ')
     update_config(system_config, 'chrome_driver', '請輸入 chrome driver 位置: ')
     update_config(system_config, 'init_pages', '請輸入一開始需要查找的頁數: ', int)
 
     save_config(config)
     return config
 
-def save_id_to_file(s, filename):
-    with open(filename, 'w+') as f:
-        f.write(','.join(s))
+def load_targets(config) -> List[WatchTarget]:
+    system_config = config.get('system')
+    interval = system_config.get('interval', 60)
+    targets = [WatchTarget.from_config(cfg, interval) for cfg in config.get('targets') or []]
+    if not targets:
+        # 舊版設定只有單一 user.url
+        user_config = config.get('user')
+        targets.append(WatchTarget(user_config.get('url'), user_config.get('receiver'), interval, MemorySeenStore.default_namespace,
+                                   filter=user_config.get('filter')))
+    names = set()
+    for target in targets:
+        # 共用 namespace 的目標會互相把對方的新商品標記為已通知
+        if target.name in names:
+            raise ValueError(f'Duplicate target name: {target.name}')
+        names.add(target.name)
+    return targets
 
-def load_id_from_file(filename):
-    with open(filename, 'r') as f:
-        return set(f.read().split(','))
+def create_filter(config, targets: List[WatchTarget]) -> Optional[ItemFilter]:
+    item_filter = ItemFilter.from_config(config.get('filters'))
+    for target in targets:
+        names = [target.filter] if isinstance(target.filter, str) else target.filter or []
+        unknown = [name for name in names if name not in item_filter.rules]
+        if unknown:
+            raise ValueError(f'Target {target.name} uses unknown filter: {", ".join(unknown)}')
+    return item_filter if item_filter.rules else None
 
-def main():
-    config = load_config()
-    if not validate(config):
-        config = init(config)
+def create_dispatcher(channel: Channel, cfg) -> NotificationDispatcher:
+    return NotificationDispatcher(
+        channel,
+        window=cfg.get('digest_window', 30),
+        max_retries=cfg.get('max_retries', 10),
+        min_interval=cfg.get('min_interval', 0),
+    )
 
-    # 初始化寄信程序
+def create_notifier(config) -> Notifier:
     email_config = config.get('email')
-    username, password = email_config.get('username'), email_config.get('password')
     if email_config.get('enabled'):
-        email = GoogleEmail(username, password)
+        email = SmtpEmail(
+            email_config.get('smtp_server'),
+            email_config.get('smtp_port'),
+            email_config.get('username'),
+            email_config.get('password'),
+            email_config.get('timeout', 30),
+        )
     else:
         email = DummyEmail()
+    dispatchers = [create_dispatcher(EmailChannel(email), email_config)]
+    for cfg in config.get('webhooks') or []:
+        channel = WebhookChannel(cfg['name'], cfg.get('url'), cfg.get('kind', 'json'), cfg.get('token'), cfg.get('timeout', 10))
+        dispatchers.append(create_dispatcher(channel, cfg))
+    return Notifier(dispatchers)
+
+def create_store(system_config) -> SeenStore:
+    state_file = system_config.get('state_file')
+    if system_config.get('store', 'sqlite') != 'sqlite':
+        return MemorySeenStore(state_file)
+    ttl_days = system_config.get('seen_ttl_days')
+    store = SqliteSeenStore(
+        system_config.get('state_db', 'state.db'),
+        system_config.get('store_batch_size', 100),
+        system_config.get('store_flush_interval', 5),
+        ttl_days * 86400 if ttl_days else None,
+        system_config.get('seen_max_size'),
+    )
+    # 第一次使用 sqlite 時匯入舊版 state 檔
+    if store.size() == 0 and state_file and os.path.exists(state_file):
+        store.import_legacy(state_file)
+    return store
+
+def create_history(config) -> Optional[ItemHistory]:
+    history_config = config.get('history') or {}
+    if not history_config.get('enabled', False):
+        return None
+    return ItemHistory(
+        history_config.get('file', 'history.bin'),
+        history_config.get('max_items', 1000000),
+        history_config.get('drop_threshold', 0.1),
+        history_config.get('relist_after_hours', 24) * 3600,
+    )
+
+def create_fetch_cache(system_config) -> Optional[FetchCache]:
+    size = system_config.get('fetch_cache_size', 1000)
+    if not size:
+        return None
+    cache = FetchCache(size)
+    registry.gauge_callback('fetch_cache_hit_rate', lambda: cache.report()['hit_rate'])
+    return cache
+
+def create_sink_writer(config) -> Optional[SinkWriter]:
+    export_config = config.get('export') or {}
+    sinks = [create_sink(cfg) for cfg in export_config.get('sinks') or []]
+    if not sinks:
+        return None
+    return SinkWriter(
+        sinks,
+        export_config.get('batch_size', 500),
+        export_config.get('flush_interval', 5),
+        export_config.get('max_pending', 20000),
+    )
+
+def create_selenium_client(system_config, cache: Optional[FetchCache] = None):
+    # 只有使用 selenium 後端時才載入 selenium
+    from selenium_client import Client
+    from utils import resolve_chrome_driver
+
+    chrome_driver = resolve_chrome_driver(system_config.get('chrome_driver'), system_config.get('driver_cache_dir', '.cache/chromedriver'))
+    return Client(
+        chrome_driver,
+        system_config.get('pool_size', 1),
+        system_config.get('driver_max_failures', 3),
+        system_config.get('driver_max_page_loads', 500),
+        system_config.get('batch_extract', True),
+        system_config.get('profile', 'default'),
+        system_config.get('blocked_domains'),
+        cache,
+    )
+
+def create_api_client(system_config, cache: Optional[FetchCache] = None):
+    from api_client import ApiClient
+    return ApiClient(system_config.get('api_base'), cache=cache)
+
+def create_client(system_config):
+    cache = create_fetch_cache(system_config)
+    factories = {
+        'api': lambda: create_api_client(system_config, cache),
+        'selenium': lambda: create_selenium_client(system_config, cache),
+    }
+    backend = system_config.get('backend', 'selenium')
+    fallback = system_config.get('fallback')
+    if backend not in factories:
+        raise ValueError(f'Unknown backend: {backend}')
+    logger.info(f'Use {backend} backend' + (f' with {fallback} fallback' if fallback else ''))
+    client = factories[backend]()
+    if fallback and fallback != backend and fallback in factories:
+        client = FallbackClient(client, factories[fallback])
+    return client
+
+def create_rate_limiter(config) -> Optional[RateLimiter]:
+    policy = RateLimitPolicy.from_config(config.get('rate_limit') or {'enabled': False})
+    if not policy.enabled:
+        return None
+    limiter = RateLimiter(policy)
+    logger.info(f'Limit requests to {policy.rate}/s per host (burst {policy.burst})')
+    return limiter
+
+def main():
+    # 記錄啟動各階段的耗時
+    timer = PhaseTimer(started)
+    timer.record('imports', time.perf_counter() - started)
+    with timer.phase('config'):
+        config = load_config()
+    if not validate(config):
+        config = init(config)
+
+    # 初始化通知程序
+    with timer.phase('notifier'):
+        notifier = create_notifier(config)
 
     # 取得系統設定
     system_config = config.get('system')
-    state_file = system_config.get('state_file')
-    chrome_driver = system_config.get('chrome_driver')
     init_pages = system_config.get('init_pages')
 
     logger.info('Session start')
-    if not os.path.exists(chrome_driver):
-        dst = os.path.abspath(os.path.dirname(chrome_driver))
-        filename = os.path.basename(chrome_driver)
-        download_chrome_driver(dst, filename)
-    client = Client(chrome_driver)
+    workers = system_config.get('workers', 0)
+    worker_group = None
+    queue_client = None
+    with timer.phase('backend'):
+        if workers > 0:
+            # coordinator 模式: 由 worker process 抓取，去重與通知集中在這個 process
+            queue = WorkQueue(system_config.get('queue_file', 'queue.db'))
+            queue.clear()
+            worker_group = WorkerGroup(queue.filename, partial(create_client, system_config), workers).start()
+            client = queue_client = QueueClient(queue)
+        else:
+            client = create_client(system_config)
+        # 限流在這個 process 集中處理，worker 只負責抓取並回報是否被擋下
+        limiter = create_rate_limiter(config)
+        if limiter:
+            client = ThrottledClient(client, limiter)
 
     logger.info('Prepare data')
-    mem = load_id_from_file(state_file) if os.path.exists(state_file) else set()
-    logger.info(f'Load {len(mem)} from {state_file}')
+    with timer.phase('store'):
+        store = create_store(system_config)
+    with timer.phase('history'):
+        history = create_history(config)
+    with timer.phase('export'):
+        sink = create_sink_writer(config)
+    with timer.phase('targets'):
+        targets = load_targets(config)
+        item_filter = create_filter(config, targets)
+
+    notifier.start()
+    if sink:
+        sink.start()
+
+    # metrics
+    metrics_port = system_config.get('metrics_port')
+    metrics_server = MetricsServer(metrics_port, system_config.get('metrics_host', '127.0.0.1')).start() if metrics_port else None
+    registry.gauge_callback('seen_store_size', store.size)
+    if history:
+        registry.gauge_callback('item_history_size', history.size)
+    trace_file = system_config.get('trace_file')
+    tracer = TraceWriter(trace_file) if trace_file else None
 
-    # 註冊信號處理函式
+    checkpoint_file = system_config.get('checkpoint_file')
+    checkpointer = Checkpointer(checkpoint_file, system_config.get('checkpoint_interval', 10)) if checkpoint_file else None
+
+    planner = None
+    if system_config.get('merge_targets', True):
+        # 指向同一個列表的目標只抓取一次
+        planner = QueryPlanner(client.default_params)
+        registry.gauge_callback('planner_dedup_ratio', planner.dedup_ratio)
+
+    def shutdown():
+        # 先寄出暫存中的通知，checkpoint 只會留下寄送失敗的部分
+        notifier.stop()
+        if sink:
+            sink.stop()
+        if checkpointer:
+            checkpointer.save()
+        store.close()
+        if history:
+            history.close()
+        if planner:
+            logger.info(f'Planner report: {planner.report()}')
+        logger.info(f'Backend report: {client.report()}')
+        client.close()
+        if worker_group:
+            worker_group.stop()
+        if tracer:
+            tracer.close()
+        if metrics_server:
+            metrics_server.stop()
+
+    # 監控開始前收到 SIGTERM 視同 Ctrl+C
     def signal_handler(sig, frame):
-        logger.info(f'You pressed Ctrl+C! sigint: {sig}')
-        save_id_to_file(mem, state_file)
-        logger.info(f'Save {len(mem)} to {state_file}')
-        client.close_driver()
-        sys.exit(0)
-    signal.signal(signal.SIGINT, signal_handler)
-
-    # 抓取第一輪資料
-    user_config = config.get('user')
-    url = user_config.get('url')
-    receiver = user_config.get('receiver')
-    for page in range(init_pages):
-        logger.info(f'Fetch page {page}')
-        for item in client.fetch(url, page = page):
-            if item.id in mem:
-                continue
-            mem.add(item.id)
-            logger.info(f'Fetch New Item {item.title}, {item.price} in **initialize step**')
+        raise KeyboardInterrupt
+    signal.signal(signal.SIGTERM, signal_handler)
 
     # 開始監控
-    send_status = True
-    logger.info('Start to monitor')
-    while True:
-        try:
-            newItems: List[ProductItem] = []
-            for item in client.fetch(url, page = 0):
-                if item.id in mem:
-                    continue
-                mem.add(item.id)
-                newItems.append(item)
-                logger.info(f'Fetch New Item {item.title}, {item.price} in **monitor step**')
-            if len(newItems) > 0:
-                s = '<br>'.join([f"{i + 1}. {item.title}, {item.price}, {item.url}" for i, item in enumerate(newItems)])
-                send_status = False
-                while not send_status:
-                    send_status = email.send(receiver, [receiver], '蝦皮提醒助手', s)
-        except KeyboardInterrupt:
-            client.close_driver()
-            break
-        except Exception as e:
-            logger.exception(e)
-            logger.error('driver restart')
-            client.restart_driver()
-        time.sleep(60)
+    def notify(target: WatchTarget, newItems: List[ProductItem]):
+        notifier.submit(target.receiver, newItems, target.channels)
+
+    watcher = Watcher(
+        client, store, targets, notify,
+        max(system_config.get('concurrency', 4), workers),
+        system_config.get('init_parallelism', 4),
+        system_config.get('incremental', True),
+        system_config.get('known_run', 3),
+        system_config.get('max_pages', 3),
+        AdaptivePolicy.from_config(config.get('adaptive') or {'enabled': False}),
+        tracer,
+        history,
+        item_filter,
+        checkpointer,
+        sink,
+        planner,
+    )
+    if checkpointer:
+        checkpointer.register('targets', watcher.snapshot, watcher.restore)
+        checkpointer.register('notifications', notifier.snapshot, notifier.restore)
+        checkpointer.on_save(store.flush)
+        if history:
+            checkpointer.on_save(history.flush)
+        with timer.phase('checkpoint'):
+            checkpointer.load()
+    logger.info(f'Startup: {timer.report()}')
+
+    def stop():
+        watcher.stop()
+        if queue_client:
+            # worker 不處理 Ctrl+C，由這裡取消佇列中的 job，進行中的查詢不用等到 timeout
+            queue_client.stop()
+
+    async def serve():
+        # SIGINT / SIGTERM: 停止排程，等進行中的查詢完成後結束
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stop)
+        # 先平行抓取前 init_pages 頁作為第一輪資料 (由 checkpoint 還原的目標不需要)，再開始監控
+        await watcher.run(init_pages)
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        logger.info('Interrupted')
+    finally:
+        shutdown()
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
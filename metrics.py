@@ -0,0 +1,242 @@
+import contextvars
+import json
+import logging
+import threading
+import time
+
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional, Tuple
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+default_buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+def label_key(labels: Dict[str, str]) -> LabelKey:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+def format_labels(key: LabelKey, extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(key) + ([extra] if extra else [])
+    if not pairs:
+        return ''
+    escaped = (v.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + '}'
+
+class Histogram:
+
+    def __init__(self, buckets=default_buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.sum += value
+        self.count += 1
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+
+class Registry:
+    """
+    簡易的 Prometheus 風格 metrics (counter / gauge / histogram)
+    metric 名稱不需要事先宣告，第一次使用時建立
+    """
+
+    def __init__(self, prefix: str = 'shopee_'):
+        self.prefix = prefix
+        self.lock = threading.Lock()
+        self.counters: Dict[str, Dict[LabelKey, float]] = {}
+        self.gauges: Dict[str, Dict[LabelKey, float]] = {}
+        self.histograms: Dict[str, Dict[LabelKey, Histogram]] = {}
+        self.callbacks: Dict[str, Callable[[], float]] = {}
+        self.help: Dict[str, str] = {}
+
+    def describe(self, name: str, text: str):
+        self.help[name] = text
+
+    def inc(self, name: str, value: float = 1, **labels):
+        with self.lock:
+            series = self.counters.setdefault(name, {})
+            key = label_key(labels)
+            series[key] = series.get(key, 0) + value
+
+    def set(self, name: str, value: float, **labels):
+        with self.lock:
+            self.gauges.setdefault(name, {})[label_key(labels)] = value
+
+    def gauge_callback(self, name: str, func: Callable[[], float]):
+        """在輸出 metrics 時才呼叫 func 取得數值"""
+        with self.lock:
+            self.callbacks[name] = func
+
+    def observe(self, name: str, value: float, **labels):
+        with self.lock:
+            series = self.histograms.setdefault(name, {})
+            key = label_key(labels)
+            if key not in series:
+                series[key] = Histogram()
+            series[key].observe(value)
+
+    def counter_value(self, name: str, **labels) -> float:
+        with self.lock:
+            return self.counters.get(name, {}).get(label_key(labels), 0)
+
+    def render(self) -> str:
+        lines: List[str] = []
+
+        def header(name, kind):
+            full = self.prefix + name
+            if name in self.help:
+                lines.append(f'# HELP {full} {self.help[name]}')
+            lines.append(f'# TYPE {full} {kind}')
+            return full
+
+        with self.lock:
+            callbacks = dict(self.callbacks)
+            for name, series in sorted(self.counters.items()):
+                full = header(name, 'counter')
+                lines.extend(f'{full}{format_labels(k)} {v}' for k, v in series.items())
+            for name, series in sorted(self.gauges.items()):
+                full = header(name, 'gauge')
+                lines.extend(f'{full}{format_labels(k)} {v}' for k, v in series.items())
+            for name, series in sorted(self.histograms.items()):
+                full = header(name, 'histogram')
+                for key, h in series.items():
+                    for bound, count in zip(h.buckets, h.counts):
+                        lines.append(f'{full}_bucket{format_labels(key, ("le", str(bound)))} {count}')
+                    lines.append(f'{full}_bucket{format_labels(key, ("le", "+Inf"))} {h.count}')
+                    lines.append(f'{full}_sum{format_labels(key)} {h.sum}')
+                    lines.append(f'{full}_count{format_labels(key)} {h.count}')
+        for name, func in sorted(callbacks.items()):
+            try:
+                value = func()
+            except Exception as e:
+                logging.getLogger('metrics').warning(f'Failed to collect {name}: {e!r}')
+                continue
+            full = header(name, 'gauge')
+            lines.append(f'{full} {value}')
+        return '\n'.join(lines) + '\n'
+
+# 全域的 registry，各模組直接使用
+registry = Registry()
+
+class Trace:
+    """單次查詢的所有 span，寫入 trace 檔供離線分析"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.start = time.time()
+        self.spans: List[Dict] = []
+        self.lock = threading.Lock()
+
+    def add(self, stage: str, start: float, duration: float, labels: Dict):
+        with self.lock:
+            self.spans.append({'stage': stage, 'offset': start - self.start, 'duration': duration, **labels})
+
+    def to_dict(self) -> Dict:
+        return {'name': self.name, 'start': self.start, 'duration': time.time() - self.start, 'spans': self.spans}
+
+current_trace: contextvars.ContextVar[Optional[Trace]] = contextvars.ContextVar('current_trace', default=None)
+
+@contextmanager
+def span(stage: str, **labels):
+    """記錄區塊的耗時到 stage_seconds histogram，並加入目前的 trace"""
+    start = time.time()
+    begin = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration = time.perf_counter() - begin
+        registry.observe('stage_seconds', duration, stage=stage, **labels)
+        trace = current_trace.get()
+        if trace is not None:
+            trace.add(stage, start, duration, labels)
+
+class PhaseTimer:
+    """記錄啟動時各階段的耗時"""
+
+    def __init__(self, start: Optional[float] = None):
+        self.start = start if start is not None else time.perf_counter()
+        self.phases: List[Tuple[str, float]] = []
+
+    def record(self, name: str, duration: float):
+        self.phases.append((name, duration))
+        registry.set('startup_phase_seconds', duration, phase=name)
+
+    @contextmanager
+    def phase(self, name: str):
+        begin = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - begin)
+
+    def report(self) -> str:
+        total = time.perf_counter() - self.start
+        return ', '.join(f'{name} {duration * 1000:.0f} ms' for name, duration in self.phases) + f' (total {total * 1000:.0f} ms)'
+
+class TraceWriter:
+    """將每次查詢的 trace 以 JSON Lines 格式附加到檔案"""
+
+    def __init__(self, filename: str):
+        self.filename = filename
+        self.lock = threading.Lock()
+        self.file = open(filename, 'a', encoding='utf-8')
+
+    @contextmanager
+    def trace(self, name: str):
+        trace = Trace(name)
+        token = current_trace.set(trace)
+        try:
+            yield trace
+        finally:
+            current_trace.reset(token)
+            self.write(trace)
+
+    def write(self, trace: Trace):
+        line = json.dumps(trace.to_dict(), ensure_ascii=False)
+        with self.lock:
+            self.file.write(line + '\n')
+            self.file.flush()
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+class MetricsHandler(BaseHTTPRequestHandler):
+
+    registry: Registry = registry
+
+    def do_GET(self):
+        if self.path.split('?', 1)[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = self.registry.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logging.getLogger('metrics').debug(format % args)
+
+class MetricsServer:
+    """在背景 thread 提供 http://host:port/metrics"""
+
+    def __init__(self, port: int, host: str = '127.0.0.1', registry: Registry = registry):
+        handler = type('Handler', (MetricsHandler,), {'registry': registry})
+        self.httpd = ThreadingHTTPServer((host, port), handler)
+        self.httpd.daemon_threads = True
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name='metrics-server', daemon=True)
+
+    def start(self):
+        self.thread.start()
+        logging.getLogger('metrics').info(f'Serve metrics on http://{self.httpd.server_address[0]}:{self.httpd.server_address[1]}/metrics')
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
@@ -1,8 +1,16 @@
 import logging
 import smtplib
+import threading
+import time
 
+from collections import deque
+from dataclasses import asdict, dataclass, field
 from email.mime.text import MIMEText
 from email.header import Header
+from typing import Callable, Deque, Dict, List, Optional
+
+from client import ProductItem
+from metrics import registry, span
 
 
 class Email:
@@ -22,6 +30,9 @@ class Email:
     def send(self, sender: str, receivers: list, title: str, content: str):
         return False
 
+    def close(self):
+        pass
+
 class DummyEmail(Email):
 
     def __init__(self, logger: logging.Logger = logging.getLogger("fake_email")):
@@ -32,7 +43,76 @@ class DummyEmail(Email):
         self.logger.info(f"send status: ok. title: {title}, content: {content!s:5.5s}")
         return True
 
-class GoogleEmail(Email):
+class SmtpEmail(Email):
+    """
+    保持同一個已登入的 SMTP 連線，斷線時自動重新連線
+    伺服器支援時才會使用 STARTTLS 與登入
+    """
+
+    def __init__(self,
+                 smtp_server: str,
+                 smtp_port: int,
+                 user: str,
+                 pwd: str,
+                 timeout: float = 30,
+                 logger: logging.Logger = logging.getLogger("email")):
+        super().__init__(smtp_server, smtp_port, user, pwd, logger)
+        self.timeout = timeout
+        self.smtp: Optional[smtplib.SMTP] = None
+        self.lock = threading.Lock()
+
+    def connect(self) -> smtplib.SMTP:
+        self.logger.info(f"connect to smtp server {self.smtp_server}:{self.smtp_port}")
+        smtpObj = smtplib.SMTP(self.smtp_server, self.smtp_port, timeout=self.timeout)
+        smtpObj.ehlo()
+        if smtpObj.has_extn('starttls'):
+            smtpObj.starttls()
+            smtpObj.ehlo()
+        if self.user and smtpObj.has_extn('auth'):
+            smtpObj.login(self.user, self.pwd)
+        return smtpObj
+
+    def session(self) -> smtplib.SMTP:
+        if self.smtp is None:
+            self.smtp = self.connect()
+        return self.smtp
+
+    def close(self):
+        with self.lock:
+            self.disconnect()
+
+    def disconnect(self):
+        if self.smtp is None:
+            return
+        try:
+            self.smtp.quit()
+        except (smtplib.SMTPException, OSError):
+            self.smtp.close()
+        self.smtp = None
+
+    def send(self, sender, receivers, title, content):
+        self.logger.info(f"send email to {', '.join(receivers)} by {sender}")
+        message = MIMEText(content, 'html', 'utf-8')
+        message['From'] = Header("提醒機器人", 'utf-8')
+        message['To'] = Header("用戶", 'utf-8')
+        message['Subject'] = Header(title, "utf-8")
+        with self.lock:
+            # 連線可能已經被伺服器關閉，重新連線後再試一次
+            for attempt in range(2):
+                try:
+                    self.session().sendmail(sender, receivers, message.as_string())
+                    self.logger.info(f"send status: ok. title: {title}, content: {content!s:5.5s}")
+                    return True
+                except (smtplib.SMTPServerDisconnected, ConnectionError) as e:
+                    self.logger.warning(f"smtp connection lost: {e!r}")
+                    self.disconnect()
+                except (smtplib.SMTPException, OSError) as e:
+                    self.logger.error(f"send status: error occurred: {e}")
+                    self.disconnect()
+                    return False
+        return False
+
+class GoogleEmail(SmtpEmail):
 
     def __init__(self, username, password):
         super().__init__(
@@ -42,23 +122,317 @@ class GoogleEmail(Email):
             password
         )
 
-    def send(self, sender, receivers, title, content):
-        self.logger.info(f"send email to {', '.join(receivers)} by {sender}")
-        message = MIMEText(content, 'html', 'utf-8')
-        message['From'] = Header("提醒機器人", 'utf-8')
-        message['To'] = Header("用戶", 'utf-8')
-        message['Subject'] = Header(title, "utf-8")
+def format_item(item: ProductItem) -> str:
+    line = f"{item.title}, {item.price}, {item.url}"
+    return f"[{item.note}] {line}" if item.note else line
+
+def format_items(items: List[ProductItem]) -> str:
+    return '<br>'.join([f"{i + 1}. {format_item(item)}" for i, item in enumerate(items)])
+
+def format_items_text(items: List[ProductItem]) -> str:
+    return '\n'.join([f"{i + 1}. {format_item(item)}" for i, item in enumerate(items)])
+
+class Channel:
+    """通知管道，send 會在該管道專屬的 thread 中被呼叫"""
+
+    def __init__(self, name: str, timeout: float = 30, logger: logging.Logger = logging.getLogger("channel")):
+        self.name = name
+        self.timeout = timeout
+        self.logger = logger
+
+    def send(self, receiver: str, items: List[ProductItem]) -> bool:
+        return False
+
+    def close(self):
+        pass
+
+class EmailChannel(Channel):
+
+    def __init__(self,
+                 email: Email,
+                 name: str = 'email',
+                 title: str = '蝦皮提醒助手',
+                 formatter: Callable[[List[ProductItem]], str] = format_items,
+                 logger: logging.Logger = logging.getLogger("channel")):
+        super().__init__(name, getattr(email, 'timeout', 30), logger)
+        self.email = email
+        self.title = title
+        self.formatter = formatter
+
+    def send(self, receiver, items):
+        return self.email.send(receiver, [receiver], self.title, self.formatter(items))
+
+    def close(self):
+        self.email.close()
+
+class WebhookChannel(Channel):
+    """
+    以 HTTP POST 推送通知
+    kind: slack / discord / line (LINE Notify) / json (原始資料)
+    """
+
+    line_notify_url = 'https://notify-api.line.me/api/notify'
+
+    def __init__(self,
+                 name: str,
+                 url: Optional[str] = None,
+                 kind: str = 'json',
+                 token: Optional[str] = None,
+                 timeout: float = 10,
+                 formatter: Callable[[List[ProductItem]], str] = format_items_text,
+                 logger: logging.Logger = logging.getLogger("webhook")):
+        super().__init__(name, timeout, logger)
+        if kind not in ('slack', 'discord', 'line', 'json'):
+            raise ValueError(f'Unknown webhook kind: {kind}')
+        self.url = url or (self.line_notify_url if kind == 'line' else None)
+        if not self.url:
+            raise ValueError(f'Webhook {name} requires url')
+        self.kind = kind
+        self.token = token
+        self.formatter = formatter
+        # 只有設定 webhook 時才載入 requests
+        import requests
+        self.session = requests.Session()
+        self.request_error = requests.RequestException
+
+    def build_request(self, receiver, items) -> Dict:
+        text = self.formatter(items)
+        if self.kind == 'slack':
+            return {'json': {'text': text}}
+        if self.kind == 'discord':
+            # discord 訊息上限為 2000 字
+            return {'json': {'content': text[:2000]}}
+        if self.kind == 'line':
+            return {'data': {'message': f'\n{text}'[:1000]}, 'headers': {'Authorization': f'Bearer {self.token}'}}
+        return {'json': {'receiver': receiver, 'items': [asdict(item) for item in items]}}
+
+    def send(self, receiver, items):
+        self.logger.info(f"post {len(items)} items to {self.name}")
         try:
-            smtpObj = smtplib.SMTP(self.smtp_server, self.smtp_port)
-            smtpObj.connect(self.smtp_server, self.smtp_port)
-            smtpObj.ehlo()
-            smtpObj.starttls()
-            smtpObj.ehlo()
-            smtpObj.login(self.user, self.pwd)
-            smtpObj.sendmail(sender, receivers, message.as_string())
-            self.logger.info(f"send status: ok. title: {title}, content: {content!s:5.5s}")
-            return True
-        except smtplib.SMTPException as e:
-            self.logger.error(f"send status: error occurred: {e}")
+            response = self.session.post(self.url, timeout=self.timeout, **self.build_request(receiver, items))
+        except self.request_error as e:
+            self.logger.error(f"post status: error occurred: {e!r}")
+            return False
+        if response.status_code >= 300:
+            self.logger.error(f"post status: {response.status_code} {response.text[:200]}")
             return False
+        return True
+
+    def close(self):
+        self.session.close()
+
+@dataclass
+class Digest:
+    receiver: str
+    items: List[ProductItem]
+    due: float          # 預計寄送的時間 (time.monotonic)
+    created: float = field(default_factory=time.monotonic)
+    attempts: int = 0
+
+@dataclass
+class ChannelStats:
+    sent: int = 0
+    failed: int = 0
+    retries: int = 0
+    latencies: Deque[float] = field(default_factory=lambda: deque(maxlen=1000))  # 從收到商品到送達的時間
+    send_durations: Deque[float] = field(default_factory=lambda: deque(maxlen=1000))
+
+    def report(self) -> Dict:
+        latencies = sorted(self.latencies)
+        return {
+            'sent': self.sent,
+            'failed': self.failed,
+            'retries': self.retries,
+            'latency_p50': latencies[len(latencies) // 2] if latencies else None,
+            'latency_max': latencies[-1] if latencies else None,
+            'send_duration_avg': sum(self.send_durations) / len(self.send_durations) if self.send_durations else None,
+        }
+
+class NotificationDispatcher:
+    """
+    以獨立的 thread 透過單一 Channel 寄送通知，不會阻塞抓取流程
+    同一個收件者在 window 秒內的新商品會合併成一則通知
+    兩次寄送至少間隔 min_interval 秒；失敗時以指數退避重試，超過 max_retries 次則放棄
+    """
+
+    def __init__(self,
+                 channel: Channel,
+                 window: float = 30,
+                 max_retries: Optional[int] = 10,
+                 base_delay: float = 2,
+                 max_delay: float = 600,
+                 min_interval: float = 0,
+                 logger: logging.Logger = logging.getLogger("dispatcher")):
+        self.logger = logger
+        self.channel = channel
+        self.window = window
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.min_interval = min_interval
+        self.digests: Dict[str, Digest] = {}
+        self.sending: Optional[Digest] = None   # 正在寄送中的 digest
+        self.undelivered: List[Digest] = []     # 停止時寄送失敗的 digest，由 checkpoint 保留到下次啟動
+        self.cond = threading.Condition()
+        self.stopping = False
+        self.next_send = 0.0
+        self.stats = ChannelStats()
+        self.thread = threading.Thread(target=self.run, name=f'dispatcher-{channel.name}', daemon=True)
+
+    @property
+    def sent(self):
+        return self.stats.sent
+
+    @property
+    def failed(self):
+        return self.stats.failed
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def submit(self, receiver: str, items: List[ProductItem]):
+        with self.cond:
+            digest = self.digests.get(receiver)
+            if digest is None:
+                self.digests[receiver] = Digest(receiver, list(items), time.monotonic() + self.window)
+            else:
+                digest.items.extend(items)
+            self.cond.notify()
+
+    def pending(self) -> Dict[str, List[ProductItem]]:
+        """尚未寄出 (包含正在寄送) 的商品"""
+        with self.cond:
+            pending = {receiver: list(digest.items) for receiver, digest in self.digests.items()}
+            for digest in self.undelivered:
+                pending[digest.receiver] = digest.items + pending.get(digest.receiver, [])
+            # 寄送失敗後重新排入的 digest 已經在 digests 中
+            if self.sending is not None and self.digests.get(self.sending.receiver) is not self.sending:
+                pending[self.sending.receiver] = self.sending.items + pending.get(self.sending.receiver, [])
+            return pending
+
+    def next_due(self) -> Optional[Digest]:
+        if not self.digests:
+            return None
+        return min(self.digests.values(), key=lambda d: d.due)
+
+    def run(self):
+        while True:
+            with self.cond:
+                while True:
+                    digest = self.next_due()
+                    if digest is None and self.stopping:
+                        return
+                    # 停止時不再等待合併視窗，直接寄出 (仍遵守 min_interval)
+                    due = None if digest is None else max(self.next_send, time.monotonic() if self.stopping else digest.due)
+                    wait = None if due is None else due - time.monotonic()
+                    if wait is not None and wait <= 0:
+                        break
+                    self.cond.wait(wait)
+                # 寄送期間新進的商品會進入新的 digest
+                del self.digests[digest.receiver]
+                self.next_send = time.monotonic() + self.min_interval
+                self.sending = digest
+            try:
+                self.deliver(digest)
+            finally:
+                with self.cond:
+                    self.sending = None
+
+    def deliver(self, digest: Digest):
+        ok = False
+        start = time.monotonic()
+        try:
+            with span('notify_send', channel=self.channel.name):
+                ok = self.channel.send(digest.receiver, digest.items)
+        except Exception as e:
+            self.logger.exception(e)
+        self.stats.send_durations.append(time.monotonic() - start)
+        if ok:
+            self.stats.sent += 1
+            self.stats.latencies.append(time.monotonic() - digest.created)
+            registry.inc('notifications_sent_total', channel=self.channel.name)
+            registry.observe('notification_latency_seconds', time.monotonic() - digest.created, channel=self.channel.name)
+            return
+        digest.attempts += 1
+        registry.inc('notification_failures_total', channel=self.channel.name)
+        with self.cond:
+            if self.max_retries is not None and digest.attempts > self.max_retries:
+                self.stats.failed += 1
+                self.logger.error(f'Give up sending {len(digest.items)} items to {digest.receiver} via {self.channel.name} after {digest.attempts} attempts')
+                return
+            if self.stopping:
+                self.stats.failed += 1
+                self.undelivered.append(digest)
+                self.logger.error(f'Failed to send {len(digest.items)} items to {digest.receiver} via {self.channel.name} while stopping')
+                return
+            self.stats.retries += 1
+            delay = min(self.max_delay, self.base_delay * 2 ** (digest.attempts - 1))
+            self.logger.warning(f'Failed to send to {digest.receiver} via {self.channel.name}, retry in {delay:.1f}s')
+            # 與重試期間新進的商品合併
+            newer = self.digests.get(digest.receiver)
+            if newer is not None:
+                digest.items.extend(newer.items)
+            digest.due = time.monotonic() + delay
+            self.digests[digest.receiver] = digest
+            self.cond.notify()
+
+    def stop(self, timeout: Optional[float] = None):
+        """寄出所有暫存中的通知後停止"""
+        with self.cond:
+            self.stopping = True
+            self.cond.notify()
+        self.thread.join(timeout)
+        self.channel.close()
+
+class Notifier:
+    """將同一則新商品通知同時送到多個 Channel，每個 Channel 各自有 dispatcher，互不阻塞"""
+
+    def __init__(self, dispatchers: List[NotificationDispatcher], logger: logging.Logger = logging.getLogger("notifier")):
+        self.logger = logger
+        self.dispatchers = {d.channel.name: d for d in dispatchers}
+
+    def start(self):
+        for dispatcher in self.dispatchers.values():
+            dispatcher.start()
+        return self
+
+    def submit(self, receiver: str, items: List[ProductItem], channels: Optional[List[str]] = None):
+        """channels 為 None 時送到所有 Channel"""
+        for name in channels if channels is not None else self.dispatchers:
+            dispatcher = self.dispatchers.get(name)
+            if dispatcher is None:
+                self.logger.error(f'Unknown notification channel: {name}')
+                continue
+            dispatcher.submit(receiver, items)
+
+    def pending(self) -> Dict[str, Dict[str, List[ProductItem]]]:
+        return {name: d.pending() for name, d in self.dispatchers.items()}
+
+    def report(self) -> Dict[str, Dict]:
+        return {name: d.stats.report() for name, d in self.dispatchers.items()}
+
+    def snapshot(self) -> Dict[str, Dict[str, List[Dict]]]:
+        return {
+            name: {receiver: [asdict(item) for item in items] for receiver, items in pending.items()}
+            for name, pending in self.pending().items() if pending
+        }
+
+    def restore(self, state: Dict[str, Dict[str, List[Dict]]]):
+        """重新排入上次結束時尚未寄出的通知"""
+        count = 0
+        for name, pending in state.items():
+            for receiver, items in pending.items():
+                self.submit(receiver, [ProductItem(**item) for item in items], [name])
+                count += len(items)
+        if count:
+            self.logger.info(f'Restore {count} pending notification items')
 
+    def stop(self, timeout: Optional[float] = None):
+        # 先通知所有 dispatcher 停止，讓它們同時送出剩下的通知
+        for dispatcher in self.dispatchers.values():
+            with dispatcher.cond:
+                dispatcher.stopping = True
+                dispatcher.cond.notify()
+        for dispatcher in self.dispatchers.values():
+            dispatcher.stop(timeout)
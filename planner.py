@@ -0,0 +1,96 @@
+import logging
+import threading
+
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Dict, List, Optional
+from urllib.parse import parse_qs, quote, urlparse, urlunparse
+from metrics import registry
+if TYPE_CHECKING:
+    from scheduler import WatchTarget
+
+
+# 每次抓取時才決定的參數，不影響是哪一個列表
+ignored_params = {'page'}
+
+def canonical_url(url: str, default_params: Optional[Dict] = None) -> str:
+    """
+    將監控的 url 轉成標準形式: scheme / host 小寫、去掉結尾的 /、補上預設參數並依名稱排序
+    `?sortBy=ctime&keyword=ipad`、`?keyword=ipad&page=2` 與 `/?keyword=ipad` 會得到相同的結果
+    """
+    parsed = urlparse(url)
+    params = {k: str(v) for k, v in (default_params or {}).items() if k not in ignored_params}
+    params.update({k: ','.join(v) for k, v in parse_qs(parsed.query).items() if k not in ignored_params})
+    query = '&'.join(f'{k}={quote(v, safe=",")}' for k, v in sorted(params.items()))
+    return urlunparse((parsed.scheme.lower(), parsed.netloc.lower(), parsed.path.rstrip('/'), '', query, ''))
+
+@dataclass
+class Listing:
+    """
+    實際抓取的單位: 一個列表頁與訂閱它的所有監控目標
+    每輪只抓取一次，結果再分別交給每個目標去重、過濾與通知
+    """
+    name: str                       # 排程、統計與 checkpoint 使用的名稱
+    url: str                        # 抓取用的 url (第一個目標的 url)
+    targets: List['WatchTarget']
+    interval: float                 # 取所有目標中最短的查詢間隔
+
+    @classmethod
+    def single(cls, target: 'WatchTarget'):
+        return cls(target.name, target.url, [target], target.interval)
+
+class QueryPlanner:
+    """
+    將指向同一個列表的監控目標合併成一個 Listing，抓取次數只與不同列表的數量有關，與訂閱者數量無關
+    dedup ratio = 1 - 抓取次數 / 訂閱者的查詢次數
+    """
+
+    def __init__(self, default_params: Optional[Dict] = None, logger: logging.Logger = logging.getLogger('planner')):
+        self.logger = logger
+        self.default_params = default_params or {}
+        self.lock = threading.Lock()
+        self.targets = 0
+        self.listings = 0
+        self.fetches = 0
+        self.deliveries = 0
+
+    def plan(self, targets: List['WatchTarget']) -> List[Listing]:
+        groups: Dict[str, List['WatchTarget']] = {}
+        for target in targets:
+            groups.setdefault(canonical_url(target.url, self.default_params), []).append(target)
+        listings = []
+        for key, members in groups.items():
+            if len(members) == 1:
+                # 沒有合併的目標沿用原本的名稱，排程與 checkpoint 不受影響
+                listings.append(Listing.single(members[0]))
+                continue
+            listings.append(Listing(key, members[0].url, members, min(t.interval for t in members)))
+            self.logger.info(f'Merge {len(members)} targets into {key}: {", ".join(t.name for t in members)}')
+        self.targets, self.listings = len(targets), len(listings)
+        self.logger.info(f'Plan {self.targets} targets into {self.listings} listings (dedup ratio {self.planned_ratio():.1%})')
+        return listings
+
+    def planned_ratio(self) -> float:
+        return 1 - self.listings / self.targets if self.targets else 0
+
+    def record(self, listing: Listing):
+        """一次抓取，結果交給 listing 中的所有目標"""
+        with self.lock:
+            self.fetches += 1
+            self.deliveries += len(listing.targets)
+        registry.inc('planner_fetches_total')
+        registry.inc('planner_deliveries_total', len(listing.targets))
+
+    def dedup_ratio(self) -> float:
+        with self.lock:
+            return 1 - self.fetches / self.deliveries if self.deliveries else self.planned_ratio()
+
+    def report(self) -> Dict:
+        with self.lock:
+            fetches, deliveries = self.fetches, self.deliveries
+        return {
+            'targets': self.targets,
+            'listings': self.listings,
+            'fetches': fetches,
+            'deliveries': deliveries,
+            'dedup_ratio': self.dedup_ratio(),
+        }
@@ -0,0 +1,244 @@
+import logging
+import random
+import threading
+import time
+
+from dataclasses import dataclass
+from typing import Dict, Iterator, List, Optional
+from urllib.parse import urlparse
+from client import BaseClient, BlockedError, ProductItem
+from metrics import registry
+
+
+class Throttled(Exception):
+    """網站目前處於暫停狀態 (circuit open)，retry_after 秒後再試"""
+
+    def __init__(self, host: str, retry_after: float):
+        super().__init__(f'{host} is throttled, retry in {retry_after:.1f}s')
+        self.host = host
+        self.retry_after = retry_after
+
+@dataclass
+class RateLimitPolicy:
+    enabled: bool = True
+    rate: float = 1             # 每個網站每秒最多的請求數
+    burst: int = 3              # 可以累積的請求數
+    backoff: float = 30         # 第一次被擋下後暫停的秒數，連續被擋下時加倍
+    max_backoff: float = 1800
+    jitter: float = 0.1         # 暫停時間的隨機擾動比例
+    ramp_start: float = 0.25    # 恢復後先以 rate 的這個比例請求
+    ramp_step: int = 10         # 每成功幾次請求提高一次速率
+    ramp_growth: float = 2      # 每次提高的倍數，直到回到 rate
+
+    @classmethod
+    def from_config(cls, cfg: Dict):
+        return cls(**{k: v for k, v in cfg.items() if k in cls.__dataclass_fields__})
+
+class TokenBucket:
+    """以預約的方式取得 token，呼叫端在 lock 外等待回傳的秒數"""
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    def refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, now: float) -> float:
+        self.refill(now)
+        self.tokens -= 1
+        return 0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def set_rate(self, rate: float, now: float):
+        self.refill(now)
+        self.rate = rate
+
+class HostState:
+    """
+    單一網站的 circuit breaker
+    closed: 正常請求；open: 被擋下後暫停到 open_until；half_open: 暫停結束，只放行一個試探請求
+    """
+
+    codes = {'closed': 0, 'half_open': 1, 'open': 2}
+
+    def __init__(self, host: str, policy: RateLimitPolicy):
+        self.host = host
+        self.bucket = TokenBucket(policy.rate, policy.burst)
+        self.state = 'closed'
+        self.open_until = 0.0
+        self.opened = float('-inf')     # 上次暫停的時間
+        self.probing = False
+        self.factor = 1.0           # 目前速率佔 rate 的比例
+        self.successes = 0          # 這次提高速率後成功的請求數
+        self.consecutive = 0        # 連續被擋下的次數
+        self.blocks = 0
+        self.throttled = 0
+        self.waited = 0.0
+
+class RateLimiter:
+    """
+    所有抓取共用的限流器，每個網站 (host) 一個 token bucket 與 circuit breaker
+    被擋下 (429 / captcha) 時暫停該網站的所有請求，暫停時間隨連續被擋下的次數指數成長，
+    恢復後先以較低的速率請求，持續成功才逐步回到設定的速率
+    """
+
+    def __init__(self, policy: RateLimitPolicy, logger: logging.Logger = logging.getLogger('ratelimit')):
+        self.logger = logger
+        self.policy = policy
+        self.lock = threading.Lock()
+        self.hosts: Dict[str, HostState] = {}
+
+    def host(self, url: str) -> HostState:
+        host = urlparse(url).netloc
+        state = self.hosts.get(host)
+        if state is None:
+            state = self.hosts[host] = HostState(host, self.policy)
+            self.publish(state)
+        return state
+
+    def publish(self, state: HostState):
+        registry.set('throttle_state', HostState.codes[state.state], host=state.host)
+        registry.set('throttle_rate', state.bucket.rate, host=state.host)
+
+    def acquire(self, url: str) -> float:
+        """等待可以請求，回傳等待的秒數；網站暫停中時丟出 Throttled"""
+        with self.lock:
+            state = self.host(url)
+            now = time.monotonic()
+            if state.state == 'open':
+                if now < state.open_until:
+                    state.throttled += 1
+                    registry.inc('throttled_requests_total', host=state.host)
+                    raise Throttled(state.host, state.open_until - now)
+                state.state = 'half_open'
+                self.publish(state)
+            if state.state == 'half_open':
+                if state.probing:
+                    # 已經有試探請求在進行，等它的結果
+                    state.throttled += 1
+                    registry.inc('throttled_requests_total', host=state.host)
+                    raise Throttled(state.host, self.policy.backoff)
+                state.probing = True
+            wait = state.bucket.reserve(now)
+            state.waited += wait
+        if wait > 0:
+            registry.inc('throttle_wait_seconds_total', wait, host=state.host)
+            time.sleep(wait)
+        return wait
+
+    def success(self, url: str):
+        with self.lock:
+            state = self.host(url)
+            state.consecutive = 0
+            if state.state == 'half_open':
+                state.state, state.probing = 'closed', False
+                self.logger.info(f'Resume requests to {state.host} at {state.bucket.rate:.2f}/s')
+            if state.factor < 1:
+                state.successes += 1
+                if state.successes >= self.policy.ramp_step:
+                    state.factor, state.successes = min(1, state.factor * self.policy.ramp_growth), 0
+                    state.bucket.set_rate(self.policy.rate * state.factor, time.monotonic())
+                    self.logger.info(f'Ramp up requests to {state.host} to {state.bucket.rate:.2f}/s')
+            self.publish(state)
+
+    def failure(self, url: str):
+        """與限流無關的錯誤，只需要讓出試探請求的機會"""
+        with self.lock:
+            self.host(url).probing = False
+
+    def blocked(self, url: str, reason: str, retry_after: Optional[float] = None, started: Optional[float] = None) -> float:
+        """
+        記錄被擋下並暫停該網站，回傳暫停的秒數
+        started 為請求開始的時間: 在上次暫停之前就送出的請求屬於同一次被擋下，不會再加倍暫停時間
+        """
+        policy = self.policy
+        with self.lock:
+            state = self.host(url)
+            state.blocks += 1
+            now = time.monotonic()
+            if started is not None and started < state.opened:
+                registry.inc('blocks_total', host=state.host, reason=reason)
+                if retry_after and now + retry_after > state.open_until:
+                    state.state, state.probing = 'open', False
+                    state.open_until = now + retry_after
+                    self.publish(state)
+                return max(0, state.open_until - now)
+            state.consecutive += 1
+            backoff = min(policy.max_backoff, policy.backoff * 2 ** (state.consecutive - 1))
+            backoff = max(backoff, retry_after or 0) * (1 + random.uniform(0, policy.jitter))
+            state.state, state.probing = 'open', False
+            state.opened = now
+            state.open_until = now + backoff
+            state.factor, state.successes = policy.ramp_start, 0
+            state.bucket.set_rate(policy.rate * state.factor, now)
+            state.bucket.tokens = min(state.bucket.tokens, 1)
+            self.publish(state)
+        registry.inc('blocks_total', host=state.host, reason=reason)
+        self.logger.warning(f'Blocked by {state.host} ({reason}, {state.consecutive} in a row), pause for {backoff:.1f}s')
+        return backoff
+
+    def report(self) -> Dict:
+        with self.lock:
+            now = time.monotonic()
+            return {
+                host: {
+                    'state': state.state,
+                    'rate': state.bucket.rate,
+                    'blocks': state.blocks,
+                    'throttled': state.throttled,
+                    'waited_seconds': state.waited,
+                    'paused_for': max(0, state.open_until - now) if state.state == 'open' else 0,
+                }
+                for host, state in self.hosts.items()
+            }
+
+class ThrottledClient(BaseClient):
+    """所有請求先經過 RateLimiter，後端回報被擋下時暫停該網站並丟出 Throttled"""
+
+    def __init__(self, client: BaseClient, limiter: RateLimiter, logger = logging.getLogger('client')):
+        super().__init__(logger)
+        self.client = client
+        self.limiter = limiter
+        self.thread_safe = client.thread_safe
+        self.default_params = client.default_params
+
+    def fetch(self, url, **args) -> List[ProductItem]:
+        self.limiter.acquire(url)
+        started = time.monotonic()
+        try:
+            items = self.client.fetch(url, **args)
+        except BlockedError as e:
+            raise Throttled(urlparse(url).netloc, self.limiter.blocked(url, e.reason, e.retry_after, started)) from e
+        except Exception:
+            self.limiter.failure(url)
+            raise
+        self.limiter.success(url)
+        return items
+
+    def iter_items(self, url, **args) -> Iterator[ProductItem]:
+        self.limiter.acquire(url)
+        started = time.monotonic()
+        try:
+            yield from self.client.iter_items(url, **args)
+        except GeneratorExit:
+            # 提早停止代表頁面已經正常載入
+            self.limiter.success(url)
+            raise
+        except BlockedError as e:
+            raise Throttled(urlparse(url).netloc, self.limiter.blocked(url, e.reason, e.retry_after, started)) from e
+        except Exception:
+            self.limiter.failure(url)
+            raise
+        self.limiter.success(url)
+
+    def close(self):
+        self.client.close()
+
+    def restart(self):
+        self.client.restart()
+
+    def report(self):
+        return {**self.client.report(), 'rate_limit': self.limiter.report()}
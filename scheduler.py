@@ -0,0 +1,500 @@
+import asyncio
+import contextvars
+import logging
+import random
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from dataclasses import dataclass
+from functools import partial
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple, Union
+from checkpoint import Checkpointer
+from client import BaseClient, ProductItem
+from fetch_cache import items_fingerprint
+from filters import ItemFilter
+from history import ItemHistory
+from metrics import TraceWriter, registry, span
+from planner import Listing, QueryPlanner
+from ratelimit import Throttled
+from sinks import SinkWriter
+from store import SeenStore
+
+
+@dataclass
+class WatchTarget:
+    url: str
+    receiver: str
+    interval: float = 60        # 查詢間隔 (秒)
+    name: Optional[str] = None  # 在 SeenStore 中的 namespace，預設由 url、收件者、過濾規則與通知管道組成
+    channels: Optional[List[str]] = None    # 要使用的通知管道，None 則使用全部
+    filter: Optional[Union[str, List[str]]] = None  # 通知前套用的過濾規則 (符合任一規則即通知)，None 則不過濾
+
+    def __post_init__(self):
+        if not self.name:
+            # 同一個 url 可以有多個訂閱者，每個訂閱者需要各自的 namespace，否則只有第一個會收到通知
+            parts = [self.url, self.receiver]
+            if self.filter:
+                parts.append(','.join([self.filter] if isinstance(self.filter, str) else self.filter))
+            if self.channels:
+                parts.append(','.join(self.channels))
+            self.name = ' | '.join(parts)
+
+    @classmethod
+    def from_config(cls, cfg: Dict, default_interval: float = 60):
+        return cls(cfg['url'], cfg['receiver'], cfg.get('interval', default_interval), cfg.get('name'), cfg.get('channels'), cfg.get('filter'))
+
+@dataclass
+class TargetStats:
+    polls: int = 0
+    errors: int = 0
+    new_items: int = 0
+    last_poll: float = 0
+    last_duration: float = 0
+    interval: float = 0     # 目前的查詢間隔
+    rate: float = 0         # 估計的新商品速率 (個/秒)
+    depth: int = 1          # 下一輪最多抓取的頁數
+    unchanged: int = 0      # 結果與上次相同而略過處理的次數
+    fingerprint: Optional[str] = None   # 上次查詢結果的 fingerprint
+
+@dataclass
+class AdaptivePolicy:
+    enabled: bool = True
+    min_interval: float = 10
+    max_interval: float = 600
+    target_items: float = 10    # 希望每次查詢平均抓到的新商品數
+    alpha: float = 0.3          # 新商品速率的 EWMA 權重
+    max_growth: float = 2       # 每次查詢後間隔最多放大的倍數
+    jitter: float = 0.1         # 隨機擾動比例
+    backoff: float = 2          # 錯誤時的退避倍數
+    max_depth: int = 10         # 整頁都是新商品時，下一輪最多抓取的頁數
+
+    @classmethod
+    def from_config(cls, cfg: Dict):
+        return cls(**{k: v for k, v in cfg.items() if k in cls.__dataclass_fields__})
+
+class AdaptiveInterval:
+    """
+    依照最近的新商品速率調整單一目標的查詢間隔
+    間隔 = target_items / 速率，並限制在 [min_interval, max_interval] 之間
+    """
+
+    def __init__(self, base: float, policy: AdaptivePolicy):
+        self.policy = policy
+        self.interval = min(max(base, policy.min_interval), policy.max_interval) if policy.enabled else base
+        self.rate: Optional[float] = None
+        self.errors = 0
+
+    def success(self, new_items: int, elapsed: Optional[float]) -> float:
+        self.errors = 0
+        policy = self.policy
+        if not policy.enabled:
+            return self.interval
+        if elapsed:
+            observed = new_items / elapsed
+            self.rate = observed if self.rate is None else policy.alpha * observed + (1 - policy.alpha) * self.rate
+        if self.rate is None:
+            # 還沒有速率的樣本 (第一次查詢)，維持目前的間隔
+            return self.interval
+        desired = policy.target_items / self.rate if self.rate else policy.max_interval
+        desired = min(desired, self.interval * policy.max_growth)
+        self.interval = min(max(desired, policy.min_interval), policy.max_interval)
+        return self.interval
+
+    def failure(self) -> float:
+        self.errors += 1
+        upper = max(self.policy.max_interval, self.interval)
+        return min(upper, self.interval * self.policy.backoff ** self.errors)
+
+    def restore(self, interval: Optional[float], rate: Optional[float]):
+        """還原 checkpoint 中的基本間隔與速率；未啟用自動調整時沿用設定的間隔"""
+        self.rate = rate
+        if interval and self.policy.enabled:
+            self.interval = min(max(interval, self.policy.min_interval), self.policy.max_interval)
+
+    def jittered(self, delay: float) -> float:
+        if not self.policy.enabled or not self.policy.jitter:
+            return delay
+        return delay * (1 + random.uniform(-self.policy.jitter, self.policy.jitter))
+
+class Watcher:
+    """
+    以 asyncio 同時監控多個 WatchTarget
+    所有目標共用同一個抓取後端與 SeenStore，同時進行的 fetch 數量受 concurrency 限制
+    排程與抓取以 Listing 為單位，有 planner 時指向同一個列表的目標只會抓取一次
+    fetch 與 notify 屬於阻塞操作，會丟到 thread pool 執行
+    """
+
+    def __init__(self,
+                 client: BaseClient,
+                 store: SeenStore,
+                 targets: List[WatchTarget],
+                 notify: Callable[[WatchTarget, List[ProductItem]], None],
+                 concurrency: int = 4,
+                 init_parallelism: int = 4,
+                 incremental: bool = True,
+                 known_run: int = 3,
+                 max_pages: int = 3,
+                 adaptive: Optional[AdaptivePolicy] = None,
+                 tracer: Optional[TraceWriter] = None,
+                 history: Optional[ItemHistory] = None,
+                 item_filter: Optional[ItemFilter] = None,
+                 checkpointer: Optional[Checkpointer] = None,
+                 sink: Optional[SinkWriter] = None,
+                 planner: Optional[QueryPlanner] = None,
+                 logger: logging.Logger = logging.getLogger('watcher')):
+        self.logger = logger
+        self.client = client
+        self.store = store
+        self.targets = targets
+        self.notify = notify
+        self.concurrency = concurrency if client.thread_safe else 1
+        self.init_parallelism = init_parallelism if client.thread_safe else 1
+        self.incremental = incremental
+        self.known_run = known_run
+        self.max_pages = max_pages
+        self.adaptive = adaptive or AdaptivePolicy(enabled=False)
+        self.tracer = tracer
+        self.history = history
+        self.item_filter = item_filter
+        self.checkpointer = checkpointer
+        self.sink = sink
+        self.planner = planner
+        self.listings = planner.plan(targets) if planner else [Listing.single(t) for t in targets]
+        self.restored: Set[str] = set()     # 由 checkpoint 還原、不需要初始化的 listing
+        # 每輪基本的抓取頁數，整頁都是新商品時會加深
+        self.base_depth = max_pages if incremental else 1
+        self.intervals = {l.name: AdaptiveInterval(l.interval, self.adaptive) for l in self.listings}
+        self.stats: Dict[str, TargetStats] = {l.name: TargetStats(interval=l.interval, depth=self.base_depth) for l in self.listings}
+        self.executor = ThreadPoolExecutor(max_workers=max(self.concurrency, self.init_parallelism) + 1)
+        self.semaphore: Optional[asyncio.Semaphore] = None
+        self.init_semaphore: Optional[asyncio.Semaphore] = None
+        self.stopped: Optional[asyncio.Event] = None
+
+    async def run_blocking(self, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        # 複製 context，讓 thread 中的 span 也能記錄到目前的 trace
+        ctx = contextvars.copy_context()
+        return await loop.run_in_executor(self.executor, partial(ctx.run, func, *args, **kwargs))
+
+    def trace(self, name: str):
+        return self.tracer.trace(name) if self.tracer else nullcontext()
+
+    def collect_new_items(self, target: WatchTarget, items: List[ProductItem]) -> List[ProductItem]:
+        newItems = []
+        for item in items:
+            if not self.store.add(target.name, item.id):
+                continue
+            newItems.append(item)
+            self.logger.info(f'Fetch New Item {item.title}, {item.price} for {target.name}')
+        return newItems
+
+    def stopping(self) -> bool:
+        return self.stopped is not None and self.stopped.is_set()
+
+    async def fetch_page(self, listing: Listing, page: int) -> List[ProductItem]:
+        while True:
+            try:
+                async with self.init_semaphore:
+                    if self.stopping():
+                        # 停止時不再開始新的抓取
+                        return []
+                    self.logger.info(f'Fetch page {page} of {listing.name}')
+                    return await self.run_blocking(self.client.fetch, listing.url, page = page)
+            except Throttled as e:
+                # 初始化不完整的話，之後會把舊商品當成新商品通知，因此等待後重試
+                self.logger.warning(f'Initialize {listing.name} paused: {e}')
+                if await self.wait_stopped(e.retry_after):
+                    return []
+            except Exception:
+                if self.stopping():
+                    # 停止時被中斷的抓取 (例如不再等待 worker)，只保留已經抓到的頁數
+                    return []
+                raise
+
+    def is_known(self, listing: Listing, item_id: str) -> bool:
+        """所有訂閱的目標都已經看過"""
+        return all(self.store.contains(target.name, item_id) for target in listing.targets)
+
+    def is_exhausted(self, listing: Listing, items: List[ProductItem]) -> bool:
+        """沒有商品或全部都是已知商品，代表不需要再往後抓"""
+        return len(items) == 0 or all(self.is_known(listing, item.id) for item in items)
+
+    async def seed(self, listing: Listing, pages: int, targets: Optional[List[WatchTarget]] = None) -> int:
+        """
+        初始化 targets (預設為 listing 的所有目標): 以 init_parallelism 為批次平行抓取前 pages 頁
+        某一頁沒有商品或全部已知時，不再抓取下一批；停止時只保留已經抓到的頁數
+        所有結果最後依頁數順序一次寫入 store
+        """
+        results: Dict[int, List[ProductItem]] = {}
+        for batch_start in range(0, pages, self.init_parallelism):
+            batch = range(batch_start, min(batch_start + self.init_parallelism, pages))
+            fetched = await asyncio.gather(*(self.fetch_page(listing, page) for page in batch))
+            if self.stopping():
+                results.update((page, items) for page, items in zip(batch, fetched) if items)
+                self.logger.info(f'Stop initialize {listing.name} at page {batch[-1]}: stopping')
+                break
+            results.update(zip(batch, fetched))
+            if any(self.is_exhausted(listing, items) for items in fetched):
+                self.logger.info(f'Stop initialize {listing.name} at page {batch[-1]}')
+                break
+        ids = [item.id for page in sorted(results) for item in results[page]]
+        # SqliteSeenStore 可能在寫入時 commit / 淘汰，不在 event loop 上執行
+        added = await self.run_blocking(self.add_seeded, targets or listing.targets, ids)
+        if self.history is not None:
+            # 記錄初始價格，之後才能比較；ItemHistory 可能淘汰大量商品，同樣不在 event loop 上執行
+            await self.run_blocking(self.history.observe, [item for page in results.values() for item in page], listing.name, notify=False)
+        self.logger.info(f'Add {added} items of {listing.name} in **initialize step**')
+        return added
+
+    def add_seeded(self, targets: List[WatchTarget], ids: List[str]) -> int:
+        return sum(self.store.add_many(target.name, ids) for target in targets)
+
+    def unseeded(self, listing: Listing) -> List[WatchTarget]:
+        """需要初始化的目標: 沒有 checkpoint，或是在 store 中還沒有任何商品 (例如新加入已合併的列表)"""
+        if listing.name not in self.restored:
+            return listing.targets
+        return [target for target in listing.targets if self.store.size(target.name) == 0]
+
+    async def seed_all(self, pages: int):
+        start = time.perf_counter()
+        jobs = [(listing, self.unseeded(listing)) for listing in self.listings]
+        jobs = [(listing, targets) for listing, targets in jobs if targets]
+        await asyncio.gather(*(self.seed(listing, pages, targets) for listing, targets in jobs))
+        self.logger.info(f'Initialize {len(jobs)} listings in {time.perf_counter() - start:.2f}s')
+
+    def fetch_latest(self, listing: Listing, depth: int) -> Tuple[List[ProductItem], bool]:
+        """
+        抓取最新的商品，最多 depth 頁
+        回傳 (商品, 是否遇到已知商品)；沒遇到已知商品代表可能有商品在兩次查詢之間被擠到更後面的頁數
+        """
+        overlapped = False
+        def is_known(item_id):
+            nonlocal overlapped
+            known = self.is_known(listing, item_id)
+            overlapped = overlapped or known
+            return known
+
+        if self.incremental:
+            # 依序讀取，遇到連續已知商品就停止；需要記錄價格或匯出時也回傳停止前的已知商品
+            include_known = self.history is not None or self.sink is not None
+            # 記錄價格時需要整頁的商品，否則只會重新看到最前面幾個已知商品，更後面的降價永遠偵測不到
+            known_run = self.known_run if self.history is None else float('inf')
+            items = self.client.fetch_new(listing.url, is_known, known_run, depth, include_known=include_known)
+            return list(items), overlapped
+        items = []
+        for page in range(depth):
+            page_items = self.client.fetch(listing.url, page = page)
+            items.extend(page_items)
+            if len(page_items) == 0 or any([is_known(item.id) for item in page_items]):
+                return items, True
+        return items, overlapped
+
+    async def poll(self, listing: Listing) -> List[ProductItem]:
+        with self.trace(listing.name):
+            return await self.poll_target(listing)
+
+    async def poll_target(self, listing: Listing) -> List[ProductItem]:
+        """抓取一次，再分別交給每個訂閱的目標處理，回傳任一目標的新商品"""
+        stats = self.stats[listing.name]
+        async with self.semaphore:
+            start = time.perf_counter()
+            try:
+                with span('fetch'):
+                    items, overlapped = await self.run_blocking(self.fetch_latest, listing, stats.depth)
+            finally:
+                stats.polls += 1
+                stats.last_poll = time.time()
+                stats.last_duration = time.perf_counter() - start
+                registry.inc('polls_total', target=listing.name)
+                if self.planner is not None:
+                    self.planner.record(listing)
+        depth = self.base_depth if overlapped or not items else min(stats.depth * 2, max(self.adaptive.max_depth, self.base_depth))
+        if depth != stats.depth:
+            self.logger.info(f'Change fetch depth of {listing.name} from {stats.depth} to {depth} pages')
+            stats.depth = depth
+        digest = items_fingerprint(items)
+        if digest == stats.fingerprint:
+            # 與上次的結果相同，不會有新商品或價格變動
+            stats.unchanged += 1
+            registry.inc('unchanged_polls_total', target=listing.name)
+            if self.history is not None:
+                await self.run_blocking(self.history.observe, items, listing.name, notify=False)
+            return []
+        stats.fingerprint = digest
+        newItems: Dict[str, ProductItem] = {}
+        delivered = await self.run_blocking(self.dedup, listing, items)
+        for target, targetNew in delivered:
+            registry.inc('new_items_total', len(targetNew), target=target.name)
+            for item in targetNew:
+                newItems.setdefault(item.id, item)
+        stats.new_items += len(newItems)
+        if self.sink is not None and items:
+            # 每個列表每輪只匯出一次，new 為任一訂閱的目標沒看過的商品
+            await self.export(listing, items, newItems)
+        changed = []
+        if self.history is not None:
+            # 所有目標都沒看過的商品會以新商品通知，只記錄價格
+            fresh = set.intersection(*(set(item.id for item in targetNew) for _, targetNew in delivered))
+            changed = await self.run_blocking(self.detect_changes, listing, items, fresh)
+        pending = []
+        for target, targetNew in delivered:
+            new_ids = set(item.id for item in targetNew)
+            pending.append((target, targetNew + [item for item in changed if item.id not in new_ids]))
+        if self.item_filter is not None:
+            pending = await self.run_blocking(self.apply_filters, pending)
+        for target, notifyItems in pending:
+            if len(notifyItems) > 0:
+                with span('notify_submit'):
+                    await self.run_blocking(self.notify, target, notifyItems)
+        return list(newItems.values())
+
+    def dedup(self, listing: Listing, items: List[ProductItem]) -> List[Tuple[WatchTarget, List[ProductItem]]]:
+        """各目標的新商品，寫入 store 可能觸發 commit (fsync) 與淘汰，因此以 run_blocking 執行"""
+        with span('dedup'):
+            return [(target, self.collect_new_items(target, items)) for target in listing.targets]
+
+    def apply_filters(self, pending: List[Tuple[WatchTarget, List[ProductItem]]]) -> List[Tuple[WatchTarget, List[ProductItem]]]:
+        """
+        每個商品只與所有規則比對一次，各目標再以自己的規則名稱取交集，訂閱者增加時不需要重新掃描標題
+        被過濾掉的商品仍然算已通知，之後不會再出現
+        """
+        matches: Dict[str, Set[str]] = {}
+        result = []
+        with span('filter'):
+            for target, items in pending:
+                if not items or not target.filter:
+                    result.append((target, items))
+                    continue
+                names = self.item_filter.rule_names(target.filter)
+                selected = []
+                for item in items:
+                    if item.id not in matches:
+                        matches[item.id] = self.item_filter.match(item)
+                    if not names.isdisjoint(matches[item.id]):
+                        selected.append(item)
+                if len(selected) < len(items):
+                    registry.inc('filtered_items_total', len(items) - len(selected), target=target.name)
+                    self.logger.info(f'Filter out {len(items) - len(selected)} of {len(items)} items for {target.name}')
+                result.append((target, selected))
+        return result
+
+    async def export(self, listing: Listing, items: List[ProductItem], new_ids: Iterable[str]):
+        records = self.sink.to_records(listing.name, items, new_ids)
+        if not self.sink.offer(records):
+            # 匯出跟不上時等待 (backpressure)，不阻塞 event loop
+            with span('sink_wait'):
+                await self.run_blocking(self.sink.put, records)
+
+    def detect_changes(self, listing: Listing, items: List[ProductItem], fresh: Set[str]) -> List[ProductItem]:
+        """已知商品的降價或重新上架，fresh (新商品) 已經會通知所以只記錄價格；以 run_blocking 執行"""
+        with span('history'):
+            changed = self.history.observe([item for item in items if item.id not in fresh], listing.name)
+            self.history.observe([item for item in items if item.id in fresh], listing.name, notify=False)
+        for item in changed:
+            self.logger.info(f'{item.note}: {item.title} for {listing.name}')
+        return changed
+
+    def snapshot(self) -> Dict[str, Dict]:
+        """
+        各目標的排程狀態，寫入 checkpoint 用
+        interval 是自動調整的基本間隔，delay 是下一次查詢前的等待 (可能是限流或錯誤的退避)，兩者分開保存
+        """
+        return {
+            name: {'interval': self.intervals[name].interval, 'delay': stats.interval, 'rate': self.intervals[name].rate,
+                   'depth': stats.depth, 'fingerprint': stats.fingerprint, 'last_poll': stats.last_poll}
+            for name, stats in self.stats.items()
+        }
+
+    def restore(self, state: Dict[str, Dict]):
+        for name, saved in state.items():
+            if name not in self.stats:
+                continue
+            stats, interval = self.stats[name], self.intervals[name]
+            # 舊版 checkpoint 的 interval 可能是退避的等待時間，還原時限制在設定的範圍內
+            interval.restore(saved.get('interval'), saved.get('rate'))
+            stats.interval = saved.get('delay') or interval.interval
+            stats.rate = interval.rate or 0
+            stats.depth = saved.get('depth', stats.depth)
+            stats.fingerprint = saved.get('fingerprint')
+            stats.last_poll = saved.get('last_poll', 0)
+            self.restored.add(name)
+        self.logger.info(f'Restore schedule of {len(self.restored)} targets')
+
+    async def wait_stopped(self, delay: float) -> bool:
+        """等待 delay 秒，期間被停止則回傳 True"""
+        if self.stopped is None:
+            # 尚未以 run 啟動 (例如 benchmark 直接呼叫 seed_all)
+            await asyncio.sleep(delay)
+            return False
+        try:
+            await asyncio.wait_for(self.stopped.wait(), timeout=delay)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    async def checkpoint_loop(self):
+        while not await self.wait_stopped(self.checkpointer.interval):
+            try:
+                # 寫入 store、history 與 checkpoint 檔都可能花上數百毫秒，不阻塞其他目標的查詢
+                await self.run_blocking(self.checkpointer.save)
+            except Exception as e:
+                self.logger.exception(e)
+
+    async def watch(self, listing: Listing):
+        loop = asyncio.get_running_loop()
+        interval, stats = self.intervals[listing.name], self.stats[listing.name]
+        last_start = None
+        if listing.name in self.restored and stats.last_poll:
+            # 接續上次的排程，避免重新啟動後所有目標同時查詢
+            if await self.wait_stopped(max(0, stats.last_poll + stats.interval - time.time())):
+                return
+        while not self.stopped.is_set():
+            start = loop.time()
+            try:
+                newItems = await self.poll(listing)
+                delay = interval.success(len(newItems), start - last_start if last_start is not None else None)
+                self.logger.info(f'Next poll of {listing.name} in {delay:.1f}s (new: {len(newItems)}, rate: {(interval.rate or 0) * 60:.2f}/min)')
+            except Throttled as e:
+                # 網站暫停中 (被限流或要求驗證)，暫停結束後再查詢，不算後端錯誤
+                registry.inc('throttled_polls_total', target=listing.name)
+                delay = e.retry_after
+                self.logger.warning(f'Pause {listing.name}: {e}')
+            except Exception as e:
+                if self.stopping():
+                    # 停止時被中斷的查詢 (例如不再等待 worker)，不算錯誤
+                    self.logger.info(f'Abort poll of {listing.name}: {e}')
+                    break
+                stats.errors += 1
+                registry.inc('poll_errors_total', target=listing.name)
+                # 後端會自行處理重啟 (例如 DriverPool 在連續失敗後才重啟 driver)
+                self.logger.exception(e)
+                delay = interval.failure()
+                self.logger.error(f'Failed to poll {listing.name}, retry in {delay:.1f}s ({interval.errors} consecutive errors)')
+            last_start = start
+            stats.interval, stats.rate = delay, interval.rate or 0
+            registry.set('poll_interval_seconds', delay, target=listing.name)
+            registry.set('new_item_rate', stats.rate, target=listing.name)
+            registry.set('fetch_depth', stats.depth, target=listing.name)
+            await self.wait_stopped(max(0, interval.jittered(delay) - (loop.time() - start)))
+
+    async def run(self, init_pages: int = 0):
+        self.semaphore = asyncio.Semaphore(self.concurrency)
+        self.init_semaphore = asyncio.Semaphore(self.init_parallelism)
+        self.stopped = asyncio.Event()
+        if init_pages > 0:
+            await self.seed_all(init_pages)
+        self.logger.info(f'Start to monitor {len(self.targets)} targets ({len(self.listings)} listings) with concurrency {self.concurrency}')
+        checkpoint_task = asyncio.create_task(self.checkpoint_loop()) if self.checkpointer else None
+        try:
+            # 停止後每個目標會先完成進行中的查詢才結束
+            await asyncio.gather(*(self.watch(listing) for listing in self.listings))
+        finally:
+            if checkpoint_task:
+                checkpoint_task.cancel()
+            self.executor.shutdown(wait=False)
+
+    def stop(self):
+        if self.stopped is not None and not self.stopped.is_set():
+            self.logger.info('Stop monitoring, wait for in-flight polls')
+            self.stopped.set()
@@ -0,0 +1,315 @@
+import logging
+import threading
+import time
+
+from typing import Dict, Iterator, List, Optional, Tuple
+from urllib.parse import urlunparse
+from selenium import webdriver
+from selenium.webdriver.support.ui import WebDriverWait
+from selenium.webdriver.support import expected_conditions as EC
+from selenium.webdriver.common.by import By
+from selenium.common.exceptions import NoSuchElementException, StaleElementReferenceException
+from selenium.webdriver.common.action_chains import ActionChains
+from client import BaseClient, BlockedError, ProductItem, blocked_url_regex
+from driver_pool import DriverPool
+from fetch_cache import CacheEntry, FetchCache, fingerprint
+from metrics import registry, span
+
+
+# 一次取得所有商品卡片的資料，避免每個欄位都要一次 WebDriver round-trip
+# 尚未載入 (沒有連結) 的卡片回傳 null
+extract_items_script = """
+const cards = arguments[0] || document.getElementsByClassName('shopee-search-item-result__item');
+return Array.from(cards, card => {
+    const link = card.querySelector(':scope > a[data-sqe="link"]');
+    if (!link) return null;
+    const img = link.querySelector('img');
+    const name = link.querySelector('div[data-sqe="name"]');
+    const price = name ? name.nextElementSibling : null;
+    return {
+        link: link.href,
+        img: img ? img.src : '',
+        title: name ? name.innerText : '',
+        price: price ? price.innerText : '',
+    };
+});
+"""
+
+# 判斷頁面是否與上次相同: 依序的商品連結與卡片文字
+page_fingerprint_script = """
+return Array.from(document.querySelectorAll('.shopee-search-item-result__item')).map(card => {
+    const link = card.querySelector("a[data-sqe='link']");
+    return link ? link.href + '\\t' + link.innerText : '';
+}).join('\\n');
+"""
+
+# 頁面載入後的傳輸量與載入時間 (Resource/Navigation Timing API)
+page_stats_script = """
+const nav = performance.getEntriesByType('navigation')[0];
+const resources = performance.getEntriesByType('resource');
+return {
+    bytes: (nav ? nav.transferSize : 0) + resources.reduce((sum, r) => sum + (r.transferSize || 0), 0),
+    resources: resources.length,
+    load_ms: nav ? (nav.domContentLoadedEventEnd || nav.duration) : 0,
+};
+"""
+
+# lean profile 不下載的資源: 圖片、影音、字型
+lean_blocked_urls = [
+    '*.png', '*.jpg', '*.jpeg', '*.gif', '*.webp', '*.svg', '*.ico',
+    '*.mp4', '*.webm', '*.mp3',
+    '*.woff', '*.woff2', '*.ttf', '*.otf',
+]
+
+# lean profile 不連線的第三方網域 (廣告、追蹤)
+default_blocked_domains = [
+    'doubleclick.net', 'googlesyndication.com', 'googleadservices.com', 'google-analytics.com',
+    'googletagmanager.com', 'facebook.net', 'facebook.com', 'criteo.com', 'criteo.net',
+    'hotjar.com', 'scorecardresearch.com', 'appier.net', 'tiktok.com',
+]
+
+class Client(BaseClient):
+
+    profiles = ('default', 'lean')
+
+    def __init__(self,
+                 driver_path,
+                 pool_size = 1,
+                 max_failures = 3,
+                 max_page_loads = 500,
+                 batch_extract = True,
+                 profile = 'default',
+                 blocked_domains = None,
+                 cache: Optional[FetchCache] = None,
+                 logger = logging.getLogger('client')):
+        super().__init__(logger)
+        if profile not in self.profiles:
+            raise ValueError(f'Unknown profile: {profile}')
+        self.driver_path = driver_path
+        self.batch_extract = batch_extract
+        self.profile = profile
+        self.blocked_domains = default_blocked_domains if blocked_domains is None else blocked_domains
+        self.cache = cache
+        self.page_stats = {'fetches': 0, 'bytes': 0, 'resources': 0, 'load_ms': 0.0}
+        self.page_stats_lock = threading.Lock()
+        self.pool = DriverPool(self.init_driver, pool_size, max_failures, max_page_loads)
+
+    @property
+    def lean(self):
+        return self.profile == 'lean'
+
+    def init_driver(self):
+        options = webdriver.ChromeOptions()
+        options.add_argument('--headless')
+        options.add_argument('--disable-logging')
+        options.add_argument('--log-level=3')
+        if self.lean:
+            # DOMContentLoaded 後就回傳，商品由 WebDriverWait 等待
+            options.page_load_strategy = 'eager'
+            options.add_argument('--blink-settings=imagesEnabled=false')
+            # 視窗夠高的話所有商品一開始就在可視範圍內，不需要逐一 hover 觸發載入
+            options.add_argument('--window-size=1920,16000')
+            options.add_experimental_option('prefs', {'profile.managed_default_content_settings.images': 2})
+        driver = webdriver.Chrome(self.driver_path, options=options)
+        if self.lean:
+            blocked = lean_blocked_urls + [f'*{domain}*' for domain in self.blocked_domains]
+            driver.execute_cdp_cmd('Network.enable', {})
+            driver.execute_cdp_cmd('Network.setBlockedURLs', {'urls': blocked})
+        return driver
+
+    def record_page_stats(self, driver):
+        try:
+            stats = driver.execute_script(page_stats_script)
+        except Exception as e:
+            self.logger.debug(f'Failed to get page stats: {e!r}')
+            return
+        with self.page_stats_lock:
+            self.page_stats['fetches'] += 1
+            self.page_stats['bytes'] += stats['bytes']
+            self.page_stats['resources'] += stats['resources']
+            self.page_stats['load_ms'] += stats['load_ms']
+        registry.inc('page_bytes_total', stats['bytes'], profile=self.profile)
+        registry.observe('page_load_seconds', stats['load_ms'] / 1000, profile=self.profile)
+        self.logger.info(f"Transferred {stats['bytes'] / 1024:.1f} KB in {stats['resources']} resources, loaded in {stats['load_ms']:.0f} ms ({self.profile} profile)")
+
+    def close_driver(self):
+        self.pool.close()
+
+    def restart_driver(self):
+        self.pool.recycle_all()
+
+    def close(self):
+        self.close_driver()
+
+    def restart(self):
+        self.restart_driver()
+
+    def report(self):
+        with self.page_stats_lock:
+            fetches = self.page_stats['fetches'] or 1
+            pages = {
+                'profile': self.profile,
+                'fetches': self.page_stats['fetches'],
+                'bytes_avg': self.page_stats['bytes'] / fetches,
+                'resources_avg': self.page_stats['resources'] / fetches,
+                'load_ms_avg': self.page_stats['load_ms'] / fetches,
+            }
+        report = {**self.pool.report(), 'pages': pages}
+        if self.cache:
+            report['cache'] = self.cache.report()
+        return report
+
+    def fetch(self, url, **args) -> List[ProductItem]:
+        # driver 失敗次數由 pool 記錄，超過上限才會重啟
+        with self.pool.checkout() as entry:
+            return self.fetch_with_driver(entry.driver, url, **args)
+
+    def iter_items(self, url, **args) -> Iterator[ProductItem]:
+        # 提早停止 (generator 被關閉) 不算失敗，見 DriverPool.checkout
+        with self.pool.checkout() as entry:
+            yield from self.iter_with_driver(entry.driver, url, **args)
+
+    def load_page(self, driver, url, **args):
+        url, params = self.build_params(url, **args)
+
+        # 因為 urlencode 會將空格轉成 +，所以直接自幹
+        url = urlunparse((url.scheme, url.netloc, url.path, '', '&'.join(f'{k}={v}' for k, v in params.items()), ''))
+
+        with span('driver_get'):
+            driver.get(url)
+        self.logger.info(f'Fetch {url} to get lastest result')
+        with span('wait'):
+            main = WebDriverWait(driver, 30).until(self.results_or_block(url))
+            items = WebDriverWait(driver, 30).until(EC.presence_of_all_elements_located((By.CLASS_NAME, "shopee-search-item-result__item")))
+        self.record_page_stats(driver)
+        return main, items
+
+    def results_or_block(self, url):
+        """等待搜尋結果出現，被導向驗證頁時立即失敗，不需要等到 timeout"""
+        results = EC.presence_of_element_located((By.CLASS_NAME, "shopee-search-item-result"))
+        def condition(driver):
+            if blocked_url_regex.search(driver.current_url):
+                raise BlockedError(url, 'captcha')
+            return results(driver)
+        return condition
+
+    def extract_item(self, item) -> ProductItem:
+        link_element = item.find_element(By.XPATH, "./a[@data-sqe='link']")
+        link = link_element.get_attribute("href")
+        img = link_element.find_element(By.XPATH, ".//img").get_attribute('src')
+        title = link_element.find_element(By.XPATH, './/div[@data-sqe="name"]').text
+        price = link_element.find_element(By.XPATH, './/div[@data-sqe="name"]/following-sibling::div').text
+        return ProductItem(self.unique_link(link), img, title, price, link)
+
+    def to_product_item(self, data: Dict) -> ProductItem:
+        return ProductItem(self.unique_link(data['link']), data['img'], data['title'], data['price'], data['link'])
+
+    def extract_items(self, driver, items=None) -> List[Optional[ProductItem]]:
+        """以單一 execute_script 取得所有 (或指定) 卡片，未載入的卡片為 None"""
+        return [self.to_product_item(data) if data else None for data in driver.execute_script(extract_items_script, items)]
+
+    def load_item(self, driver, item):
+        stale_retry = 0
+        while stale_retry < 10:
+            try:
+                e = item.find_element(By.CLASS_NAME, "shopee-image-placeholder")
+                ActionChains(driver).move_to_element(e).perform()
+            except StaleElementReferenceException:
+                stale_retry += 1
+                continue
+            except NoSuchElementException:
+                break
+        registry.inc('stale_retries_total', stale_retry)
+
+    def extract_one_by_one(self, driver, items) -> Iterator[ProductItem]:
+        for item in items:
+            self.load_item(driver, item)
+            yield self.extract_item(item)
+
+    def extract_lazily(self, driver, items) -> Iterator[ProductItem]:
+        """已經載入的卡片一次取得，未載入的卡片等讀到時才載入"""
+        with span('extract'):
+            infos = self.extract_items(driver, items)
+        for item, info in zip(items, infos):
+            if info is None:
+                self.load_item(driver, item)
+                info = self.extract_items(driver, [item])[0] or self.extract_item(item)
+            yield info
+
+    def page_fingerprint(self, driver) -> Optional[str]:
+        if self.cache is None:
+            return None
+        try:
+            return fingerprint(driver.execute_script(page_fingerprint_script).encode('utf-8'))
+        except Exception as e:
+            self.logger.debug(f'Failed to get page fingerprint: {e!r}')
+            return None
+
+    def cached_items(self, driver) -> Tuple[Optional[List[ProductItem]], Optional[str]]:
+        """頁面與上次相同時回傳上次的商品，不需要再捲動與抽取"""
+        digest = self.page_fingerprint(driver)
+        if digest is None:
+            return None, None
+        cached = self.cache.lookup(driver.current_url, digest)
+        if cached is None:
+            return None, digest
+        self.cache.hit(cached, cached.parse_cost)
+        self.logger.info(f'Page unchanged, reuse {len(cached.items)} items')
+        return list(cached.items), digest
+
+    def fetch_with_driver(self, driver, url, **args) -> List[ProductItem]:
+        main, items = self.load_page(driver, url, **args)
+        cached, digest = self.cached_items(driver)
+        if cached is not None:
+            return cached
+        start = time.perf_counter()
+        info = self.extract_page(driver, main, items)
+        if digest is not None:
+            self.cache.put(driver.current_url, CacheEntry(digest, info, 0, time.perf_counter() - start))
+        return info
+
+    def extract_page(self, driver, main, items) -> List[ProductItem]:
+        if self.lean and self.batch_extract:
+            # 不觸發圖片載入，直接讀取屬性
+            return list(self.extract_lazily(driver, items))
+
+        # make unload items loaded
+        stale_retry = 0
+        self.logger.info(f"Load {len(items)} Items")
+        with span('scroll'):
+            while stale_retry < 100:
+                try:
+                    e = main.find_element(By.CLASS_NAME, "shopee-image-placeholder")
+                    ActionChains(driver).move_to_element(e).perform()
+                except StaleElementReferenceException:
+                    stale_retry += 1
+                    continue
+                except NoSuchElementException:
+                    break
+        registry.inc('stale_retries_total', stale_retry)
+        if stale_retry >= 100: self.logger.error(f"Failed to load all items")
+
+        # get all items
+        self.logger.info(f'Loaded {len(items)} items')
+        with span('extract'):
+            if self.batch_extract:
+                return [item for item in self.extract_items(driver) if item]
+            return [self.extract_item(item) for item in items]
+
+    def iter_with_driver(self, driver, url, **args) -> Iterator[ProductItem]:
+        """只載入目前要讀取的商品，呼叫端停止迭代後就不再處理後面的商品"""
+        _, items = self.load_page(driver, url, **args)
+        cached, digest = self.cached_items(driver)
+        if cached is not None:
+            yield from cached
+            return
+        start, elapsed, info = time.perf_counter(), 0.0, []
+        extracted = self.extract_lazily(driver, items) if self.batch_extract else self.extract_one_by_one(driver, items)
+        for item in extracted:
+            elapsed += time.perf_counter() - start
+            info.append(item)
+            yield item
+            start = time.perf_counter()
+        # 完整讀完的頁面才放入 cache
+        if digest is not None:
+            self.cache.put(driver.current_url, CacheEntry(digest, info, 0, elapsed))
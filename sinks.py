@@ -0,0 +1,303 @@
+import csv
+import io
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from collections import deque
+from typing import Deque, Dict, Iterable, List, Optional
+from client import ProductItem
+from history import parse_item_id, parse_price
+from metrics import registry
+
+
+fields = ['ts', 'target', 'id', 'shop_id', 'item_id', 'title', 'price', 'price_cents', 'url', 'img_url', 'new']
+
+def to_record(target: str, item: ProductItem, new: bool, ts: float) -> Dict:
+    ids = parse_item_id(item.id)
+    return {
+        'ts': ts,
+        'target': target,
+        'id': item.id,
+        'shop_id': ids[0] if ids else None,
+        'item_id': ids[1] if ids else None,
+        'title': item.title,
+        'price': item.price,
+        'price_cents': parse_price(item.price),
+        'url': item.url,
+        'img_url': item.img_url,
+        'new': new,
+    }
+
+def unique_path(directory: str, prefix: str, extension: str) -> str:
+    """directory/prefix-<時間>.<extension>，同一秒內重複時加上編號"""
+    name = f"{prefix}-{time.strftime('%Y%m%d-%H%M%S')}"
+    path = os.path.join(directory, f'{name}.{extension}')
+    suffix = 1
+    while os.path.exists(path):
+        path = os.path.join(directory, f'{name}-{suffix}.{extension}')
+        suffix += 1
+    return path
+
+class Sink:
+    """匯出商品的目的地，write 只會在 SinkWriter 的 thread 中被呼叫"""
+
+    def __init__(self, name: str, logger: logging.Logger = logging.getLogger('sink')):
+        self.name = name
+        self.logger = logger
+
+    def write(self, records: List[Dict]):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+class RotatingFileSink(Sink):
+    """
+    寫入 directory/prefix-<時間>.<extension>，超過 max_bytes 或開啟超過 max_age 秒時換新檔案
+    """
+
+    extension = 'txt'
+
+    def __init__(self, directory: str, prefix: str = 'items', max_bytes: int = 64 * 1024 * 1024, max_age: float = 3600,
+                 logger: logging.Logger = logging.getLogger('sink')):
+        super().__init__(f'{self.extension}:{directory}', logger)
+        self.directory = directory
+        self.prefix = prefix
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.file: Optional[io.TextIOWrapper] = None
+        self.opened = 0.0
+        self.written = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def header(self) -> str:
+        return ''
+
+    def encode(self, records: List[Dict]) -> str:
+        raise NotImplementedError
+
+    def open(self):
+        path = unique_path(self.directory, self.prefix, self.extension)
+        self.file = open(path, 'w', encoding='utf-8', newline='')
+        self.opened = time.monotonic()
+        self.written = self.file.write(self.header())
+        self.logger.info(f'Export items to {path}')
+
+    def should_rotate(self) -> bool:
+        return self.written >= self.max_bytes or (self.max_age and time.monotonic() - self.opened >= self.max_age)
+
+    def write(self, records):
+        if self.file is None or self.should_rotate():
+            self.close()
+            self.open()
+        self.written += self.file.write(self.encode(records))
+        self.file.flush()
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+class JsonlSink(RotatingFileSink):
+
+    extension = 'jsonl'
+
+    def encode(self, records):
+        return ''.join(json.dumps(record, ensure_ascii=False) + '\n' for record in records)
+
+class CsvSink(RotatingFileSink):
+
+    extension = 'csv'
+
+    def header(self):
+        return ','.join(fields) + '\r\n'
+
+    def encode(self, records):
+        buffer = io.StringIO()
+        csv.DictWriter(buffer, fields).writerows(records)
+        return buffer.getvalue()
+
+class SqliteSink(Sink):
+    """寫入 SQLite 資料表，每批一次 commit"""
+
+    def __init__(self, filename: str, table: str = 'items', logger: logging.Logger = logging.getLogger('sink')):
+        super().__init__(f'sqlite:{filename}', logger)
+        self.table = table
+        self.conn = sqlite3.connect(filename, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute(
+            f'CREATE TABLE IF NOT EXISTS {table} ('
+            'ts REAL, target TEXT, id TEXT, shop_id INTEGER, item_id INTEGER, title TEXT, '
+            'price TEXT, price_cents INTEGER, url TEXT, img_url TEXT, new INTEGER)'
+        )
+        self.insert = f"INSERT INTO {table} VALUES ({', '.join('?' * len(fields))})"
+
+    def write(self, records):
+        with self.conn:
+            self.conn.executemany(self.insert, ([record[k] for k in fields] for record in records))
+
+    def close(self):
+        self.conn.close()
+
+class ParquetSink(Sink):
+    """
+    寫入 Parquet (需要安裝 pyarrow)，每個檔案最多 max_rows 筆或開啟 max_age 秒
+    每批資料寫成一個 row group
+    """
+
+    def __init__(self, directory: str, prefix: str = 'items', max_rows: int = 1000000, max_age: float = 3600,
+                 logger: logging.Logger = logging.getLogger('sink')):
+        super().__init__(f'parquet:{directory}', logger)
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise RuntimeError('Parquet sink requires pyarrow: pip install pyarrow')
+        self.pa = pyarrow
+        self.pq = pyarrow.parquet
+        self.schema = pyarrow.schema([
+            ('ts', pyarrow.float64()), ('target', pyarrow.string()), ('id', pyarrow.string()),
+            ('shop_id', pyarrow.int64()), ('item_id', pyarrow.int64()), ('title', pyarrow.string()),
+            ('price', pyarrow.string()), ('price_cents', pyarrow.int64()), ('url', pyarrow.string()),
+            ('img_url', pyarrow.string()), ('new', pyarrow.bool_()),
+        ])
+        self.directory = directory
+        self.prefix = prefix
+        self.max_rows = max_rows
+        self.max_age = max_age
+        self.writer = None
+        self.opened = 0.0
+        self.rows = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def write(self, records):
+        if self.writer is None or self.rows >= self.max_rows or time.monotonic() - self.opened >= self.max_age:
+            self.close()
+            path = unique_path(self.directory, self.prefix, 'parquet')
+            self.writer = self.pq.ParquetWriter(path, self.schema)
+            self.opened, self.rows = time.monotonic(), 0
+            self.logger.info(f'Export items to {path}')
+        self.writer.write_table(self.pa.Table.from_pylist(records, schema=self.schema))
+        self.rows += len(records)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+sink_kinds = {'jsonl': JsonlSink, 'csv': CsvSink, 'sqlite': SqliteSink, 'parquet': ParquetSink}
+
+def create_sink(cfg: Dict) -> Sink:
+    cfg = dict(cfg)
+    kind = cfg.pop('kind', 'jsonl')
+    if kind not in sink_kinds:
+        raise ValueError(f'Unknown sink kind: {kind}')
+    return sink_kinds[kind](**cfg)
+
+class SinkWriter:
+    """
+    以獨立的 thread 將商品批次寫入所有 Sink
+    累積 batch_size 筆或超過 flush_interval 秒寫入一次；
+    尚未寫入的資料超過 max_pending 筆時 put 會等待 (backpressure)，不會無限制地佔用記憶體
+    """
+
+    def __init__(self,
+                 sinks: List[Sink],
+                 batch_size: int = 500,
+                 flush_interval: float = 5,
+                 max_pending: int = 20000,
+                 logger: logging.Logger = logging.getLogger('sink')):
+        self.logger = logger
+        self.sinks = sinks
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.pending: Deque[Dict] = deque()
+        self.cond = threading.Condition()
+        self.stopping = False
+        self.written = 0
+        self.blocked_seconds = 0.0
+        self.thread = threading.Thread(target=self.run, name='sink-writer', daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def offer(self, records: List[Dict]) -> bool:
+        """不等待的 put，佇列已滿時回傳 False"""
+        with self.cond:
+            if len(self.pending) >= self.max_pending:
+                return False
+            self.enqueue(records)
+            return True
+
+    def put(self, records: List[Dict]):
+        with self.cond:
+            if len(self.pending) >= self.max_pending:
+                start = time.monotonic()
+                while len(self.pending) >= self.max_pending and not self.stopping:
+                    self.cond.wait()
+                waited = time.monotonic() - start
+                self.blocked_seconds += waited
+                registry.inc('sink_blocked_seconds_total', waited)
+            self.enqueue(records)
+
+    def enqueue(self, records: List[Dict]):
+        self.pending.extend(records)
+        registry.set('sink_pending_records', len(self.pending))
+        if len(self.pending) >= self.batch_size:
+            self.cond.notify_all()
+
+    def to_records(self, target: str, items: Iterable[ProductItem], new_ids: Iterable[str] = ()) -> List[Dict]:
+        ts = time.time()
+        new_ids = set(new_ids)
+        return [to_record(target, item, item.id in new_ids, ts) for item in items]
+
+    def run(self):
+        while True:
+            with self.cond:
+                deadline = time.monotonic() + self.flush_interval
+                while len(self.pending) < self.batch_size and not self.stopping:
+                    wait = deadline - time.monotonic()
+                    if wait <= 0:
+                        break
+                    self.cond.wait(wait)
+                if not self.pending:
+                    if self.stopping:
+                        return
+                    continue
+                count = min(len(self.pending), self.batch_size)
+                batch = [self.pending.popleft() for _ in range(count)]
+                registry.set('sink_pending_records', len(self.pending))
+                self.cond.notify_all()
+            self.write(batch)
+
+    def write(self, batch: List[Dict]):
+        for sink in self.sinks:
+            start = time.perf_counter()
+            try:
+                sink.write(batch)
+            except Exception as e:
+                registry.inc('sink_errors_total', sink=sink.name)
+                self.logger.error(f'Failed to write {len(batch)} records to {sink.name}: {e!r}')
+                continue
+            registry.observe('sink_write_seconds', time.perf_counter() - start, sink=sink.name)
+        self.written += len(batch)
+        registry.inc('sink_records_total', len(batch))
+
+    def report(self) -> Dict:
+        with self.cond:
+            return {'written': self.written, 'pending': len(self.pending), 'blocked_seconds': self.blocked_seconds}
+
+    def stop(self, timeout: Optional[float] = None):
+        """寫入剩下的資料後關閉所有 Sink"""
+        with self.cond:
+            self.stopping = True
+            self.cond.notify_all()
+        self.thread.join(timeout)
+        for sink in self.sinks:
+            sink.close()
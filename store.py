@@ -0,0 +1,197 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+from checkpoint import atomic_write
+
+
+class SeenStore:
+    """記錄已經通知過的商品 id，以 namespace (監控目標) 區分"""
+
+    def __init__(self, logger: logging.Logger = logging.getLogger('store')):
+        self.logger = logger
+
+    def contains(self, namespace: str, item_id: str) -> bool:
+        raise NotImplementedError
+
+    def add(self, namespace: str, item_id: str) -> bool:
+        """加入 id，若 id 先前不存在則回傳 True"""
+        raise NotImplementedError
+
+    def add_many(self, namespace: str, item_ids: Iterable[str]) -> int:
+        return sum(1 for item_id in item_ids if self.add(namespace, item_id))
+
+    def size(self, namespace: str = None) -> int:
+        raise NotImplementedError
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.flush()
+
+class MemorySeenStore(SeenStore):
+    """
+    記憶體內的 SeenStore，以 `namespace,id1,id2,...` 一行一個 namespace 存檔
+    相容舊版只有 `id1,id2,...` 的 state 檔 (視為 default namespace)
+    """
+
+    default_namespace = 'default'
+
+    def __init__(self, filename: str = None, logger: logging.Logger = logging.getLogger('store')):
+        super().__init__(logger)
+        self.filename = filename
+        self.mem: Dict[str, Set[str]] = {}
+        if filename and os.path.exists(filename):
+            self.load(filename)
+
+    def load(self, filename):
+        with open(filename, 'r') as f:
+            lines = f.read().splitlines()
+        if len(lines) == 1 and not lines[0].startswith('#'):
+            # 舊版格式
+            self.mem[self.default_namespace] = set(i for i in lines[0].split(',') if i)
+        else:
+            for line in lines:
+                if not line.startswith('#'):
+                    continue
+                namespace, _, ids = line[1:].partition(',')
+                self.mem[namespace] = set(i for i in ids.split(',') if i)
+        self.logger.info(f'Load {self.size()} from {filename}')
+
+    def save(self, filename):
+        data = ''.join(f"#{namespace},{','.join(ids)}\n" for namespace, ids in self.mem.items())
+        atomic_write(filename, data.encode('utf-8'))
+        self.logger.info(f'Save {self.size()} to {filename}')
+
+    def contains(self, namespace, item_id):
+        return item_id in self.mem.get(namespace, ())
+
+    def add(self, namespace, item_id):
+        ids = self.mem.setdefault(namespace, set())
+        if item_id in ids:
+            return False
+        ids.add(item_id)
+        return True
+
+    def size(self, namespace = None):
+        if namespace is not None:
+            return len(self.mem.get(namespace, ()))
+        return sum(len(ids) for ids in self.mem.values())
+
+    def flush(self):
+        if self.filename:
+            self.save(self.filename)
+
+class SqliteSeenStore(SeenStore):
+    """
+    以 SQLite 持久化的 SeenStore
+    - 啟動時將 id 載入記憶體，查詢為 O(1)
+    - 新增的 id 先暫存，累積 batch_size 筆或超過 flush_interval 秒才一次 commit (fsync)
+    - 超過 ttl 秒或每個 namespace 超過 max_size 筆的舊 id 會被移除
+    """
+
+    def __init__(self,
+                 filename: str,
+                 batch_size: int = 100,
+                 flush_interval: float = 5,
+                 ttl: Optional[float] = None,
+                 max_size: Optional[int] = None,
+                 logger: logging.Logger = logging.getLogger('store')):
+        super().__init__(logger)
+        self.filename = filename
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.ttl = ttl
+        self.max_size = max_size
+        self.lock = threading.RLock()
+        self.pending: List[Tuple[str, str, float]] = []
+        self.last_flush = time.monotonic()
+        # namespace -> {id: first_seen}，依 first_seen 排序 (dict 保留插入順序)
+        self.mem: Dict[str, Dict[str, float]] = {}
+        self.conn = sqlite3.connect(filename, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=FULL')
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS seen ('
+            'namespace TEXT NOT NULL, item_id TEXT NOT NULL, first_seen REAL NOT NULL, '
+            'PRIMARY KEY (namespace, item_id)) WITHOUT ROWID'
+        )
+        self.conn.execute('CREATE INDEX IF NOT EXISTS seen_first_seen ON seen (namespace, first_seen)')
+        self.conn.commit()
+        self.load()
+
+    def load(self):
+        start = time.perf_counter()
+        for namespace, item_id, first_seen in self.conn.execute('SELECT namespace, item_id, first_seen FROM seen ORDER BY first_seen'):
+            self.mem.setdefault(namespace, {})[item_id] = first_seen
+        self.logger.info(f'Load {self.size()} from {self.filename} in {time.perf_counter() - start:.3f}s')
+        self.evict()
+
+    def import_legacy(self, filename: str):
+        """匯入舊版 state 檔 (MemorySeenStore 格式)"""
+        legacy = MemorySeenStore(filename, self.logger)
+        for namespace, ids in legacy.mem.items():
+            self.add_many(namespace, ids)
+        self.flush()
+
+    def contains(self, namespace, item_id):
+        return item_id in self.mem.get(namespace, ())
+
+    def add(self, namespace, item_id):
+        with self.lock:
+            ids = self.mem.setdefault(namespace, {})
+            if item_id in ids:
+                return False
+            now = time.time()
+            ids[item_id] = now
+            self.pending.append((namespace, item_id, now))
+            if len(self.pending) >= self.batch_size or time.monotonic() - self.last_flush >= self.flush_interval:
+                self.flush()
+            return True
+
+    def size(self, namespace = None):
+        if namespace is not None:
+            return len(self.mem.get(namespace, ()))
+        return sum(len(ids) for ids in self.mem.values())
+
+    def evict(self):
+        """移除過期或超過數量上限的 id"""
+        if self.ttl is None and self.max_size is None:
+            return
+        with self.lock:
+            removed: List[Tuple[str, str]] = []
+            cutoff = time.time() - self.ttl if self.ttl is not None else None
+            for namespace, ids in self.mem.items():
+                overflow = len(ids) - self.max_size if self.max_size is not None else 0
+                expired = []
+                for item_id, first_seen in ids.items():
+                    if len(expired) < overflow or (cutoff is not None and first_seen < cutoff):
+                        expired.append(item_id)
+                    else:
+                        break
+                for item_id in expired:
+                    del ids[item_id]
+                removed.extend((namespace, item_id) for item_id in expired)
+            if removed:
+                self.conn.executemany('DELETE FROM seen WHERE namespace = ? AND item_id = ?', removed)
+                self.conn.commit()
+                self.logger.info(f'Evict {len(removed)} ids from {self.filename}')
+
+    def flush(self):
+        with self.lock:
+            self.last_flush = time.monotonic()
+            if not self.pending:
+                return
+            pending, self.pending = self.pending, []
+            self.conn.executemany('INSERT OR IGNORE INTO seen (namespace, item_id, first_seen) VALUES (?, ?, ?)', pending)
+            self.conn.commit()
+            self.logger.debug(f'Flush {len(pending)} ids to {self.filename}')
+        self.evict()
+
+    def close(self):
+        self.flush()
+        self.conn.close()
@@ -0,0 +1,83 @@
+import socketserver
+import threading
+
+from typing import List, Tuple
+
+
+class SmtpHandler(socketserver.StreamRequestHandler):
+    """只實作寄信需要的指令，不支援 STARTTLS 與登入"""
+
+    def reply(self, line: str):
+        self.wfile.write(f'{line}\r\n'.encode('ascii'))
+
+    def handle(self):
+        server = self.server
+        with server.lock:
+            server.connections += 1
+        self.reply('220 localhost stub')
+        sender, receivers = None, []
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode('utf-8', 'replace').strip()
+            verb = command[:4].upper()
+            if verb in ('EHLO', 'HELO'):
+                self.reply('250 localhost')
+            elif verb == 'MAIL':
+                if server.reject:
+                    self.reply('550 rejected')
+                    continue
+                sender, receivers = command.split(':', 1)[1].strip(' <>'), []
+                self.reply('250 OK')
+            elif verb == 'RCPT':
+                receivers.append(command.split(':', 1)[1].strip(' <>'))
+                self.reply('250 OK')
+            elif verb == 'DATA':
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+                data = []
+                for raw in self.rfile:
+                    if raw in (b'.\r\n', b'.\n'):
+                        break
+                    data.append(raw)
+                with server.lock:
+                    server.messages.append((sender, receivers, b''.join(data).decode('utf-8', 'replace')))
+                    drop = server.drop_after_message
+                self.reply('250 OK')
+                if drop:
+                    # 模擬伺服器關閉閒置的連線
+                    return
+            elif verb == 'RSET' or verb == 'NOOP':
+                self.reply('250 OK')
+            elif verb == 'QUIT':
+                self.reply('221 Bye')
+                return
+            else:
+                self.reply('502 not implemented')
+
+class SmtpStub(socketserver.ThreadingTCPServer):
+    """在本機背景執行的 SMTP server，記錄收到的信件"""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), SmtpHandler)
+        self.lock = threading.Lock()
+        self.messages: List[Tuple[str, List[str], str]] = []
+        self.connections = 0
+        self.reject = False
+        self.drop_after_message = False
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+
+    @property
+    def port(self) -> int:
+        return self.server_address[1]
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
+        self.server_close()
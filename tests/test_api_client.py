@@ -0,0 +1,43 @@
+import json
+
+from urllib.parse import unquote, urlparse
+
+from api_client import ApiClient
+from benchmarks.server import FixtureServer, fixtures_dir
+
+
+def test_search_items_are_mapped_to_product_items():
+    with open(f'{fixtures_dir}/search_items.json', encoding='utf-8') as f:
+        template = json.load(f)['items']
+    with FixtureServer(initial_items=9, new_per_poll=0) as server:
+        client = ApiClient(image_base='https://cf.shopee.tw/file/')
+        items = client.fetch(server.url('/bench-cat.1.2'))
+        client.close()
+    assert len(items) == 10
+    # 第一個商品是最新的 serial 9
+    item, basic = items[0], template[9 % len(template)]['item_basic']
+    shop_id, item_id = 10000000 + 9 % 7, 20000000009
+    assert item.id == f'-i.{shop_id}.{item_id}'
+    assert item.title.endswith('#9')
+
+    # 價格單位為 1/100000 元，區間以最低價與最高價表示
+    low, high = basic['price_min'] // 100000, basic['price_max'] // 100000
+    assert item.price == (f'${low:,}' if low == high else f'${low:,} - ${high:,}')
+
+    # 標題中的 `#` 不會讓 id 變成 fragment
+    link = urlparse(item.url)
+    assert link.fragment == '' and link.query == ''
+    assert unquote(link.path) == f'/{item.title}-i.{shop_id}.{item_id}'
+    assert client.unique_link(item.url) == item.id
+
+    assert item.img_url == f"https://cf.shopee.tw/file/{basic['image']}"
+
+def test_link_quotes_special_characters():
+    client = ApiClient()
+    entry = {'item_basic': {'shopid': 5, 'itemid': 7, 'name': 'iPad 9/10 保護殼 #現貨? 100%', 'price': 10000000}}
+    item = client.to_product_item(urlparse('https://shopee.tw/search?keyword=ipad'), entry)
+    client.close()
+    link = urlparse(item.url)
+    assert link.fragment == '' and link.query == ''
+    assert link.path.endswith('-i.5.7') and unquote(link.path) == '/iPad 9/10 保護殼 #現貨? 100%-i.5.7'
+    assert item.price == '$100' and item.img_url == ''
@@ -0,0 +1,40 @@
+import json
+import os
+
+from checkpoint import Checkpointer, atomic_write
+
+
+def test_atomic_write_replaces_file(tmp_path):
+    filename = str(tmp_path / 'state.bin')
+    atomic_write(filename, b'first')
+    atomic_write(filename, b'second')
+    with open(filename, 'rb') as f:
+        assert f.read() == b'second'
+    assert not os.path.exists(filename + '.tmp')
+
+def test_save_and_load(tmp_path):
+    filename = str(tmp_path / 'checkpoint.json')
+    saved, flushed = {'count': 3}, []
+    checkpointer = Checkpointer(filename)
+    checkpointer.register('state', lambda: saved, None)
+    checkpointer.on_save(lambda: flushed.append(True))
+    checkpointer.save()
+    assert flushed == [True]
+
+    restored = {}
+    loader = Checkpointer(filename)
+    loader.register('state', None, restored.update)
+    assert loader.load()
+    assert restored == {'count': 3}
+
+def test_ignores_missing_corrupt_and_old_checkpoints(tmp_path):
+    filename = str(tmp_path / 'checkpoint.json')
+    checkpointer = Checkpointer(filename)
+    checkpointer.register('state', None, lambda state: None)
+    assert not checkpointer.load()
+    with open(filename, 'w') as f:
+        f.write('{not json')
+    assert not checkpointer.load()
+    with open(filename, 'w') as f:
+        json.dump({'version': 0, 'state': {}}, f)
+    assert not checkpointer.load()
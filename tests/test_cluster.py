@@ -0,0 +1,104 @@
+import os
+import signal
+import threading
+import time
+
+import pytest
+
+from api_client import ApiClient
+from benchmarks.server import FixtureServer
+from client import BlockedError
+from cluster import QueueClient, QueueStopped, WorkerGroup, WorkQueue
+
+
+def test_claim_in_order_and_deliver_result(tmp_path):
+    queue = WorkQueue(str(tmp_path / 'queue.db'))
+    first, second = queue.put({'url': 'a'}), queue.put({'url': 'b'})
+    assert queue.claim('w0') == (first, {'url': 'a'})
+    assert queue.claim('w1') == (second, {'url': 'b'})
+    assert queue.claim('w2') is None
+    assert queue.take_result(first) is None
+    queue.complete(first, {'items': []})
+    queue.fail(second, 'boom')
+    assert queue.take_result(first) == ('done', {'items': []}, None)
+    assert queue.take_result(second) == ('failed', None, 'boom')
+    assert queue.counts() == {}
+
+def test_expired_lease_is_requeued_until_max_attempts(tmp_path):
+    queue = WorkQueue(str(tmp_path / 'queue.db'), lease=0.05, max_attempts=2)
+    job_id = queue.put({'url': 'a'})
+    assert queue.claim('w0')[0] == job_id
+    assert queue.claim('w1') is None
+    time.sleep(0.1)
+    # w0 當掉，lease 過期後由其他 worker 取得
+    assert queue.claim('w1')[0] == job_id
+    time.sleep(0.1)
+    assert queue.claim('w2') is None
+    state, _, error = queue.take_result(job_id)
+    assert state == 'failed' and 'lease expired' in error
+
+def serve_one(queue, handle):
+    def worker():
+        while True:
+            job = queue.claim('w0')
+            if job is not None:
+                handle(*job)
+                return
+            time.sleep(0.01)
+    thread = threading.Thread(target=worker)
+    thread.start()
+    return thread
+
+def test_queue_client_returns_worker_results(tmp_path):
+    queue = WorkQueue(str(tmp_path / 'queue.db'))
+    item = {'id': '-i.1.2', 'img_url': '', 'title': 'x', 'price': '$1', 'url': '', 'note': None}
+    thread = serve_one(queue, lambda job_id, payload: queue.complete(job_id, {'items': [item]}))
+    items = QueueClient(queue, poll_interval=0.01).fetch('https://shopee.tw/search', page=2)
+    thread.join()
+    assert [i.id for i in items] == ['-i.1.2']
+
+    blocked = BlockedError('https://shopee.tw/search', 'rate_limited', 30)
+    thread = serve_one(queue, lambda job_id, payload: queue.fail(job_id, blocked.to_error()))
+    with pytest.raises(BlockedError) as e:
+        QueueClient(queue, poll_interval=0.01).fetch('https://shopee.tw/search')
+    thread.join()
+    assert e.value.retry_after == 30
+
+def test_stop_aborts_waits_and_cancels_queued_jobs(tmp_path):
+    queue = WorkQueue(str(tmp_path / 'queue.db'))
+    client = QueueClient(queue, timeout=60, poll_interval=0.01)
+    errors = []
+
+    def fetch():
+        try:
+            client.fetch('https://shopee.tw/search')
+        except QueueStopped as e:
+            errors.append(e)
+    threads = [threading.Thread(target=fetch) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.1)
+    start = time.monotonic()
+    client.stop()
+    for thread in threads:
+        thread.join()
+    assert time.monotonic() - start < 2
+    assert len(errors) == 3
+    assert queue.counts() == {}
+
+def test_managed_workers_ignore_sigint(tmp_path):
+    queue_path = str(tmp_path / 'queue.db')
+    WorkQueue(queue_path)
+    with FixtureServer() as server:
+        group = WorkerGroup(queue_path, ApiClient, 1).start()
+        try:
+            client = QueueClient(WorkQueue(queue_path), timeout=30)
+            assert client.fetch(server.url('/bench-cat.1.1'))
+            os.kill(group.processes[0].pid, signal.SIGINT)
+            time.sleep(0.2)
+            # Ctrl+C 交給 coordinator 處理，worker 仍繼續處理 job
+            assert group.processes[0].is_alive()
+            assert client.fetch(server.url('/bench-cat.1.1'))
+        finally:
+            group.stop()
+    assert not group.processes[0].is_alive()
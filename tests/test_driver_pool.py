@@ -0,0 +1,69 @@
+import pytest
+
+from driver_pool import DriverPool
+
+
+class FakeDriver:
+
+    def __init__(self, healthy=True):
+        self.healthy = healthy
+        self.quit_called = False
+
+    def execute_script(self, script):
+        if not self.healthy:
+            raise RuntimeError('chrome not reachable')
+        return 1
+
+    def quit(self):
+        self.quit_called = True
+
+class Factory:
+
+    def __init__(self):
+        self.fail = False
+        self.drivers = []
+
+    def __call__(self):
+        if self.fail:
+            raise RuntimeError('chrome failed to start')
+        driver = FakeDriver()
+        self.drivers.append(driver)
+        return driver
+
+def test_failed_recycle_on_checkout_keeps_slot():
+    factory = Factory()
+    pool = DriverPool(factory, size=1)
+    factory.drivers[0].healthy = False
+    factory.fail = True
+    with pytest.raises(RuntimeError):
+        pool.acquire(timeout=1)
+    assert pool.idle.qsize() == 1
+    # chrome 恢復後下一次 checkout 會重新建立 driver
+    factory.fail = False
+    entry = pool.acquire(timeout=1)
+    assert entry.driver is factory.drivers[-1]
+    assert entry.driver.healthy
+    pool.release(entry)
+    assert pool.idle.qsize() == 1
+
+def test_failed_recycle_on_release_does_not_return_quit_driver():
+    factory = Factory()
+    pool = DriverPool(factory, size=1, max_failures=1)
+    entry = pool.acquire(timeout=1)
+    factory.fail = True
+    pool.release(entry, failed=True)
+    assert entry.driver.quit_called
+    assert pool.idle.qsize() == 1
+    factory.fail = False
+    replaced = pool.acquire(timeout=1)
+    assert replaced.driver is not entry.driver
+    assert not replaced.driver.quit_called
+
+def test_release_recycles_after_max_failures():
+    factory = Factory()
+    pool = DriverPool(factory, size=1, max_failures=2)
+    for _ in range(2):
+        entry = pool.acquire(timeout=1)
+        pool.release(entry, failed=True)
+    assert len(factory.drivers) == 2
+    assert pool.stats.recycles == 1
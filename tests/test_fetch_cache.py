@@ -0,0 +1,60 @@
+from api_client import ApiClient
+from benchmarks.server import FixtureServer
+from fetch_cache import CacheEntry, FetchCache
+
+
+def entry(digest):
+    return CacheEntry(digest, [], 0.1, 0.2)
+
+def test_lru_eviction():
+    cache = FetchCache(max_entries=2)
+    cache.put('a', entry('1'))
+    cache.put('b', entry('2'))
+    # 讀取 a 之後，最久沒用到的是 b
+    assert cache.get('a') is not None
+    cache.put('c', entry('3'))
+    assert cache.get('b') is None
+    assert cache.get('a') is not None and cache.get('c') is not None
+    assert cache.report()['size'] == 2
+
+def test_lookup_requires_same_fingerprint():
+    cache = FetchCache()
+    cache.put('a', entry('1'))
+    assert cache.lookup('a', '1') is not None
+    assert cache.lookup('a', '2') is None
+    assert cache.lookup('missing', '1') is None
+    assert cache.report()['misses'] == 2
+
+def fetch_twice(server, cache):
+    client = ApiClient(cache=cache)
+    try:
+        url = server.url('/bench-cat.1.3')
+        return client.fetch(url), client.fetch(url)
+    finally:
+        client.close()
+
+def test_etag_revalidation_reuses_items():
+    cache = FetchCache()
+    with FixtureServer(initial_items=20, new_per_poll=0, etag=True) as server:
+        first, second = fetch_twice(server, cache)
+    assert [i.id for i in second] == [i.id for i in first]
+    report = cache.report()
+    assert report['hits'] == 1 and report['not_modified'] == 1 and report['misses'] == 1
+    # 回傳的是複本，修改不影響 cache
+    second.clear()
+    assert len(next(iter(cache.entries.values())).items) == len(first)
+
+def test_fingerprint_hit_without_etag():
+    cache = FetchCache()
+    with FixtureServer(initial_items=20, new_per_poll=0, etag=False) as server:
+        first, second = fetch_twice(server, cache)
+    assert [i.id for i in second] == [i.id for i in first]
+    report = cache.report()
+    assert report['hits'] == 1 and report['not_modified'] == 0
+
+def test_changed_page_is_parsed_again():
+    cache = FetchCache()
+    with FixtureServer(initial_items=20, new_per_poll=1, etag=True) as server:
+        first, second = fetch_twice(server, cache)
+    assert second[0].id != first[0].id
+    assert cache.report()['hits'] == 0 and cache.report()['misses'] == 2
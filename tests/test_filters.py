@@ -0,0 +1,35 @@
+import pytest
+
+from client import ProductItem
+from filters import ItemFilter, Rule
+
+
+def item(title, price='$100', shop=1, serial=1):
+    return ProductItem(f'-i.{shop}.{serial}', '', title, price, '')
+
+@pytest.fixture
+def item_filter():
+    return ItemFilter.from_config({
+        'air': {'include': ['ipad air'], 'exclude': ['保護貼'], 'max_price': 20000},
+        'cheap': {'max_price': 500},
+        'pro': {'include': 'pro', 'regex': r'(128|256)\s*GB', 'shops_deny': [9]},
+    })
+
+def test_match(item_filter):
+    assert item_filter.match(item('Apple iPad Air 5', '$18,000')) == {'air'}
+    assert item_filter.match(item('Apple iPad Air 5 保護貼', '$300')) == {'cheap'}
+    assert item_filter.match(item('iPad Pro 256GB', '$30,000')) == {'pro'}
+    assert item_filter.match(item('iPad Pro 256GB', '$30,000', shop=9)) == set()
+
+def test_price_range_overlaps(item_filter):
+    assert 'cheap' in item_filter.match(item('case', '$400 - $900'))
+    assert 'cheap' not in item_filter.match(item('case', '$600 - $900'))
+
+def test_overlapping_keywords():
+    item_filter = ItemFilter([Rule('a', include=['ipad']), Rule('b', include=['ipad air'])])
+    assert item_filter.match(item('iPad Air')) == {'a', 'b'}
+
+def test_select_unknown_rule(item_filter):
+    with pytest.raises(KeyError):
+        item_filter.select([item('x')], ['missing'])
+    assert item_filter.select([item('ipad air', '$1')], 'air')
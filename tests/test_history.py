@@ -0,0 +1,74 @@
+from client import ProductItem
+from history import ItemHistory, parse_item_id, parse_price, parse_price_range
+
+
+def item(serial, price='$100'):
+    return ProductItem(f'-i.1.{serial}', '', f'item {serial}', price, '')
+
+def test_parse_helpers():
+    assert parse_price('$1,234') == 123400
+    assert parse_price_range('$100 - $200.5') == (10000, 20050)
+    assert parse_price('') is None
+    assert parse_item_id('https://shopee.tw/x-i.12.345?sp=1') == (12, 345)
+
+def test_evict_removes_only_ten_percent_on_ties():
+    history = ItemHistory(max_items=1000)
+    history.observe([item(i) for i in range(1000)], now=1000)
+    history.observe([item(1000)], now=1000)
+    assert history.size() == 901
+
+def test_evict_prefers_oldest():
+    history = ItemHistory(max_items=10)
+    history.observe([item(i) for i in range(5)], now=100)
+    history.observe([item(i) for i in range(5, 10)], now=200)
+    history.observe([item(10)], now=300)
+    assert history.size() == 10
+    # 最舊的 item 0 被淘汰，再次出現時視為第一次看到
+    assert history.observe([item(0, '$10')], now=400) == []
+
+def test_price_drop_and_relist():
+    history = ItemHistory(drop_threshold=0.1, relist_after=1000)
+    history.observe([item(1, '$100')], now=0)
+    assert history.observe([item(1, '$95')], now=10) == []
+    changed = history.observe([item(1, '$80')], now=20)
+    assert len(changed) == 1 and changed[0].note.startswith('降價')
+    changed = history.observe([item(1, '$80')], now=5000)
+    assert len(changed) == 1 and changed[0].note.startswith('重新上架')
+
+def test_save_and_load(tmp_path):
+    filename = str(tmp_path / 'history.bin')
+    history = ItemHistory(filename)
+    history.observe([item(i, f'${100 + i}') for i in range(20)], now=100)
+    history.close()
+    loaded = ItemHistory(filename)
+    assert loaded.size() == 20
+    changed = loaded.observe([item(3, '$10')], now=200)
+    assert changed[0].note.startswith('降價 $103')
+
+def test_price_drop_is_reported_to_every_namespace():
+    history = ItemHistory()
+    for namespace in ('a', 'b'):
+        history.observe([item(1, '$100')], namespace, now=0)
+    assert [c.note for c in history.observe([item(1, '$50')], 'a', now=10)] == ['降價 $100 -> $50']
+    assert [c.note for c in history.observe([item(1, '$50')], 'b', now=20)] == ['降價 $100 -> $50']
+    assert history.observe([item(1, '$50')], 'a', now=30) == []
+
+def test_save_and_load_keeps_namespaces(tmp_path):
+    filename = str(tmp_path / 'history.bin')
+    history = ItemHistory(filename)
+    history.observe([item(1, '$100')], 'https://shopee.tw/search?keyword=ipad', now=0)
+    history.observe([item(1, '$100')], '', now=0)
+    history.close()
+    loaded = ItemHistory(filename)
+    assert loaded.size() == 2
+    assert loaded.observe([item(1, '$10')], '', now=10)[0].note.startswith('降價')
+    assert loaded.observe([item(1, '$10')], 'https://shopee.tw/search?keyword=ipad', now=10)[0].note.startswith('降價')
+
+def test_evict_keeps_recently_seen_items():
+    history = ItemHistory(max_items=10)
+    history.observe([item(i) for i in range(10)], now=100)
+    # item 0 最早加入，但最近又看到，應該淘汰 item 1
+    history.observe([item(0)], now=200)
+    history.observe([item(10)], now=300)
+    assert history.observe([item(0, '$10')], now=400)[0].note.startswith('降價')
+    assert history.observe([item(1, '$10')], now=400) == []
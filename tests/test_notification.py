@@ -0,0 +1,110 @@
+import time
+
+import pytest
+
+from client import ProductItem
+from notification import Channel, EmailChannel, NotificationDispatcher, Notifier, SmtpEmail
+from smtp_stub import SmtpStub
+
+
+def item(serial):
+    return ProductItem(f'-i.1.{serial}', '', f'item {serial}', '$100', f'https://shopee.tw/x-i.1.{serial}')
+
+@pytest.fixture
+def smtp():
+    with SmtpStub() as server:
+        yield server
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError('timeout')
+        time.sleep(0.01)
+
+def test_smtp_email_reuses_connection(smtp):
+    email = SmtpEmail('127.0.0.1', smtp.port, '', '', timeout=5)
+    assert email.send('bot@example.com', ['a@example.com'], 'title', 'hello')
+    assert email.send('bot@example.com', ['b@example.com'], 'title', 'world')
+    email.close()
+    assert smtp.connections == 1
+    assert [receivers for _, receivers, _ in smtp.messages] == [['a@example.com'], ['b@example.com']]
+
+def test_smtp_email_reconnects_after_server_closes(smtp):
+    smtp.drop_after_message = True
+    email = SmtpEmail('127.0.0.1', smtp.port, '', '', timeout=5)
+    assert email.send('bot@example.com', ['a@example.com'], 'title', 'first')
+    assert email.send('bot@example.com', ['a@example.com'], 'title', 'second')
+    email.close()
+    assert len(smtp.messages) == 2
+    assert smtp.connections == 2
+
+def test_smtp_email_rejected(smtp):
+    smtp.reject = True
+    email = SmtpEmail('127.0.0.1', smtp.port, '', '', timeout=5)
+    assert not email.send('bot@example.com', ['a@example.com'], 'title', 'hello')
+    email.close()
+
+def test_dispatcher_merges_items_within_window(smtp):
+    channel = EmailChannel(SmtpEmail('127.0.0.1', smtp.port, '', '', timeout=5))
+    dispatcher = NotificationDispatcher(channel, window=0.2).start()
+    dispatcher.submit('a@example.com', [item(1)])
+    dispatcher.submit('a@example.com', [item(2)])
+    dispatcher.submit('b@example.com', [item(3)])
+    wait_for(lambda: dispatcher.sent == 2)
+    dispatcher.stop(5)
+    bodies = {receivers[0]: body for _, receivers, body in smtp.messages}
+    assert len(smtp.messages) == 2
+    assert 'a@example.com' in bodies and 'b@example.com' in bodies
+
+class FlakyChannel(Channel):
+
+    def __init__(self, failures):
+        super().__init__('flaky')
+        self.failures = failures
+        self.calls = []
+
+    def send(self, receiver, items):
+        self.calls.append((time.monotonic(), receiver, len(items)))
+        if self.failures > 0:
+            self.failures -= 1
+            return False
+        return True
+
+def test_dispatcher_retries_with_backoff():
+    channel = FlakyChannel(failures=2)
+    dispatcher = NotificationDispatcher(channel, window=0, base_delay=0.05, max_delay=1).start()
+    dispatcher.submit('a@example.com', [item(1)])
+    wait_for(lambda: dispatcher.sent == 1)
+    dispatcher.stop(5)
+    times = [t for t, _, _ in channel.calls]
+    assert len(times) == 3
+    assert times[2] - times[1] >= times[1] - times[0] >= 0.05
+    assert dispatcher.stats.retries == 2
+
+def test_dispatcher_gives_up_after_max_retries():
+    channel = FlakyChannel(failures=100)
+    dispatcher = NotificationDispatcher(channel, window=0, max_retries=1, base_delay=0.01).start()
+    dispatcher.submit('a@example.com', [item(1)])
+    wait_for(lambda: dispatcher.failed == 1)
+    dispatcher.stop(5)
+    assert len(channel.calls) == 2
+    assert dispatcher.pending() == {}
+
+def test_undelivered_on_stop_survives_checkpoint():
+    channel = FlakyChannel(failures=100)
+    notifier = Notifier([NotificationDispatcher(channel, window=60)]).start()
+    notifier.submit('a@example.com', [item(1), item(2)])
+    notifier.stop(5)
+    # 停止時不等待合併視窗，寄送失敗的商品保留在 checkpoint 中
+    assert len(channel.calls) == 1
+    state = notifier.snapshot()
+    assert [i['id'] for i in state['flaky']['a@example.com']] == ['-i.1.1', '-i.1.2']
+
+    retry = FlakyChannel(failures=0)
+    restored = Notifier([NotificationDispatcher(retry, window=0)])
+    restored.restore(state)
+    restored.start()
+    wait_for(lambda: restored.dispatchers['flaky'].sent == 1)
+    restored.stop(5)
+    assert retry.calls[0][1:] == ('a@example.com', 2)
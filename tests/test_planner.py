@@ -0,0 +1,30 @@
+from planner import QueryPlanner, canonical_url
+from scheduler import WatchTarget
+
+defaults = {'page': 0, 'sortBy': 'ctime'}
+
+
+def test_canonical_url():
+    expected = 'https://shopee.tw/search?keyword=ipad%20pro&sortBy=ctime'
+    assert canonical_url('https://Shopee.tw/search?keyword=ipad%20pro', defaults) == expected
+    assert canonical_url('https://shopee.tw/search/?sortBy=ctime&keyword=ipad pro&page=3', defaults) == expected
+    assert canonical_url('https://shopee.tw/search?keyword=ipad+pro', defaults) == expected
+    assert canonical_url('https://shopee.tw/search?keyword=ipad%20pro&sortBy=sales', defaults) != expected
+
+def test_plan_groups_targets_and_reports_dedup_ratio():
+    planner = QueryPlanner(defaults)
+    targets = [
+        WatchTarget('https://shopee.tw/search?keyword=a', 'x', interval=60, name='a'),
+        WatchTarget('https://shopee.tw/search?sortBy=ctime&keyword=a', 'y', interval=30, name='b'),
+        WatchTarget('https://shopee.tw/search?keyword=b', 'z', name='c'),
+    ]
+    listings = planner.plan(targets)
+    assert [len(listing.targets) for listing in listings] == [2, 1]
+    assert listings[0].interval == 30
+    # 沒有合併的目標沿用原本的名稱
+    assert listings[1].name == 'c'
+    for listing in listings:
+        planner.record(listing)
+    report = planner.report()
+    assert report['fetches'] == 2 and report['deliveries'] == 3
+    assert abs(report['dedup_ratio'] - 1 / 3) < 1e-9
@@ -0,0 +1,103 @@
+import threading
+import time
+
+import pytest
+
+from client import BaseClient, BlockedError
+from ratelimit import RateLimiter, RateLimitPolicy, Throttled, ThrottledClient, TokenBucket
+
+url = 'http://shopee.test/search'
+
+
+def limiter(**kwargs):
+    policy = dict(rate=1000, burst=5, backoff=0.2, max_backoff=10, jitter=0, ramp_step=2)
+    policy.update(kwargs)
+    return RateLimiter(RateLimitPolicy(**policy))
+
+def test_token_bucket_reserves_in_order():
+    bucket = TokenBucket(rate=10, burst=2)
+    now = bucket.updated
+    assert bucket.reserve(now) == 0
+    assert bucket.reserve(now) == 0
+    assert bucket.reserve(now) == pytest.approx(0.1)
+    assert bucket.reserve(now) == pytest.approx(0.2)
+
+def test_concurrent_blocks_escalate_once():
+    rate_limiter = limiter()
+    started = time.monotonic()
+    backoffs = [rate_limiter.blocked(url, 'rate_limited', None, started) for _ in range(4)]
+    assert backoffs[0] == pytest.approx(0.2)
+    assert all(b <= 0.2 for b in backoffs[1:])
+    assert rate_limiter.hosts['shopee.test'].consecutive == 1
+    assert rate_limiter.report()['shopee.test']['blocks'] == 4
+
+def test_failed_probe_escalates_and_success_ramps_up():
+    rate_limiter = limiter()
+    rate_limiter.blocked(url, 'rate_limited', None, time.monotonic())
+    with pytest.raises(Throttled):
+        rate_limiter.acquire(url)
+    time.sleep(0.21)
+    rate_limiter.acquire(url)
+    # 試探請求進行中，其他請求需要等待
+    with pytest.raises(Throttled):
+        rate_limiter.acquire(url)
+    started = time.monotonic()
+    assert rate_limiter.blocked(url, 'captcha', None, started) == pytest.approx(0.4)
+    time.sleep(0.41)
+    rate_limiter.acquire(url)
+    rate_limiter.success(url)
+    state = rate_limiter.hosts['shopee.test']
+    assert state.state == 'closed' and state.bucket.rate == 250
+    for _ in range(4):
+        rate_limiter.acquire(url)
+        rate_limiter.success(url)
+    assert state.bucket.rate == 1000
+
+def test_retry_after_is_honoured():
+    rate_limiter = limiter()
+    assert rate_limiter.blocked(url, 'rate_limited', 3, time.monotonic()) == pytest.approx(3)
+
+class BlockingClient(BaseClient):
+
+    def __init__(self):
+        super().__init__()
+        self.barrier = threading.Barrier(4)
+
+    def fetch(self, url, **args):
+        self.barrier.wait(timeout=5)
+        raise BlockedError(url, 'rate_limited')
+
+def test_throttled_client_reports_one_episode_for_parallel_blocks():
+    client = ThrottledClient(BlockingClient(), limiter())
+    errors = []
+
+    def fetch():
+        try:
+            client.fetch(url)
+        except Throttled as e:
+            errors.append(e)
+    threads = [threading.Thread(target=fetch) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(errors) == 4
+    assert all(isinstance(e.__cause__, BlockedError) for e in errors)
+    assert client.limiter.hosts['shopee.test'].consecutive == 1
+
+@pytest.mark.parametrize('block, reason', [('429', 'rate_limited'), ('captcha', 'captcha')])
+def test_api_client_detects_blocks_from_stub_server(block, reason):
+    pytest.importorskip('requests')
+    from api_client import ApiClient
+    from benchmarks.server import FixtureServer
+    with FixtureServer(max_rate=2, penalty=5, block=block) as server:
+        client = ApiClient()
+        target = server.url('/bench-cat.1.1')
+        assert len(client.fetch(target)) == 60
+        client.fetch(target)
+        with pytest.raises(BlockedError) as info:
+            client.fetch(target)
+        client.close()
+    assert info.value.reason == reason
+    if block == '429':
+        assert info.value.retry_after == 5
@@ -0,0 +1,254 @@
+import asyncio
+import threading
+
+from client import BaseClient, ProductItem
+from filters import ItemFilter
+from history import ItemHistory
+from planner import QueryPlanner
+from ratelimit import Throttled
+from scheduler import AdaptiveInterval, AdaptivePolicy, Watcher, WatchTarget
+from store import MemorySeenStore
+
+
+class FakeClient(BaseClient):
+    """依時間排序的列表: 第 0 頁是最新的 page_size 個商品"""
+
+    def __init__(self, count=100, page_size=20):
+        super().__init__()
+        self.count = count
+        self.page_size = page_size
+        self.prices = {}
+        self.fetches = 0
+
+    def fetch(self, url, page=0, **args):
+        self.fetches += 1
+        start = self.count - 1 - page * self.page_size
+        return [
+            ProductItem(f'-i.1.{serial}', '', f'item {serial}', self.prices.get(serial, '$100'), '')
+            for serial in range(start, max(start - self.page_size, -1), -1)
+        ]
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+def make_watcher(client, targets=None, **kwargs):
+    targets = targets or [WatchTarget('https://shopee.tw/search?keyword=a', 'a@example.com', name='a')]
+    notified = []
+    watcher = Watcher(client, MemorySeenStore(), targets, lambda target, items: notified.append((target.name, items)), **kwargs)
+    return watcher, notified
+
+async def start(watcher, init_pages=1):
+    watcher.semaphore = asyncio.Semaphore(watcher.concurrency)
+    watcher.init_semaphore = asyncio.Semaphore(watcher.init_parallelism)
+    watcher.stopped = asyncio.Event()
+    if init_pages:
+        await watcher.seed_all(init_pages)
+
+def test_history_sees_price_drop_deep_in_first_page():
+    client = FakeClient()
+    watcher, notified = make_watcher(client, history=ItemHistory(), max_pages=1)
+
+    async def scenario():
+        await start(watcher)
+        client.prices[85] = '$50'
+        await watcher.poll(watcher.listings[0])
+    run(scenario())
+    assert [(name, [i.id for i in items]) for name, items in notified] == [('a', ['-i.1.85'])]
+    assert notified[0][1][0].note.startswith('降價')
+
+def test_filter_matches_each_item_once_for_many_subscribers():
+    client = FakeClient()
+    item_filter = ItemFilter.from_config({'odd': {'regex': '[13579]$'}, 'all': {}})
+    calls = []
+    match = item_filter.match
+    item_filter.match = lambda item, names=None: calls.append(item.id) or match(item, names)
+    targets = [WatchTarget('https://shopee.tw/search?keyword=a', f'{i}@example.com', name=f't{i}', filter='odd' if i % 2 else 'all')
+               for i in range(50)]
+    watcher, notified = make_watcher(client, targets, item_filter=item_filter, planner=QueryPlanner(client.default_params))
+
+    async def scenario():
+        await start(watcher)
+        client.count += 10
+        await watcher.poll(watcher.listings[0])
+    run(scenario())
+    assert client.fetches == 2
+    assert len(calls) == 10
+    counts = {name: len(items) for name, items in notified}
+    assert counts['t0'] == 10 and counts['t1'] == 5
+
+def test_seed_stops_between_batches():
+    client = FakeClient(count=1000)
+    watcher, _ = make_watcher(client, init_parallelism=1)
+
+    async def scenario():
+        await start(watcher, init_pages=0)
+        loop = asyncio.get_running_loop()
+        fetch = client.fetch
+        def stop_after_first(url, **args):
+            loop.call_soon_threadsafe(watcher.stop)
+            return fetch(url, **args)
+        client.fetch = stop_after_first
+        await watcher.seed_all(10)
+    run(scenario())
+    assert client.fetches == 1
+    assert watcher.store.size() == 20
+
+def test_seed_waiting_for_throttled_host_returns_on_stop():
+    class ThrottledClient(FakeClient):
+        def fetch(self, url, **args):
+            self.fetches += 1
+            raise Throttled('shopee.tw', 1800)
+    client = ThrottledClient()
+    watcher, _ = make_watcher(client)
+
+    async def scenario():
+        await start(watcher, init_pages=0)
+        asyncio.get_running_loop().call_later(0.1, watcher.stop)
+        await asyncio.wait_for(watcher.seed_all(1), timeout=5)
+    run(scenario())
+    assert client.fetches == 1
+
+def test_new_subscriber_of_restored_listing_is_seeded():
+    client = FakeClient()
+    url = 'https://shopee.tw/search?keyword=a'
+    targets = [WatchTarget(url, 'a@example.com', name='a'), WatchTarget(url + '&sortBy=ctime', 'b@example.com', name='b')]
+    watcher, _ = make_watcher(client, targets[:2], planner=QueryPlanner(client.default_params))
+    run(start(watcher))
+    state = watcher.snapshot()
+
+    # 重新啟動時加入同一個列表的新目標
+    targets.append(WatchTarget(url + '&page=0', 'c@example.com', name='c'))
+    restarted, notified = make_watcher(client, targets, planner=QueryPlanner(client.default_params))
+    restarted.store = watcher.store
+    restarted.restore(state)
+
+    async def scenario():
+        await start(restarted)
+        client.count += 2
+        await restarted.poll(restarted.listings[0])
+    run(scenario())
+    assert restarted.store.size('c') > 0
+    assert {name: len(items) for name, items in notified} == {'a': 2, 'b': 2, 'c': 2}
+
+def test_store_writes_run_off_the_event_loop():
+    main_thread = threading.get_ident()
+    threads = []
+
+    class RecordingStore(MemorySeenStore):
+        def add(self, namespace, item_id):
+            threads.append(threading.get_ident())
+            return super().add(namespace, item_id)
+
+    client = FakeClient()
+    watcher, _ = make_watcher(client)
+    watcher.store = RecordingStore()
+
+    async def scenario():
+        await start(watcher)
+        client.count += 1
+        await watcher.poll(watcher.listings[0])
+    run(scenario())
+    assert threads and main_thread not in threads
+
+def test_adaptive_interval_keeps_interval_without_rate_sample():
+    policy = AdaptivePolicy(min_interval=10, max_interval=600, target_items=10, jitter=0)
+    interval = AdaptiveInterval(60, policy)
+    assert interval.success(5, None) == 60
+    # 60 秒 10 個新商品 -> 每秒 1/6 個，間隔 60 秒
+    assert interval.success(10, 60) == 60
+    # EWMA: 0.3 * 0 + 0.7 * 1/6
+    assert abs(interval.success(0, 60) - 10 / (0.7 / 6)) < 1e-9
+
+def test_subscribers_of_one_url_are_notified_separately():
+    url = 'https://shopee.tw/search?keyword=a'
+    for planner in (None, QueryPlanner()):
+        client = FakeClient()
+        targets = [WatchTarget(url, 'a@example.com'), WatchTarget(url, 'b@example.com')]
+        assert targets[0].name != targets[1].name
+        watcher, notified = make_watcher(client, targets, planner=planner)
+
+        async def scenario():
+            await start(watcher)
+            client.count += 5
+            for listing in watcher.listings:
+                await watcher.poll(listing)
+        run(scenario())
+        assert sorted((name.split(' | ')[1], len(items)) for name, items in notified) == [('a@example.com', 5), ('b@example.com', 5)]
+
+class ThrottledOnceClient(FakeClient):
+    def fetch(self, url, page=0, **args):
+        if self.fetches == 1:
+            self.fetches += 1
+            raise Throttled('shopee.tw', 1800)
+        return super().fetch(url, page, **args)
+
+def test_restore_after_backoff_keeps_base_interval():
+    for policy in (AdaptivePolicy(enabled=False), AdaptivePolicy(min_interval=10, max_interval=600)):
+        client = ThrottledOnceClient()
+        target = WatchTarget('https://shopee.tw/search?keyword=a', 'a@example.com', interval=60, name='a')
+        watcher, _ = make_watcher(client, [target], adaptive=policy)
+
+        async def scenario():
+            await start(watcher)
+            task = asyncio.create_task(watcher.watch(watcher.listings[0]))
+            while watcher.stats['a'].interval != 1800:
+                await asyncio.sleep(0.01)
+            watcher.stop()
+            await task
+        run(scenario())
+        state = watcher.snapshot()
+        assert state['a']['delay'] == 1800 and state['a']['interval'] == 60
+
+        restored, _ = make_watcher(FakeClient(), [target], adaptive=policy)
+        restored.restore(state)
+        assert restored.intervals['a'].interval == 60
+        # 重新啟動後仍然先等完剩下的退避時間
+        assert restored.stats['a'].interval == 1800
+        assert restored.intervals['a'].success(0, None) == 60
+
+        # 舊版 checkpoint 只有 interval (實際上是退避的等待時間)
+        restored, _ = make_watcher(FakeClient(), [target], adaptive=policy)
+        restored.restore({'a': {'interval': 1800}})
+        assert restored.intervals['a'].interval == (60 if not policy.enabled else 600)
+
+def test_price_drop_reaches_every_listing_with_the_item():
+    client = FakeClient()
+    targets = [WatchTarget('https://shopee.tw/search?keyword=a', 'a@example.com', name='a'),
+               WatchTarget('https://shopee.tw/search?keyword=b', 'b@example.com', name='b')]
+    watcher, notified = make_watcher(client, targets, history=ItemHistory(), max_pages=1)
+
+    async def scenario():
+        await start(watcher)
+        client.prices[90] = '$50'
+        for listing in watcher.listings:
+            await watcher.poll(listing)
+    run(scenario())
+    assert [(name, [i.note for i in items]) for name, items in notified] == [('a', ['降價 $100 -> $50']), ('b', ['降價 $100 -> $50'])]
+
+class RecordingSink:
+    def __init__(self):
+        self.records = []
+
+    def to_records(self, target, items, new_ids):
+        new_ids = set(new_ids)
+        return [(target, item.id, item.id in new_ids) for item in items]
+
+    def offer(self, records):
+        self.records.extend(records)
+        return True
+
+def test_merged_listing_is_exported_once_per_poll():
+    client = FakeClient()
+    sink = RecordingSink()
+    targets = [WatchTarget('https://shopee.tw/search?keyword=a', f'{i}@example.com', name=f't{i}') for i in range(3)]
+    watcher, _ = make_watcher(client, targets, sink=sink, planner=QueryPlanner(client.default_params), max_pages=1)
+
+    async def scenario():
+        await start(watcher)
+        client.count += 5
+        await watcher.poll(watcher.listings[0])
+    run(scenario())
+    # 5 個新商品與停止前的 3 個已知商品，只匯出一次
+    assert len(sink.records) == 8
+    assert len(set(item_id for _, item_id, _ in sink.records)) == 8
+    assert sum(new for _, _, new in sink.records) == 5
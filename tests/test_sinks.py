@@ -0,0 +1,98 @@
+import csv
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from client import ProductItem
+from sinks import CsvSink, JsonlSink, Sink, SinkWriter, SqliteSink, create_sink, to_record
+
+
+def records(count, start=0):
+    return [to_record('t', ProductItem(f'-i.1.{i}', '', f'item {i}', '$100', ''), i % 2 == 0, 0) for i in range(start, start + count)]
+
+def read_jsonl(directory):
+    files = sorted(os.listdir(directory))
+    return files, [json.loads(line) for name in files for line in open(os.path.join(directory, name), encoding='utf-8')]
+
+class RecordingSink(Sink):
+    def __init__(self, gate=None):
+        super().__init__('recording')
+        self.gate = gate
+        self.batches = []
+        self.closed = False
+
+    def write(self, records):
+        if self.gate is not None:
+            self.gate.wait()
+        self.batches.append(records)
+
+    def close(self):
+        self.closed = True
+
+def test_jsonl_rotates_by_size(tmp_path):
+    sink = JsonlSink(str(tmp_path), max_bytes=500, max_age=0)
+    for start in range(0, 20, 2):
+        sink.write(records(2, start))
+    sink.close()
+    files, rows = read_jsonl(str(tmp_path))
+    assert len(files) > 1
+    # 同一秒內換檔的檔名會加上編號，不依檔名排序
+    assert sorted(row['item_id'] for row in rows) == list(range(20))
+    assert rows[0]['shop_id'] == 1 and rows[0]['price_cents'] == 10000
+
+def test_csv_rotates_by_age_and_repeats_header(tmp_path):
+    sink = create_sink({'kind': 'csv', 'directory': str(tmp_path), 'max_age': 0.05})
+    assert isinstance(sink, CsvSink)
+    sink.write(records(2))
+    time.sleep(0.1)
+    sink.write(records(2, 2))
+    sink.close()
+    files = sorted(os.listdir(str(tmp_path)))
+    assert len(files) == 2
+    for name in files:
+        with open(os.path.join(str(tmp_path), name), newline='', encoding='utf-8') as f:
+            assert len(list(csv.DictReader(f))) == 2
+
+def test_sqlite_sink(tmp_path):
+    filename = str(tmp_path / 'export.db')
+    sink = SqliteSink(filename)
+    sink.write(records(3))
+    sink.close()
+    with sqlite3.connect(filename) as conn:
+        assert conn.execute('SELECT COUNT(*), SUM(new) FROM items').fetchone() == (3, 2)
+
+def test_offer_fails_and_put_waits_when_full():
+    gate = threading.Event()
+    sink = RecordingSink(gate)
+    writer = SinkWriter([sink], batch_size=5, flush_interval=60, max_pending=10).start()
+    # 第一批被 sink 卡住，佇列再放滿 10 筆
+    assert writer.offer(records(5))
+    while writer.report()['pending']:
+        time.sleep(0.01)
+    assert writer.offer(records(10, 5))
+    assert not writer.offer(records(1, 15))
+
+    done = threading.Event()
+    thread = threading.Thread(target=lambda: (writer.put(records(1, 15)), done.set()))
+    thread.start()
+    assert not done.wait(0.2)
+    gate.set()
+    assert done.wait(5)
+    thread.join()
+    writer.stop()
+    assert writer.report()['blocked_seconds'] >= 0.2
+    assert [r['id'] for batch in sink.batches for r in batch] == [f'-i.1.{i}' for i in range(16)]
+
+def test_stop_flushes_pending_records_and_closes_sinks(tmp_path):
+    sink = JsonlSink(str(tmp_path))
+    recording = RecordingSink()
+    writer = SinkWriter([sink, recording], batch_size=1000, flush_interval=60).start()
+    assert writer.offer(records(3))
+    writer.stop(timeout=5)
+    assert not writer.thread.is_alive()
+    assert recording.closed and sink.file is None
+    _, rows = read_jsonl(str(tmp_path))
+    assert len(rows) == 3
+    assert writer.report() == {'written': 3, 'pending': 0, 'blocked_seconds': 0.0}
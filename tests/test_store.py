@@ -0,0 +1,22 @@
+from store import MemorySeenStore, SqliteSeenStore
+
+
+def test_memory_store_persists(tmp_path):
+    filename = str(tmp_path / 'seen.json')
+    store = MemorySeenStore(filename)
+    assert store.add('a', '-i.1.1')
+    assert not store.add('a', '-i.1.1')
+    assert store.add('b', '-i.1.1')
+    store.close()
+    loaded = MemorySeenStore(filename)
+    assert loaded.contains('a', '-i.1.1') and loaded.size() == 2
+
+def test_sqlite_store_persists(tmp_path):
+    filename = str(tmp_path / 'seen.db')
+    store = SqliteSeenStore(filename)
+    assert store.add_many('a', ['-i.1.1', '-i.1.2', '-i.1.1']) == 2
+    store.close()
+    loaded = SqliteSeenStore(filename)
+    assert loaded.contains('a', '-i.1.2') and not loaded.contains('b', '-i.1.2')
+    assert loaded.size('a') == 2
+    loaded.close()
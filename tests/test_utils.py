@@ -0,0 +1,32 @@
+from urllib.error import HTTPError, URLError
+
+import pytest
+
+import utils
+
+
+def fake_get(responses):
+    def http_get(url, timeout=30):
+        for prefix, response in responses.items():
+            if url.startswith(utils.chromedriver_base_url + prefix):
+                if isinstance(response, Exception):
+                    raise response
+                return response
+        raise AssertionError(url)
+    return http_get
+
+def test_find_driver_version_falls_back_to_major_release(monkeypatch):
+    monkeypatch.setattr(utils, 'http_get', fake_get({'?delimiter': b'<ListBucketResult/>', 'LATEST_RELEASE_108': b'108.0.5359.71\n'}))
+    assert utils.find_driver_version('108.0.5359.124') == '108.0.5359.71'
+
+def test_missing_driver_release_explains_what_to_do(monkeypatch):
+    not_found = HTTPError(utils.chromedriver_base_url + 'LATEST_RELEASE_200', 404, 'Not Found', {}, None)
+    monkeypatch.setattr(utils, 'http_get', fake_get({'?delimiter': b'<ListBucketResult/>', 'LATEST_RELEASE_200': not_found}))
+    with pytest.raises(RuntimeError, match='chromedriver.chromium.org') as e:
+        utils.find_driver_version('200.0.1.2')
+    assert 'Chrome 200.0.1.2' in str(e.value)
+
+def test_offline_driver_lookup_explains_what_to_do(monkeypatch):
+    monkeypatch.setattr(utils, 'http_get', fake_get({'?delimiter': URLError('no network')}))
+    with pytest.raises(RuntimeError, match='no network'):
+        utils.find_driver_version('108.0.5359.124')
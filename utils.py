@@ -1,12 +1,15 @@
+import json
+import logging
 import os
-import io
 import re
-import sys
+import shutil
+from platform import machine
 from sys import platform
+from typing import Optional
+from urllib.error import HTTPError, URLError
+from urllib.request import urlopen
 
-import zipfile
-import xml.etree.ElementTree as ET
-import requests
+from checkpoint import atomic_write
 
 # code from `https://gist.github.com/primaryobjects/d5346bf7a173dbded1a70375ff7461b4`
 def extract_version_registry(output):
@@ -29,7 +32,7 @@ def extract_version_folder():
             paths = [f.path for f in os.scandir(path) if f.is_dir()]
             for path in paths:
                 filename = os.path.basename(path)
-                pattern = '\d+\.\d+\.\d+\.\d+'
+                pattern = r'\d+\.\d+\.\d+\.\d+'
                 match = re.search(pattern, filename)
                 if match and match.group():
                     # Found a Chrome version.
@@ -42,12 +45,9 @@ def detect_chrome_version():
     install_path = None
 
     try:
-        if platform == "linux" or platform == "linux2":
-            # linux
-            install_path = "/usr/bin/google-chrome"
-        elif platform == "darwin":
-            # OS X
-            install_path = "/Applications/Google\ Chrome.app/Contents/MacOS/Google\ Chrome"
+        if platform in ("linux", "linux2", "darwin"):
+            # linux / OS X
+            install_path = find_chrome()
         elif platform == "win32":
             # Windows...
             try:
@@ -61,123 +61,116 @@ def detect_chrome_version():
     except Exception as ex:
         print(ex)
 
-    version = os.popen(f"{install_path} --version").read().strip('Google Chrome ').strip() if install_path else version
+    if install_path:
+        # `Google Chrome 108.0.5359.124` 或 `Chromium 108.0.5359.124`
+        match = re.search(r'\d+\.\d+\.\d+\.\d+', os.popen(f'"{install_path}" --version').read())
+        version = match.group(0) if match else None
 
     return version
 # ---
 
 chromedriver_base_url = 'https://chromedriver.storage.googleapis.com/'
-def download_chrome_driver(dst_dir, filename):
-    def get_all_version():
-        index_url = f'{chromedriver_base_url}?delimiter=/&prefix='
-        response = requests.get(index_url)
-        if response.status_code == 200:
-            xml = ET.fromstring(response.text)
-            return [child[0].text.strip('/') for child in xml if 'CommonPrefixes' in child.tag and child[0].text != 'icons/']
-        else:
-            return None
-
-    def extract_major_version(version):
-        return version.split('.')[0]
-
-    def list_all_files(version):
-        index_url = f'{chromedriver_base_url}?delimiter=/&prefix={version}/'
-        response = requests.get(index_url)
-        if response.status_code == 200:
-            xml = ET.fromstring(response.text)
-            res = []
-            for child in xml:
-                if 'Contents' in child.tag and '.zip' in child[0].text:
-                    res.append({
-                        'filename': child[0].text[child[0].text.rindex('/') + 1:],
-                        'uri': child[0].text,
-                    })
-            return res
-        else:
-            return None
-
-    current_version = detect_chrome_version()
-    versions = get_all_version()
-
-    # 如果有版本直接命中，直接選擇該版本
-    choose_version = None
-    for version in versions:
-        if version == current_version:
-            choose_version = version
-            break
-
-    # 如果沒有版本直接命中，則挑選與當前 major version 相同的版本
-    if not choose_version:
-        compatible_versions = []
-        current_major_version = extract_major_version(current_version)
-        for version in versions:
-            if extract_major_version(version) == current_major_version:
-                compatible_versions.append(version)
-        
-        # 還找不到的話就直接結束
-        if len(compatible_versions) == 0:
-            print('找不到合適的 Chrome Driver 版本')
-            print('請至 `https://chromedriver.chromium.org/downloads` 下載')
-            print('解壓縮後放置於`config.yaml`裡所設定的`chrome_driver`相同的資料夾')
-            sys.exit(1)
-        elif len(compatible_versions) == 1:
-            choose_version = compatible_versions[0]
-        else:
-            # 選擇版本
-            while not choose_version:
-                print('已為您找到合適的 Chrome Driver 版本')
-                print(f'目前版本為: {current_version}')
-                print('--------------------------------')
-                print('請選擇下列版本之一:')
-                for i, version in enumerate(compatible_versions):
-                    print(f'{i}. {version}')
-                print('--------------------------------')
-                choose_index = int(input(f'請輸入編號[0 ~ {len(compatible_versions) - 1}]: ').strip())
-
-                if 0 <= choose_index < len(compatible_versions):
-                    choose_version = compatible_versions[choose_index]
-                else:
-                    print('輸入錯誤，請重新輸入')
-
-    # 列出所有可用檔案
-    files = list_all_files(choose_version)
-    # 若資料夾內無檔案，則直接結束
-    if not files:
-        print('此資料夾無可用檔案')
-        print('請至 `https://chromedriver.chromium.org/downloads` 下載')
-        print('解壓縮後放置於`config.yaml`裡所設定的`chrome_driver`相同的資料夾')
-        sys.exit(1)
-        
-    # 選擇與作業系統相符之檔案
-    choose_file = None
-    while not choose_file:
-        print('請依照作業系統選擇下列檔案之一:')
-        print('--------------------------------')
-        for i, file in enumerate(files):
-            print(f'{i}. {file["filename"]}')
-        print('--------------------------------')
-        choose_index = int(input(f'請輸入編號[0 ~ {len(files) - 1}]: ').strip())
-        if 0 <= choose_index < len(files):
-            choose_file = files[choose_index]['uri']
-        else:
-            print('輸入錯誤，請重新輸入')
-
-    # 下載所選擇之檔案
-    download_url = f"{chromedriver_base_url}{choose_file}"
-    print(f'downloading chrome driver version {choose_version} from {download_url}')
-    response = requests.get(download_url, timeout=600)
-    if response.status_code == 200:
-        # extract the zip file
-        with zipfile.ZipFile(io.BytesIO(response.content), 'r') as zip_ref:
-            zip_ref.extractall(dst_dir)
-        # rename the file 
-        if platform == 'win32': 
-            # add extension if not exists
-            if not filename.endswith('.exe'): 
-                filename += '.exe'
-            os.rename(os.path.join(dst_dir, 'chromedriver.exe'), os.path.join(dst_dir, filename))
-        else: 
-            os.rename(os.path.join(dst_dir, 'chromedriver'), os.path.join(dst_dir, filename))
-        print('download success')
-    else:
-        print('download failed')
+
+def find_chrome() -> Optional[str]:
+    """Chrome 執行檔的路徑，找不到時回傳 None"""
+    if platform == 'darwin':
+        path = '/Applications/Google Chrome.app/Contents/MacOS/Google Chrome'
+        return path if os.path.exists(path) else None
+    if platform == 'win32':
+        for base in ('C:\\Program Files', 'C:\\Program Files (x86)'):
+            path = os.path.join(base, 'Google', 'Chrome', 'Application', 'chrome.exe')
+            if os.path.exists(path):
+                return path
+        return None
+    for name in ('google-chrome', 'google-chrome-stable', 'chromium', 'chromium-browser'):
+        path = shutil.which(name)
+        if path:
+            return os.path.realpath(path)
+    return None
+
+def driver_platform() -> str:
+    """chromedriver 壓縮檔名稱中的平台"""
+    if platform == 'win32':
+        return 'win32'
+    if platform == 'darwin':
+        return 'mac_arm64' if machine() == 'arm64' else 'mac64'
+    return 'linux64'
+
+def http_get(url: str, timeout: float = 30) -> bytes:
+    with urlopen(url, timeout=timeout) as response:
+        return response.read()
+
+driver_download_help = '請至 `https://chromedriver.chromium.org/downloads` 下載，解壓縮後在 `config.yaml` 的 `chrome_driver` 設定其路徑'
+
+def find_driver_version(chrome_version: str) -> str:
+    """與 Chrome 版本相同的 chromedriver，沒有的話使用同一個 major version 的最新版"""
+    prefix = f'{chrome_version}/'
+    major = chrome_version.split('.')[0]
+    try:
+        index = http_get(f'{chromedriver_base_url}?delimiter=/&prefix={prefix}')
+        # 只列出該版本的資料夾，不需要下載整個 bucket 的索引
+        if f'<Key>{prefix}'.encode() in index:
+            return chrome_version
+        return http_get(f'{chromedriver_base_url}LATEST_RELEASE_{major}').decode().strip()
+    except HTTPError as e:
+        if e.code != 404:
+            raise RuntimeError(f'無法取得 Chrome Driver 版本 ({e})，{driver_download_help}') from e
+        raise RuntimeError(f'找不到 Chrome {chrome_version} 適用的 Chrome Driver (major version {major})，{driver_download_help}') from e
+    except URLError as e:
+        raise RuntimeError(f'無法連線取得 Chrome Driver 版本 ({e.reason})，{driver_download_help}') from e
+
+def download_chrome_driver(version: str, dst_dir: str) -> str:
+    """下載並解壓縮指定版本的 chromedriver，回傳執行檔路徑"""
+    import io
+    import zipfile
+
+    url = f'{chromedriver_base_url}{version}/chromedriver_{driver_platform()}.zip'
+    logging.getLogger('utils').info(f'Download chrome driver {version} from {url}')
+    try:
+        data = http_get(url, timeout=600)
+    except (HTTPError, URLError) as e:
+        raise RuntimeError(f'無法下載 Chrome Driver {version} ({e})，{driver_download_help}') from e
+    with zipfile.ZipFile(io.BytesIO(data), 'r') as zip_ref:
+        zip_ref.extractall(dst_dir)
+    path = os.path.join(dst_dir, 'chromedriver.exe' if platform == 'win32' else 'chromedriver')
+    os.chmod(path, 0o755)
+    return path
+
+def resolve_chrome_driver(chrome_driver: str, cache_dir: str = '.cache/chromedriver') -> str:
+    """
+    回傳要使用的 chromedriver 路徑，不需要互動
+    - chrome_driver 已存在時直接使用
+    - 否則依照 Chrome 版本下載對應的 chromedriver 到 cache_dir
+      解析結果記錄在 cache_dir/resolution.json，Chrome 沒有更新的話下次啟動不需要再偵測版本或連網
+    """
+    logger = logging.getLogger('utils')
+    if os.path.exists(chrome_driver):
+        return chrome_driver
+    chrome = find_chrome()
+    chrome_mtime = os.path.getmtime(chrome) if chrome else None
+    resolution_file = os.path.join(cache_dir, 'resolution.json')
+    try:
+        with open(resolution_file, 'r') as f:
+            cached = json.load(f)
+        if cached['chrome'] == chrome and cached['chrome_mtime'] == chrome_mtime and os.path.exists(cached['driver']):
+            logger.info(f"Use cached chrome driver {cached['driver_version']} for chrome {cached['chrome_version']}")
+            return cached['driver']
+    except (OSError, ValueError, KeyError):
+        pass
+
+    chrome_version = detect_chrome_version()
+    if not chrome_version:
+        raise RuntimeError('找不到 Chrome，請安裝 Chrome 或在 `config.yaml` 的 `chrome_driver` 設定 chromedriver 路徑')
+    driver_version = find_driver_version(chrome_version)
+    dst_dir = os.path.join(cache_dir, driver_version)
+    driver = os.path.join(dst_dir, 'chromedriver.exe' if platform == 'win32' else 'chromedriver')
+    if not os.path.exists(driver):
+        os.makedirs(dst_dir, exist_ok=True)
+        driver = download_chrome_driver(driver_version, dst_dir)
+    resolution = {
+        'chrome': chrome, 'chrome_mtime': chrome_mtime, 'chrome_version': chrome_version,
+        'driver_version': driver_version, 'driver': driver,
+    }
+    atomic_write(resolution_file, json.dumps(resolution).encode('utf-8'))
+    logger.info(f'Use chrome driver {driver_version} for chrome {chrome_version}')
+    return driver